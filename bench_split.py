@@ -0,0 +1,283 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tracemalloc
+from datetime import datetime
+
+import split_sentences
+
+# 默认基线文件
+BASELINE_FILE = 'bench_baseline.json'
+
+# 合成语料使用的词汇
+SUBJECTS = ['发动机', '主减速器', '尾桨', '燃油泵', '液压系统', '滑油滤', '起落架', '旋翼桨叶',
+            '自动驾驶仪', '大气数据计算机', '惯导系统', '点火装置', '防冰活门', '蓄电池']
+ACTIONS = ['拆下', '安装', '检查', '清洗', '更换', '校准', '紧固', '润滑', '测量', '复位']
+OBJECTS = ['固定螺栓', '密封圈', '保险丝', '电缆插头', '滤芯', '传感器', '作动筒', '管路接头',
+           '锁紧垫片', '安装支架']
+CONDITIONS = ['在发动机冷却后', '断开电源后', '按照力矩要求', '使用专用工具', '在地面慢车状态下',
+              '确认无渗漏后', '参照维护手册']
+RESULTS = ['确保工作正常', '记录测量数值', '检查是否有裂纹', '确认指示灯熄灭', '防止异物进入']
+ENDINGS = ['。', '。', '。', '！', '？', '；']
+
+MENU_SECTIONS = ['文件', '编辑', '视图', '插入', '格式', '工具', '窗口']
+MENU_ACTIONS = ['新建', '打开', '保存', '关闭', '复制', '粘贴', '剪切', '撤销', '重做', '查找',
+                '替换', '全选', '打印', '放大', '缩小']
+KEYS = [chr(c) for c in range(ord('A'), ord('Z') + 1)] + [f'F{i}' for i in range(1, 13)]
+MODIFIERS = ['CTRL+', 'ALT+', 'SHIFT+', 'CTRL+SHIFT+']
+
+TERMS = ['abort', 'aileron', 'airspeed', 'altimeter', 'anemometer', 'autopilot', 'bank', 'bleed',
+         'canopy', 'cowling', 'datum', 'elevator', 'flap', 'fuselage', 'gimbal', 'glideslope',
+         'hover', 'inlet', 'nacelle', 'pitch', 'rotor', 'rudder', 'spar', 'stall', 'strut',
+         'throttle', 'torque', 'trim', 'turbine', 'yaw']
+DEFINITIONS = ['中止', '副翼', '空速', '高度表', '风速计', '自动驾驶仪', '坡度', '引气', '座舱盖',
+               '整流罩', '基准面', '升降舵', '襟翼', '机身', '万向节', '下滑道', '悬停', '进气口',
+               '短舱', '俯仰', '旋翼', '方向舵', '翼梁', '失速', '支柱', '油门', '扭矩', '配平',
+               '涡轮', '偏航']
+PARTS_OF_SPEECH = ['名词 n.', '形容词 a.', '动词 v.', '固定词组 ph.']
+
+ARROWS = ['Up Arrow', 'Down Arrow', 'Left Arrow', 'Right Arrow']
+GUIDE_MODIFIERS = ['Ctrl -', 'Alt -', 'Shift -']
+GUIDE_SECTIONS = ['移动', '选择', '视图控制', '航图操作', '组合键', '小键盘']
+
+def fill_to_size(make_block, rng, size):
+    """重复生成文本块直到UTF-8编码后达到size字节"""
+    blocks = []
+    total = 0
+    while total < size:
+        block = make_block(rng)
+        blocks.append(block)
+        total += len(block.encode('utf-8'))
+    return ''.join(blocks)
+
+def make_normal_block(rng):
+    """一段航空维修说明文字"""
+    sentences = []
+    for _ in range(rng.randint(2, 6)):
+        sentence = (f"{rng.choice(CONDITIONS)}，{rng.choice(ACTIONS)}{rng.choice(SUBJECTS)}的"
+                    f"{rng.choice(OBJECTS)}，{rng.choice(RESULTS)}")
+        if rng.random() < 0.2:
+            sentence += f"（力矩{rng.randint(5, 90)}N·m）"
+        sentences.append(sentence + rng.choice(ENDINGS))
+    return ''.join(sentences) + '\n\n'
+
+def make_table_block(rng):
+    """一个extract_text.py格式的表格"""
+    lines = [split_sentences.TABLE_START]
+    number = 1
+    for _ in range(rng.randint(2, 8)):
+        cells = []
+        for _ in range(rng.randint(2, 4)):
+            cells.append(f"{number}. {rng.choice(ACTIONS)}{rng.choice(OBJECTS)}")
+            number += 1
+        lines.append(' | '.join(cells))
+    lines.append(split_sentences.TABLE_END)
+    return '\n'.join(lines) + '\n\n'
+
+def make_command_block(rng):
+    """一组菜单快捷键列表"""
+    lines = [f"{rng.choice(MENU_SECTIONS)}指令："]
+    for _ in range(rng.randint(3, 10)):
+        action = rng.choice(MENU_ACTIONS)
+        if rng.random() < 0.2:
+            lines.append(f"{action} ({rng.choice(KEYS)}键)")
+        else:
+            lines.append(f"{action} {rng.choice(MODIFIERS)}{rng.choice(KEYS)}")
+    return '\n'.join(lines) + '\n\n'
+
+def make_dictionary_block(rng):
+    """一个带音标的词典条目"""
+    index = rng.randrange(len(TERMS))
+    term = TERMS[index]
+    line = f"{term} {rng.choice(PARTS_OF_SPEECH)} {DEFINITIONS[index]}"
+    if rng.random() < 0.6:
+        line += f" 英音：[{term}]美音：[{term}]"
+    return line + '\n\n'
+
+def make_operation_block(rng):
+    """一段英文按键的操作指南"""
+    lines = [f"{rng.choice(GUIDE_SECTIONS)}："]
+    for _ in range(rng.randint(3, 8)):
+        choice = rng.random()
+        if choice < 0.4:
+            lines.append(f"{rng.choice(ARROWS)} {rng.choice(MENU_ACTIONS)}")
+        elif choice < 0.8:
+            lines.append(f"{rng.choice(GUIDE_MODIFIERS)} {rng.choice(KEYS)}  {rng.choice(MENU_ACTIONS)}")
+        else:
+            lines.append(f"Key Pad {rng.randint(0, 9)} {rng.choice(MENU_ACTIONS)} (Num Lock)")
+    return '\n'.join(lines) + '\n\n'
+
+def make_mixed_block(rng):
+    """混合文档：以正文为主，夹杂表格、快捷键、词典和操作指南"""
+    make_block = rng.choices(
+        [make_normal_block, make_table_block, make_command_block, make_dictionary_block,
+         make_operation_block],
+        weights=[6, 1, 1, 1, 1]
+    )[0]
+    return make_block(rng)
+
+# 基准项：名称 -> (语料生成函数, 分句函数)
+BENCHMARKS = {
+    'normal': (make_normal_block, split_sentences.split_normal_content),
+    'table': (make_table_block, split_sentences.split_table_content),
+    'command': (make_command_block, split_sentences.split_command_content),
+    'dictionary': (make_dictionary_block, split_sentences.split_dictionary_content),
+    'operation': (make_operation_block, split_sentences.split_operation_guide),
+    'mixed': (make_mixed_block, split_sentences.split_sentences),
+}
+
+def generate_corpus(name, size, seed):
+    """生成指定类型、大小（字节）的合成语料，相同的seed总是生成相同的语料"""
+    make_block, _ = BENCHMARKS[name]
+    return fill_to_size(make_block, random.Random(f"{name}:{seed}"), size)
+
+def run_benchmark(name, text, repeat):
+    """测量分句函数的吞吐量和峰值内存，返回结果字典"""
+    _, splitter = BENCHMARKS[name]
+
+    # 计时：取多次运行中最快的一次，减少系统抖动的影响
+    best = None
+    count = 0
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        count = len(splitter(text))
+        elapsed = time.perf_counter() - start_time
+        if best is None or elapsed < best:
+            best = elapsed
+
+    # 峰值内存单独测量，tracemalloc会拖慢计时
+    tracemalloc.start()
+    splitter(text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    size_mb = len(text.encode('utf-8')) / (1024 * 1024)
+    best = max(best, 1e-9)
+    return {
+        'sentences': count,
+        'seconds': best,
+        'sentences_per_sec': count / best,
+        'mb_per_sec': size_mb / best,
+        'peak_memory_mb': peak / (1024 * 1024),
+    }
+
+def load_baseline(path):
+    """读取基线文件，不存在时返回None"""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_baseline(path, results, size, seed):
+    """保存本次结果作为基线"""
+    baseline = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'size': size,
+        'seed': seed,
+        'results': results,
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, ensure_ascii=False, indent=2)
+
+def find_regressions(results, baseline, threshold):
+    """与基线比较，返回 [(名称, 指标, 基线值, 当前值)]
+
+    吞吐量低于基线的(1-threshold)倍或峰值内存高于基线的(1+threshold)倍视为退化；
+    分句数量与基线不同说明分句结果变了，也一并列出。
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        if result['sentences'] != base['sentences']:
+            regressions.append((name, 'sentences', base['sentences'], result['sentences']))
+        if result['mb_per_sec'] < base['mb_per_sec'] * (1 - threshold):
+            regressions.append((name, 'mb_per_sec', base['mb_per_sec'], result['mb_per_sec']))
+        if result['peak_memory_mb'] > base['peak_memory_mb'] * (1 + threshold):
+            regressions.append((name, 'peak_memory_mb', base['peak_memory_mb'], result['peak_memory_mb']))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='split_sentences 分句性能基准测试')
+    parser.add_argument('--size', '-n',
+                      type=float,
+                      default=1.0,
+                      help='每种语料的大小（MB），默认为1')
+    parser.add_argument('--seed',
+                      type=int,
+                      default=42,
+                      help='语料生成的随机种子，默认为42')
+    parser.add_argument('--repeat', '-r',
+                      type=int,
+                      default=5,
+                      help='每项重复运行次数，取最快的一次，默认为5')
+    parser.add_argument('--only',
+                      nargs='+',
+                      choices=list(BENCHMARKS),
+                      help='只运行指定的基准项')
+    parser.add_argument('--baseline', '-b',
+                      default=BASELINE_FILE,
+                      help=f'基线文件路径，默认为{BASELINE_FILE}')
+    parser.add_argument('--save-baseline',
+                      action='store_true',
+                      help='将本次结果保存为新的基线')
+    parser.add_argument('--threshold', '-t',
+                      type=float,
+                      default=0.3,
+                      help='判定退化的相对阈值，默认为0.3（即30%%）')
+    parser.add_argument('--dump',
+                      help='将生成的语料保存到指定目录，便于人工检查')
+
+    args = parser.parse_args()
+
+    size = int(args.size * 1024 * 1024)
+    names = args.only or list(BENCHMARKS)
+
+    print(f"语料大小：{args.size} MB，随机种子：{args.seed}，重复次数：{args.repeat}")
+    print("=" * 50)
+    print(f"{'基准项':<12}{'句子数':>10}{'句/秒':>14}{'MB/秒':>10}{'峰值内存MB':>12}")
+
+    results = {}
+    for name in names:
+        text = generate_corpus(name, size, args.seed)
+        if args.dump:
+            os.makedirs(args.dump, exist_ok=True)
+            with open(os.path.join(args.dump, f'{name}.txt'), 'w', encoding='utf-8') as f:
+                f.write(text)
+        result = run_benchmark(name, text, args.repeat)
+        results[name] = result
+        print(f"{name:<12}{result['sentences']:>10}{result['sentences_per_sec']:>14.0f}"
+              f"{result['mb_per_sec']:>10.2f}{result['peak_memory_mb']:>12.1f}")
+    print("=" * 50)
+
+    if args.save_baseline:
+        save_baseline(args.baseline, results, size, args.seed)
+        print(f"基线已保存到：{args.baseline}")
+        return
+
+    baseline = load_baseline(args.baseline)
+    if baseline is None:
+        print(f"未找到基线文件 {args.baseline}，使用 --save-baseline 保存当前结果作为基线")
+        return
+    if baseline.get('size') != size or baseline.get('seed') != args.seed:
+        print("警告：基线使用的语料大小或随机种子与本次不同，比较结果仅供参考")
+
+    regressions = find_regressions(results, baseline, args.threshold)
+    if not regressions:
+        print(f"✓ 与基线（{baseline.get('created')}）相比没有发现性能退化")
+        return
+
+    print(f"✗ 发现 {len(regressions)} 项退化（阈值 {args.threshold:.0%}）：")
+    for name, metric, base_value, value in regressions:
+        print(f"  - {name} {metric}: 基线 {base_value:.2f} → 当前 {value:.2f}")
+    sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,91 +1,671 @@
+import io
 import os
+import sys
+import json
+import time
+import ctypes
+import ctypes.util
+import select
+import struct
+import hashlib
 import argparse
+import zipfile
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import xml.etree.ElementTree as ET
 from docx import Document
 
+# WordprocessingML命名空间
+W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+# 输出目录中记录已提取文件信息的清单
+MANIFEST_FILENAME = '.extract_manifest.json'
+MANIFEST_VERSION = 2
+
+# ZIP归档内文件的源标识格式：<归档路径>!/<归档内路径>
+ARCHIVE_SEP = '!/'
+
+# 已打开的ZIP归档：(进程号, 归档路径) -> ZipFile
+_archives = {}
+
+# inotify相关常量（见 <sys/inotify.h>）
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT_SIZE = struct.calcsize('iIII')
+
 # 提取DOCX内容
 def extract_text_from_docx(file_path):
-    text = ""
+    parts = []
     doc = Document(file_path)
     
     # 提取段落文本
     for para in doc.paragraphs:
-        if para.text.strip():  # 只添加非空段落
-            text += para.text + '\n'
+        text = para.text
+        if text.strip():  # 只添加非空段落
+            parts.append(text + '\n')
     
-    # 提取表格内容
+    # 提取表格内容：每个表格的w:tbl只读取一次，宽度计算和输出都基于同一个单元格矩阵
     for table in doc.tables:
-        text += "\n=== 表格开始 ===\n"  # 表格标记
-        
-        # 获取每列的最大宽度
-        col_widths = []
-        for col in range(len(table.columns)):
-            width = max(len(cell.text) for row in table.rows for cell in row.cells[col:col+1])
-            col_widths.append(width)
-        
-        # 输出表格内容
-        for row in table.rows:
-            # 将每个单元格的文本对齐后用竖线分隔
-            row_text = ' | '.join(
-                cell.text.ljust(col_widths[i]) 
-                for i, cell in enumerate(row.cells)
-            )
-            text += row_text + '\n'
-            
-        text += "=== 表格结束 ===\n\n"  # 表格结束标记
+        parts.append(_render_table(*_read_table_grid(table._tbl)))
     
-    return text
+    return ''.join(parts)
+
+# 提取run中的文本（与python-docx的Run.text保持一致）
+def _run_text(r):
+    parts = []
+    for child in r:
+        tag = child.tag
+        if tag == W_NS + 't':
+            parts.append(child.text or '')
+        elif tag == W_NS + 'tab' or tag == W_NS + 'ptab':
+            parts.append('\t')
+        elif tag == W_NS + 'br':
+            # 只有换行符转为'\n'，分页符和分栏符忽略
+            if child.get(W_NS + 'type', 'textWrapping') == 'textWrapping':
+                parts.append('\n')
+        elif tag == W_NS + 'cr':
+            parts.append('\n')
+        elif tag == W_NS + 'noBreakHyphen':
+            parts.append('-')
+    return ''.join(parts)
+
+# 提取段落文本（包含超链接中的文本）
+def _paragraph_text(p):
+    parts = []
+    for child in p:
+        if child.tag == W_NS + 'r':
+            parts.append(_run_text(child))
+        elif child.tag == W_NS + 'hyperlink':
+            parts.extend(_run_text(r) for r in child if r.tag == W_NS + 'r')
+    return ''.join(parts)
+
+# 提取单元格文本，多个段落之间用换行连接
+def _cell_text(tc):
+    return '\n'.join(_paragraph_text(p) for p in tc if p.tag == W_NS + 'p')
+
+# 一次性读取w:tbl元素，构建紧凑的单元格矩阵
+# 返回 (cell_texts, grid)：cell_texts为去重后的单元格文本列表，
+# grid的每一行是该行各网格列对应的单元格下标。
+# 横向合并(gridSpan)的单元格在所占的每一列重复出现，纵向合并(vMerge)的后续单元格
+# 指向上方的起始单元格，与python-docx的row.cells语义一致。
+def _read_table_grid(tbl):
+    cell_texts = []
+    grid = []
+    prev_row = {}  # 上一行：网格列 -> 单元格下标
+    for tr in tbl:
+        if tr.tag != W_NS + 'tr':
+            continue
+        row = []
+        current_row = {}
+        grid_col = 0
+        tr_pr = tr.find(W_NS + 'trPr')
+        if tr_pr is not None:
+            grid_before = tr_pr.find(W_NS + 'gridBefore')
+            if grid_before is not None:
+                grid_col = int(grid_before.get(W_NS + 'val', '0'))
+        for tc in tr:
+            if tc.tag != W_NS + 'tc':
+                continue
+            span = 1
+            v_merge = None
+            tc_pr = tc.find(W_NS + 'tcPr')
+            if tc_pr is not None:
+                grid_span = tc_pr.find(W_NS + 'gridSpan')
+                if grid_span is not None:
+                    span = int(grid_span.get(W_NS + 'val', '1'))
+                merge = tc_pr.find(W_NS + 'vMerge')
+                if merge is not None:
+                    v_merge = merge.get(W_NS + 'val', 'continue')
+            if v_merge == 'continue' and grid_col in prev_row:
+                # 纵向合并的后续单元格，沿用上方单元格
+                cell_index = prev_row[grid_col]
+            else:
+                cell_index = len(cell_texts)
+                cell_texts.append(_cell_text(tc))
+            for offset in range(span):
+                current_row[grid_col + offset] = cell_index
+                row.append(cell_index)
+            grid_col += span
+        grid.append(row)
+        prev_row = current_row
+    return cell_texts, grid
+
+# 按现有格式渲染表格，列宽和输出都来自同一个单元格矩阵
+def _render_table(cell_texts, grid):
+    cell_widths = [len(cell_text) for cell_text in cell_texts]
+    col_widths = []
+    for row in grid:
+        for i, cell_index in enumerate(row):
+            width = cell_widths[cell_index]
+            if i == len(col_widths):
+                col_widths.append(width)
+            elif width > col_widths[i]:
+                col_widths[i] = width
+
+    lines = ["\n=== 表格开始 ===\n"]  # 表格标记
+    for row in grid:
+        # 将每个单元格的文本对齐后用竖线分隔
+        lines.append(' | '.join(
+            cell_texts[cell_index].ljust(col_widths[i])
+            for i, cell_index in enumerate(row)
+        ) + '\n')
+    lines.append("=== 表格结束 ===\n\n")  # 表格结束标记
+    return ''.join(lines)
+
+# 流式提取DOCX内容：直接从压缩包中增量解析word/document.xml，
+# 按文档顺序逐个产出段落和表格文本，不构建完整的文档树
+def iter_docx_blocks(file_path):
+    with zipfile.ZipFile(file_path) as zf:
+        with zf.open('word/document.xml') as xml_file:
+            body = None
+            depth = 0  # 当前元素相对于w:body的层级
+            for event, elem in ET.iterparse(xml_file, events=('start', 'end')):
+                if event == 'start':
+                    if body is None:
+                        if elem.tag == W_NS + 'body':
+                            body = elem
+                    else:
+                        depth += 1
+                    continue
+
+                if body is None:
+                    continue
+                if elem is body:
+                    break
+
+                depth -= 1
+                if depth > 0:
+                    continue
+
+                # body的直接子元素已完整解析
+                if elem.tag == W_NS + 'p':
+                    text = _paragraph_text(elem)
+                    if text.strip():  # 只输出非空段落
+                        yield text + '\n'
+                elif elem.tag == W_NS + 'tbl':
+                    yield _render_table(*_read_table_grid(elem))
+
+                # 释放已处理的元素，保持内存占用稳定
+                body.clear()
+
+# 流式提取DOCX内容并逐块写入writer（任何带write方法的对象）
+def extract_text_streaming(file_path, writer):
+    for block in iter_docx_blocks(file_path):
+        writer.write(block)
 
 # 保存提取的纯文本内容
 def save_to_file(text, output_dir, filename):
-    os.makedirs(output_dir, exist_ok=True)
     output_path = os.path.join(output_dir, filename)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
     with open(output_path, "w", encoding="utf-8") as f:
         f.write(text)
 
-# 提取并保存DOCX中的文本
-def extract_and_save(input_path, output_dir):
-    docx_files = []
+# 流式提取DOCX内容并直接写入输出文件
+def stream_to_file(file_path, output_dir, filename):
+    output_path = os.path.join(output_dir, filename)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        extract_text_streaming(file_path, f)
+
+# 拆分源标识，返回 (文件路径, 归档内路径)；普通文件的归档内路径为None
+def split_source(source):
+    if ARCHIVE_SEP in source:
+        archive_path, member = source.split(ARCHIVE_SEP, 1)
+        if archive_path.lower().endswith('.zip'):
+            return archive_path, member
+    return source, None
+
+# 打开ZIP归档并在当前进程内复用，避免每个内部文件都重新读取中央目录
+# 缓存按进程号区分，子进程不会与父进程共用同一个文件句柄
+def _open_archive(archive_path):
+    key = (os.getpid(), archive_path)
+    zf = _archives.get(key)
+    if zf is None:
+        zf = _archives[key] = zipfile.ZipFile(archive_path)
+    return zf
+
+# 关闭当前进程中已打开的ZIP归档
+def close_archives():
+    for key in [key for key in _archives if key[0] == os.getpid()]:
+        _archives.pop(key).close()
+
+# 列出ZIP归档中的所有DOCX文件（支持任意层级的子目录）
+def list_archive_sources(archive_path):
+    archive_path = os.path.abspath(archive_path)
+    sources = []
+    for info in _open_archive(archive_path).infolist():
+        name = info.filename
+        basename = name.rsplit('/', 1)[-1]
+        if info.is_dir() or not name.lower().endswith('.docx'):
+            continue
+        # 跳过Word临时文件和macOS生成的元数据
+        if basename.startswith('~$') or name.startswith('__MACOSX/'):
+            continue
+        sources.append(archive_path + ARCHIVE_SEP + name)
+    return sources
+
+# 打开源文件：普通文件直接返回路径；归档内的文件只解压一次到内存中，不写临时文件
+def open_source(source):
+    archive_path, member = split_source(source)
+    if member is None:
+        return source
+    return io.BytesIO(_open_archive(archive_path).read(member))
+
+# 用于显示的源文件名称
+def source_display_name(source):
+    archive_path, member = split_source(source)
+    if member is None:
+        return os.path.basename(source)
+    return f"{os.path.basename(archive_path)}/{member}"
+
+# 源文件对应的输出文件名（相对于输出目录）
+# 归档内的文件按 <归档名>/<内部路径>.txt 输出，保留原有的目录层级
+def source_output_name(source):
+    archive_path, member = split_source(source)
+    if member is None:
+        return f"{os.path.splitext(os.path.basename(source))[0]}.txt"
+    # 去掉空路径段和..，防止写到输出目录之外
+    parts = [part for part in member.split('/') if part not in ('', '.', '..')]
+    parts[-1] = os.path.splitext(parts[-1])[0] + '.txt'
+    return os.path.join(os.path.splitext(os.path.basename(archive_path))[0], *parts)
+
+# 源文件的大小和修改时间
+def source_signature(source):
+    archive_path, member = split_source(source)
+    if member is None:
+        stat = os.stat(source)
+        return stat.st_size, stat.st_mtime_ns
+    info = _open_archive(archive_path).getinfo(member)
+    return info.file_size, list(info.date_time)
+
+# 计算源文件的内容哈希：普通文件为SHA-256，
+# 归档内的文件直接使用中央目录中的CRC32，无需解压
+def source_digest(source):
+    archive_path, member = split_source(source)
+    if member is not None:
+        return f"crc32:{_open_archive(archive_path).getinfo(member).CRC:08x}"
+    digest = hashlib.sha256()
+    with open(source, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return f"sha256:{digest.hexdigest()}"
+
+# 收集需要处理的源文件，输入可以是DOCX文件、ZIP归档或包含两者的目录
+def collect_sources(input_path):
+    if os.path.isfile(input_path):
+        if input_path.lower().endswith('.docx'):
+            return [os.path.abspath(input_path)]
+        if input_path.lower().endswith('.zip'):
+            return list_archive_sources(input_path)
+        print(f"错误：'{input_path}' 不是DOCX文件或ZIP归档")
+        return None
+    if os.path.isdir(input_path):
+        sources = []
+        for f in sorted(os.listdir(input_path)):
+            file_path = os.path.abspath(os.path.join(input_path, f))
+            if f.lower().endswith('.docx'):
+                sources.append(file_path)
+            elif f.lower().endswith('.zip'):
+                sources.extend(list_archive_sources(file_path))
+        return sources
+    print(f"错误：'{input_path}' 不存在")
+    return None
+
+# 提取单个源文件并保存，返回 (输出路径, 错误信息)
+# 定义在模块顶层，以便在进程池中执行
+def extract_one(source, output_dir, stream=False):
+    output_filename = source_output_name(source)
+    try:
+        if stream:
+            stream_to_file(open_source(source), output_dir, output_filename)
+        else:
+            text = extract_text_from_docx(open_source(source))
+            save_to_file(text, output_dir, output_filename)
+        return os.path.join(output_dir, output_filename), None
+    except Exception as e:
+        return None, str(e)
+
+# 读取输出目录中的提取清单：源文件标识 -> {size, mtime, digest, output, stream}
+def load_manifest(output_dir):
+    manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠ 提取清单读取失败，将重新提取全部文件: {str(e)}")
+        return {}
+    if data.get('version') != MANIFEST_VERSION:
+        return {}
+    return data.get('files', {})
+
+# 保存提取清单，先写临时文件再替换，避免中断时清单损坏
+def save_manifest(output_dir, manifest):
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': MANIFEST_VERSION, 'files': manifest}, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, manifest_path)
+
+# 判断源文件自上次提取后是否未变化，返回 (是否未变化, 内容哈希)
+# 大小和修改时间都相同时直接视为未变化；否则再比较内容哈希，
+# 只是被touch过的文件同样会被跳过。切换提取模式后输出格式不同，需要重新提取
+def check_unchanged(source, entry, output_dir, stream=False):
+    if not entry or entry.get('stream', False) != stream:
+        return False, None
+    if not os.path.exists(os.path.join(output_dir, entry['output'])):
+        return False, None
+    size, mtime = source_signature(source)
+    if size != entry['size']:
+        return False, None
+    if mtime == entry['mtime']:
+        return True, entry['digest']
+    digest = source_digest(source)
+    return digest == entry['digest'], digest
+
+# 在清单中记录源文件的提取结果
+def record_manifest(manifest, source, output_name, digest=None, stream=False):
+    size, mtime = source_signature(source)
+    manifest[source] = {
+        'size': size,
+        'mtime': mtime,
+        'digest': digest or source_digest(source),
+        'output': output_name,
+        'stream': stream,
+    }
+
+# 清理源文件已被删除的输出，只处理属于本次输入（目录或ZIP归档）的清单条目
+def cleanup_deleted(manifest, input_path, sources, output_dir):
+    input_path = os.path.abspath(input_path)
+    is_dir = os.path.isdir(input_path)
+    current = set(sources)
+    removed = []
+    for source in list(manifest):
+        if source in current:
+            continue
+        file_path, _ = split_source(source)
+        in_scope = os.path.dirname(file_path) == input_path if is_dir else file_path == input_path
+        if not in_scope:
+            continue
+        output = manifest.pop(source)['output']
+        # 其他源文件仍在使用同名输出时不删除
+        if any(entry['output'] == output for entry in manifest.values()):
+            continue
+        output_path = os.path.join(output_dir, output)
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        removed.append(output)
+    return removed
+
+# 提取一组源文件，跳过自上次提取后未变化的文件，并更新清单
+# 返回 (待处理数, 跳过数, 成功数, 失败文件列表)
+def extract_sources(sources, output_dir, manifest, stream=False, workers=1, force=False):
+    pending_sources = []
+    digests = {}
+    skipped_count = 0
+    for source in sources:
+        if force:
+            pending_sources.append(source)
+            continue
+        entry = manifest.get(source)
+        unchanged, digest = check_unchanged(source, entry, output_dir, stream)
+        if unchanged:
+            skipped_count += 1
+            record_manifest(manifest, source, entry['output'], digest, stream)
+        else:
+            pending_sources.append(source)
+            digests[source] = digest
+    
+    total_files = len(pending_sources)
+    print(f"\n共发现 {len(sources)} 个DOCX文件，其中 {skipped_count} 个未变化已跳过，{total_files} 个待处理")
+    print("=" * 50)
+    
+    success_count = 0
+    failed_files = []
+    
+    # 记录成功提取的文件
+    def on_success(source):
+        try:
+            record_manifest(manifest, source, source_output_name(source), digests.get(source), stream)
+        except OSError:  # 源文件在处理期间被删除
+            pass
     
+    # 处理文件
+    try:
+        if workers > 1 and total_files > 1:
+            # 大文件优先提交，避免最后只剩一个超大文件占用单个核心
+            pending_sources.sort(key=lambda source: source_signature(source)[0], reverse=True)
+            workers = min(workers, total_files)
+            print(f"使用 {workers} 个进程并行处理")
+            
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {
+                    executor.submit(extract_one, source, output_dir, stream): source
+                    for source in pending_sources
+                }
+                for index, future in enumerate(as_completed(futures), 1):
+                    source = futures[future]
+                    filename = source_display_name(source)
+                    try:
+                        output_path, error = future.result()
+                    except Exception as e:  # 工作进程异常退出
+                        output_path, error = None, str(e)
+                    
+                    if error is None:
+                        success_count += 1
+                        on_success(source)
+                        print(f"✓ [{index}/{total_files}] {filename} -> {output_path}")
+                    else:
+                        failed_files.append(filename)
+                        print(f"✗ [{index}/{total_files}] 处理文件 '{filename}' 时出错: {error}")
+        else:
+            for index, source in enumerate(pending_sources, 1):
+                filename = source_display_name(source)
+                print(f"\n正在处理第 {index}/{total_files} 个文件: {filename}")
+                
+                output_path, error = extract_one(source, output_dir, stream)
+                if error is None:
+                    success_count += 1
+                    on_success(source)
+                    print(f"✓ 已完成提取并保存到: {output_path}")
+                else:
+                    failed_files.append(filename)
+                    print(f"✗ 处理文件 '{filename}' 时出错: {error}")
+    finally:
+        # 中断时也保存已完成的部分，下次运行可以跳过
+        save_manifest(output_dir, manifest)
+    
+    return total_files, skipped_count, success_count, failed_files
+
+# 提取并保存DOCX中的文本
+def extract_and_save(input_path, output_dir, stream=False, workers=1, force=False):
     # 收集需要处理的文件
-    if os.path.isfile(input_path):
-        if not input_path.endswith('.docx'):
-            print(f"错误：'{input_path}' 不是DOCX文件")
-            return
-        docx_files.append(input_path)
-    elif os.path.isdir(input_path):
-        docx_files.extend([
-            os.path.join(input_path, f) 
-            for f in os.listdir(input_path) 
-            if f.endswith('.docx')
-        ])
-    else:
-        print(f"错误：'{input_path}' 不存在")
+    sources = collect_sources(input_path)
+    if sources is None:
         return
     
-    total_files = len(docx_files)
-    if total_files == 0:
+    manifest = load_manifest(output_dir)
+    
+    # 清理源文件已删除的输出（输入为单个DOCX文件时不清理）
+    if os.path.isdir(input_path) or input_path.lower().endswith('.zip'):
+        for output in cleanup_deleted(manifest, input_path, sources, output_dir):
+            print(f"已删除源文件不存在的输出: {output}")
+    
+    if not sources:
+        save_manifest(output_dir, manifest)
         print("未找到任何DOCX文件")
         return
-        
-    print(f"\n共发现 {total_files} 个DOCX文件待处理")
-    print("=" * 50)
     
-    # 处理文件
-    for index, file_path in enumerate(docx_files, 1):
-        filename = os.path.basename(file_path)
-        print(f"\n正在处理第 {index}/{total_files} 个文件: {filename}")
-        
-        try:
-            text = extract_text_from_docx(file_path)
-            output_filename = f"{os.path.splitext(filename)[0]}.txt"
-            save_to_file(text, output_dir, output_filename)
-            print(f"✓ 已完成提取并保存到: {os.path.join(output_dir, output_filename)}")
-            
-        except Exception as e:
-            print(f"✗ 处理文件 '{filename}' 时出错: {str(e)}")
+    total_files, skipped_count, success_count, failed_files = extract_sources(
+        sources, output_dir, manifest, stream, workers, force)
     
     print("\n" + "=" * 50)
-    print(f"处理完成！成功提取 {total_files} 个文件的内容到目录: {output_dir}")
+    print(f"处理完成！总计处理 {total_files} 个文件")
+    print(f"跳过：{skipped_count} 个（未变化）")
+    print(f"成功：{success_count} 个")
+    print(f"失败：{len(failed_files)} 个")
+    
+    if failed_files:
+        print("\n以下文件处理失败：")
+        for f in failed_files:
+            print(f"- {f}")
+    
+    print(f"\n提取结果已保存到目录：{output_dir}")
+
+# 打开inotify并监听目录，返回文件描述符；当前系统不支持时返回None
+def _inotify_open(directory):
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            return None
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_CREATE | IN_MODIFY | IN_DELETE
+        if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError):
+        return None
+
+# 等待并读取inotify事件，返回发生变化的文件名列表
+def _inotify_read(fd, timeout):
+    ready, _, _ = select.select([fd], [], [], timeout)
+    if not ready:
+        return []
+    try:
+        data = os.read(fd, 64 * 1024)
+    except BlockingIOError:
+        return []
+    names = []
+    offset = 0
+    while offset + INOTIFY_EVENT_SIZE <= len(data):
+        _, _, _, length = struct.unpack_from('iIII', data, offset)
+        offset += INOTIFY_EVENT_SIZE
+        name = data[offset:offset + length].rstrip(b'\0')
+        offset += length
+        if name:
+            names.append(os.fsdecode(name))
+    return names
+
+# 扫描目录中需要监听的文件：文件名 -> (大小, 修改时间)
+def _scan_directory(directory):
+    snapshot = {}
+    for name in os.listdir(directory):
+        if not _is_watched_name(name):
+            continue
+        try:
+            stat = os.stat(os.path.join(directory, name))
+        except OSError:
+            continue
+        snapshot[name] = (stat.st_size, stat.st_mtime_ns)
+    return snapshot
+
+# 是否为需要监听的文件（跳过Word临时文件）
+def _is_watched_name(name):
+    lower = name.lower()
+    return lower.endswith(('.docx', '.zip')) and not name.startswith(('~$', '.'))
+
+# 处理一批已稳定的变化文件，只提取发生变化的部分
+def _extract_changes(input_dir, output_dir, names, stream, workers):
+    # 归档可能已被替换，丢弃已打开的句柄
+    close_archives()
+    manifest = load_manifest(output_dir)
+    
+    sources = []
+    needs_cleanup = False
+    for name in sorted(names):
+        path = os.path.abspath(os.path.join(input_dir, name))
+        if not os.path.exists(path):
+            needs_cleanup = True
+        elif name.lower().endswith('.zip'):
+            needs_cleanup = True  # 归档中可能删除了部分文件
+            try:
+                sources.extend(list_archive_sources(path))
+            except zipfile.BadZipFile as e:
+                print(f"✗ 无法读取归档 '{name}': {str(e)}")
+        else:
+            sources.append(path)
+    
+    if needs_cleanup:
+        for output in cleanup_deleted(manifest, input_dir, collect_sources(input_dir), output_dir):
+            print(f"已删除源文件不存在的输出: {output}")
+    
+    if sources:
+        extract_sources(sources, output_dir, manifest, stream, workers)
+    else:
+        save_manifest(output_dir, manifest)
+
+# 监听目录中的新增或修改的DOCX/ZIP文件并增量提取
+# 优先使用Linux inotify，不可用时退化为定时轮询。
+# 文件在settle秒内没有新的变化且大小、修改时间保持不变后才会被处理，避免读到未写完的文件
+# force为True时启动时的首次提取忽略提取清单
+def watch_and_extract(input_dir, output_dir, stream=False, workers=1, interval=2.0, settle=3.0, force=False):
+    if not os.path.isdir(input_dir):
+        print(f"错误：监听模式需要输入目录，'{input_dir}' 不是目录")
+        return
+    
+    # 先开始监听再处理启动前已有的变化，首次提取期间新增或修改的文件不会被漏掉
+    fd = _inotify_open(input_dir)
+    snapshot = _scan_directory(input_dir) if fd is None else None
+    extract_and_save(input_dir, output_dir, stream=stream, workers=workers, force=force)
+    
+    mode = "inotify" if fd is not None else f"轮询（每 {interval} 秒）"
+    print(f"\n开始监听目录：{os.path.abspath(input_dir)}，监听方式：{mode}，按 Ctrl+C 退出")
+    
+    pending = {}  # 文件名 -> (最后一次变化的时间, 上次检查时的签名)
+    try:
+        while True:
+            if fd is not None:
+                names = _inotify_read(fd, interval if pending else None)
+            else:
+                time.sleep(interval)
+                current = _scan_directory(input_dir)
+                names = [name for name in current.keys() | snapshot.keys()
+                         if current.get(name) != snapshot.get(name)]
+                snapshot = current
+            
+            now = time.monotonic()
+            for name in names:
+                if _is_watched_name(name):
+                    pending[name] = (now, None)
+            
+            # 找出已经稳定的文件
+            ready = []
+            for name, (changed_at, signature) in list(pending.items()):
+                if now - changed_at < settle:
+                    continue
+                try:
+                    stat = os.stat(os.path.join(input_dir, name))
+                except FileNotFoundError:
+                    ready.append(name)  # 文件已删除
+                    del pending[name]
+                    continue
+                current_signature = (stat.st_size, stat.st_mtime_ns)
+                if current_signature == signature:
+                    ready.append(name)
+                    del pending[name]
+                else:
+                    # 记录签名，再等待一个settle周期确认文件已写完
+                    pending[name] = (now, current_signature)
+            
+            if ready:
+                print(f"\n[{datetime.now().strftime('%H:%M:%S')}] 检测到 {len(ready)} 个文件变化")
+                _extract_changes(input_dir, output_dir, ready, stream, workers)
+    except KeyboardInterrupt:
+        print("\n已停止监听")
+    finally:
+        if fd is not None:
+            os.close(fd)
 
 def main():
     # 创建命令行参数解析器
@@ -105,18 +685,65 @@ def main():
   
   # 处理整个目录并指定输出目录
   python extract_text.py /path/to/docx/folder -o /path/to/output
+  
+  # 直接处理ZIP归档中的docx文件（无需解压），按 <归档名>/<内部路径>.txt 输出
+  python extract_text.py /path/to/bundle.zip
+  
+  # 使用流式模式处理大文档（按文档顺序输出段落和表格）
+  python extract_text.py /path/to/docx/folder --stream
+  
+  # 使用4个进程并行处理整个目录
+  python extract_text.py /path/to/docx/folder --workers 4
+  
+  # 忽略提取清单，强制重新提取所有文件
+  python extract_text.py /path/to/docx/folder --force
+  
+  # 监听目录，新增或修改的文件在写入完成后几秒内自动提取
+  python extract_text.py /path/to/docx/folder --watch
         '''
     )
     
     parser.add_argument('input', 
-                       help='输入路径：可以是单个DOCX文件或包含多个DOCX文件的目录')
+                       help='输入路径：可以是单个DOCX文件、包含DOCX文件的ZIP归档，或包含两者的目录')
     
     parser.add_argument('-o', '--output', 
                        default='output/docx_output',
                        help='输出目录路径，用于存放提取的文本文件 (默认: output/docx_output)')
     
+    parser.add_argument('--stream',
+                       action='store_true',
+                       help='流式模式：增量解析word/document.xml，按文档顺序输出段落和表格，适合超大文档')
+    
+    parser.add_argument('-w', '--workers',
+                       type=int,
+                       default=1,
+                       help='并行处理的进程数，大文件优先分配 (默认: 1，即串行处理)')
+    
+    parser.add_argument('-f', '--force',
+                       action='store_true',
+                       help='强制重新提取所有文件，忽略输出目录中的提取清单（监听模式下只影响启动时的首次提取）')
+    
+    parser.add_argument('--watch',
+                       action='store_true',
+                       help='监听模式：持续监听输入目录，自动提取新增或修改的文件（Linux使用inotify，其他系统定时轮询）')
+    
+    parser.add_argument('--interval',
+                       type=float,
+                       default=2.0,
+                       help='监听模式下的轮询间隔秒数 (默认: 2.0)')
+    
+    parser.add_argument('--settle',
+                       type=float,
+                       default=3.0,
+                       help='监听模式下文件保持不变多少秒后才开始提取，避免读取未写完的文件 (默认: 3.0)')
+    
     args = parser.parse_args()
-    extract_and_save(args.input, args.output)
+    if args.watch:
+        watch_and_extract(args.input, args.output, stream=args.stream, workers=args.workers,
+                          interval=args.interval, settle=args.settle, force=args.force)
+    else:
+        extract_and_save(args.input, args.output, stream=args.stream,
+                         workers=args.workers, force=args.force)
 
 if __name__ == "__main__":
     main()
@@ -1,22 +1,494 @@
 import os
 import re
+import json
+import math
 import time
-import jieba
-import requests
+import random
+import shutil
+import sqlite3
+import hashlib
+import threading
+import heapq
+import itertools
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 import argparse
-from typing import List, Tuple
-from tqdm import tqdm
+from typing import Iterator, List, Tuple
 from datetime import datetime
+from urllib.parse import urlparse
+from split_sentences import (CHUNK_SIZE, TMP_SUFFIX, find_window_cut, iter_text_chunks, remove_stale_outputs,
+                             replace_output)
+
+# 需要重试的HTTP状态码（服务端暂时不可用）
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# 默认的Ollama服务地址
+DEFAULT_ENDPOINT = "http://localhost:11434"
+
+# 启用自适应并发而没有指定并发上限时，每个服务的并发上限
+ADAPTIVE_CONCURRENCY_PER_ENDPOINT = 8
+
+# 健康检查（/api/tags）的超时（秒）：恢复检查在请求线程上进行，不能使用生成请求的长读取超时
+HEALTH_CHECK_TIMEOUT = 5.0
+
+class LLMError(Exception):
+    """LLM请求失败：HTTP错误、响应不是合法JSON或缺少response字段（重试后仍失败）"""
+
+# 批量模式的prompt：把单句prompt作为处理要求，多条文本以JSON数组输入、输出
+BATCH_PROMPT = """下面的JSON数组中有多条文本，每条文本都有唯一的id。请对每条文本分别按照以下要求处理：
+
+{instructions}
+
+输入：
+{items}
+
+只返回一个JSON数组，每条输入文本对应一个元素，格式为：[{{"id": 编号, "result": "处理结果"}}]
+id必须与输入一致，不要遗漏或增加元素，不要添加任何说明。"""
+
+# 批量模式下替换单句prompt中{text}的说明文字
+BATCH_TEXT_PLACEHOLDER = "（见下方输入中每个元素的text）"
+
+# chat接口中替换prompt里{text}的说明文字（句子作为用户消息单独发送）
+CHAT_TEXT_PLACEHOLDER = "（见用户消息）"
+
+# 处理日志文件后缀
+JOURNAL_SUFFIX = '.journal.jsonl'
+
+# 各阶段在处理日志和统计信息中的键及其名称
+STAGE_NAMES = {"1": "第一阶段", "2": "第二阶段", "3": "第三阶段分类", "3-single": "第三阶段优化", "4": "第四阶段"}
+
+# 第三阶段的分类标签
+SENTENCE_LABELS = ('SINGLE', 'MULTIPLE', 'INVALID')
+
+# 从模型回复中提取JSON数组（允许前后有```json等多余内容）
+JSON_ARRAY_PATTERN = re.compile(r'\[.*\]', re.S)
+
+class ResponseCache:
+    """基于SQLite的模型响应缓存，键为请求内容（模型、prompt、生成参数）的哈希
+    
+    超过max_age秒的记录视为过期；总大小超过max_size字节时按最近使用时间淘汰。
+    多个线程共享同一个连接，读写由锁保护。
+    """
+    
+    def __init__(self, path, max_size=500 * 1024 * 1024, max_age=30 * 24 * 3600):
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self.conn.commit()
+        self.evict()
+    
+    @staticmethod
+    def make_key(request_data):
+        """根据请求内容生成缓存键"""
+        payload = json.dumps(request_data, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def get(self, key):
+        """查询缓存，未命中或已过期时返回None"""
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT response FROM responses WHERE key = ? AND created >= ?",
+                (key, now - self.max_age)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            return row[0]
+    
+    def put(self, key, response):
+        """写入缓存"""
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, response, len(response.encode('utf-8')), now, now)
+            )
+            self.conn.commit()
+    
+    def evict(self):
+        """删除过期记录，并按最近使用时间淘汰超出大小上限的记录，返回删除的条数"""
+        with self.lock:
+            removed = self.conn.execute(
+                "DELETE FROM responses WHERE created < ?", (time.time() - self.max_age,)
+            ).rowcount
+            total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_size:
+                rows = self.conn.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall()
+                expired = []
+                for key, size in rows:
+                    if total <= self.max_size:
+                        break
+                    expired.append((key,))
+                    total -= size
+                self.conn.executemany("DELETE FROM responses WHERE key = ?", expired)
+                removed += len(expired)
+            self.conn.commit()
+            return removed
+    
+    def close(self):
+        """淘汰超限记录并关闭数据库"""
+        self.evict()
+        self.conn.close()
+
+def normalize_endpoint(url):
+    """把服务地址统一为以/api结尾的接口地址，如 localhost:11434 -> http://localhost:11434/api"""
+    url = url.strip().rstrip('/')
+    if '://' not in url:
+        url = 'http://' + url
+    return url if url.endswith('/api') else url + '/api'
+
+def model_names(models):
+    """模型列表中的名称集合，没有写标签的名称等同于 :latest"""
+    names = set(models)
+    return names | {name[:-len(':latest')] for name in models if name.endswith(':latest')}
+
+class Endpoint:
+    """一个Ollama服务及其状态"""
+    
+    def __init__(self, url):
+        self.url = url
+        # 正在进行的请求数和已发送的请求总数（正在进行的请求数相同时轮流选择）
+        self.outstanding = 0
+        self.requests = 0
+        # 连续失败次数，以及移出轮换的截止时间（time.monotonic()，0表示在轮换中）
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.probing = False
+        # 服务上已有的模型名称，还没有检查成功过时为None；最近一次健康检查的错误
+        self.models = None
+        self.error = None
+    
+    def serves(self, model):
+        """是否可能提供该模型（还没有检查成功过的服务视为可能提供）"""
+        return self.models is None or model in self.models
+
+class EndpointPool:
+    """多个Ollama服务之间的负载均衡
+    
+    每个请求发给提供该模型、且在轮换中的服务里正在进行的请求最少的一个。请求连续失败max_failures次
+    （连接失败、超时或服务端暂时性错误）的服务移出轮换eject_time秒，到期后先通过模型列表接口
+    （/api/tags）确认服务恢复才重新加入。所有服务都被移出时仍向它们发送请求，由重试和退避处理，
+    因此只有一个服务时与不做负载均衡的行为相同。
+    
+    timeout为健康检查的超时：接受连接但不响应的服务最多让执行检查的请求线程等待这么久。
+    """
+    
+    def __init__(self, urls, session, timeout, eject_time=30.0, max_failures=1):
+        self.endpoints = [Endpoint(normalize_endpoint(url)) for url in urls]
+        self.session = session
+        self.timeout = timeout
+        self.eject_time = eject_time
+        self.max_failures = max_failures
+        self.lock = threading.Lock()
+    
+    def check(self, endpoint):
+        """健康检查：获取服务上的模型列表，成功时重新加入轮换并返回True，失败时移出轮换"""
+        try:
+            response = self.session.get(f"{endpoint.url}/tags", timeout=self.timeout)
+            response.raise_for_status()
+            models = [model.get('name', '') for model in response.json().get('models', [])]
+        except Exception as e:
+            with self.lock:
+                endpoint.error = str(e)
+                endpoint.probing = False
+                endpoint.ejected_until = time.monotonic() + self.eject_time
+            return False
+        
+        with self.lock:
+            endpoint.models = model_names(models)
+            endpoint.error = None
+            endpoint.failures = 0
+            endpoint.probing = False
+            endpoint.ejected_until = 0.0
+        return True
+    
+    def check_all(self):
+        """检查所有服务，返回可以访问的服务数"""
+        return sum(self.check(endpoint) for endpoint in self.endpoints)
+    
+    def serving(self, model):
+        """检查成功、确实提供该模型的服务"""
+        return [endpoint for endpoint in self.endpoints
+                if endpoint.models is not None and model in endpoint.models]
+    
+    def available(self, model):
+        """是否有提供该模型且在轮换中的服务"""
+        now = time.monotonic()
+        with self.lock:
+            return any(endpoint.serves(model) and endpoint.ejected_until <= now and not endpoint.probing
+                       for endpoint in self.endpoints)
+    
+    def acquire(self, model):
+        """选择一个服务发送请求，返回Endpoint；请求结束后必须调用release"""
+        now = time.monotonic()
+        with self.lock:
+            probes = [endpoint for endpoint in self.endpoints
+                      if 0 < endpoint.ejected_until <= now and not endpoint.probing]
+            for endpoint in probes:
+                endpoint.probing = True
+        # 移出轮换到期的服务先检查是否恢复（网络请求不在锁内进行）
+        for endpoint in probes:
+            self.check(endpoint)
+        
+        now = time.monotonic()
+        with self.lock:
+            candidates = [endpoint for endpoint in self.endpoints if endpoint.serves(model)]
+            if not candidates:
+                raise LLMError(f"没有提供模型 {model} 的Ollama服务")
+            available = [endpoint for endpoint in candidates
+                         if endpoint.ejected_until <= now and not endpoint.probing]
+            endpoint = min(available or candidates, key=lambda e: (e.outstanding, e.requests))
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+    
+    def release(self, endpoint, failed=False):
+        """请求结束；failed为True表示连接失败、超时或服务端暂时性错误"""
+        with self.lock:
+            endpoint.outstanding -= 1
+            if not failed:
+                endpoint.failures = 0
+                return
+            endpoint.failures += 1
+            if endpoint.failures >= self.max_failures:
+                endpoint.ejected_until = time.monotonic() + self.eject_time
+    
+    def eject(self, endpoint):
+        """把服务移出轮换"""
+        with self.lock:
+            endpoint.ejected_until = time.monotonic() + self.eject_time
+
+class RequestScheduler:
+    """LLM请求调度器，代替固定大小的线程池
+    
+    排队的请求按 (所属文件大小, 预计prompt长度) 从小到大执行（短作业优先），小文件和短句不会排在
+    大批量请求后面。adaptive为True时按AIMD方式调整同时进行的请求数：上限被用满、请求成功且延迟正常时
+    每完成约limit个请求加1，出错或延迟超过基线的tolerance倍时乘以decrease_factor（每个窗口最多减小一次）；
+    上限为max_limit（即concurrency）。
+    
+    延迟按请求的预计prompt长度折算为每字符秒数，基线按 (阶段, prompt长度的数量级) 分别统计：
+    短作业优先时越往后prompt越长，直接比较延迟会把变长的prompt误判为过载。
+    """
+    
+    def __init__(self, max_limit, initial_limit=None, adaptive=False, min_limit=1,
+                 tolerance=2.0, decrease_factor=0.7):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = min(min_limit, self.max_limit)
+        self.adaptive = adaptive
+        initial_limit = initial_limit if adaptive and initial_limit else self.max_limit
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.tolerance = tolerance
+        self.decrease_factor = decrease_factor
+        
+        # 各 (阶段, prompt长度的数量级) 的平滑延迟和延迟基线（每字符秒数），以及上次减小后完成的请求数
+        self.latency = {}
+        self.baseline = {}
+        self.since_decrease = 0
+        # 并发上限的变化范围，用于运行结束时的统计
+        self.limit_range = [self.limit, self.limit]
+        
+        self.queue = []
+        self.counter = itertools.count()
+        self.inflight = 0
+        self.closed = False
+        self.cond = threading.Condition()
+        # 提交请求的线程正在处理的文件大小（用于排序）；工作线程正在执行的请求的预计prompt长度（用于折算延迟）
+        self.local = threading.local()
+        self.workers = [threading.Thread(target=self._worker, daemon=True) for _ in range(self.max_limit)]
+        for worker in self.workers:
+            worker.start()
+    
+    @contextmanager
+    def job(self, size):
+        """在with块中由当前线程提交的请求都属于大小为size的文件"""
+        self.local.size = size
+        try:
+            yield
+        finally:
+            self.local.size = 0
+    
+    def submit(self, cost, fn, *args):
+        """提交一个请求，cost为预计的prompt长度，返回Future"""
+        future = Future()
+        priority = (getattr(self.local, 'size', 0), cost, next(self.counter))
+        with self.cond:
+            if self.closed:
+                raise RuntimeError("调度器已关闭")
+            heapq.heappush(self.queue, (priority, future, fn, args))
+            self.cond.notify()
+        return future
+    
+    def _worker(self):
+        while True:
+            with self.cond:
+                while not self.closed and (not self.queue or self.inflight >= int(self.limit)):
+                    self.cond.wait()
+                if self.closed:
+                    return
+                (_, cost, _), future, fn, args = heapq.heappop(self.queue)
+                self.inflight += 1
+            
+            self.local.cost = cost
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args))
+                except BaseException as e:
+                    future.set_exception(e)
+            
+            with self.cond:
+                self.inflight -= 1
+                self.cond.notify_all()
+    
+    def record(self, key, latency=None, ok=True):
+        """记录一次模型请求的结果：ok为False表示连接失败、超时或服务端暂时性错误
+        
+        在执行请求的工作线程中调用，延迟按该请求提交时的预计prompt长度折算。
+        """
+        if not self.adaptive:
+            return
+        cost = max(1, int(getattr(self.local, 'cost', 1)))
+        key = (key, cost.bit_length())
+        with self.cond:
+            self.since_decrease += 1
+            if not ok:
+                self._decrease()
+            else:
+                latency /= cost
+                smoothed = self.latency.get(key, latency)
+                smoothed += 0.2 * (latency - smoothed)
+                self.latency[key] = smoothed
+                # 基线取平滑延迟的最小值，并缓慢向当前延迟靠拢，避免一次偶然的快速响应长期压低基线
+                baseline = min(self.baseline.get(key, smoothed), smoothed)
+                baseline += 0.01 * (smoothed - baseline)
+                self.baseline[key] = baseline
+                if smoothed > baseline * self.tolerance:
+                    self._decrease()
+                elif self.inflight >= int(self.limit):
+                    # 只有上限被用满时才增大，排队的请求不够多时延迟正常并不说明可以承受更高的并发
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.limit_range[0] = min(self.limit_range[0], self.limit)
+            self.limit_range[1] = max(self.limit_range[1], self.limit)
+            self.cond.notify_all()
+    
+    def _decrease(self):
+        # 同一批过载的请求只减小一次：上次减小后至少完成limit个请求才再次减小
+        if self.since_decrease < self.limit:
+            return
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+        self.since_decrease = 0
+    
+    def shutdown(self):
+        """取消排队的请求，等待正在进行的请求完成"""
+        with self.cond:
+            self.closed = True
+            for _, future, _, _ in self.queue:
+                future.cancel()
+            self.queue = []
+            self.cond.notify_all()
+        for worker in self.workers:
+            worker.join()
+
+def is_local_endpoint(url):
+    """服务是否运行在本机上"""
+    return urlparse(normalize_endpoint(url)).hostname in ('localhost', '127.0.0.1', '::1')
+
+def server_parallelism(urls):
+    """本机Ollama服务的并行请求数之和，用作自适应并发的初始值；无法得知时返回None
+    
+    环境变量OLLAMA_NUM_PARALLEL只是本机服务配置的提示（本脚本与Ollama运行在同一台机器上时才有意义），
+    远程服务的配置无从得知，不计入。
+    """
+    value = os.environ.get('OLLAMA_NUM_PARALLEL', '')
+    local = sum(1 for url in urls if is_local_endpoint(url))
+    if not value.isdigit() or int(value) <= 0 or local == 0:
+        return None
+    return int(value) * local
 
 class LLMProcessor:
-    def __init__(self, model="qwen2.5-coder:7b"):
-        self.base_url = "http://localhost:11434/api"
+    def __init__(self, model="qwen2.5-coder:7b", connect_timeout=5.0, read_timeout=300.0,
+                 max_retries=3, backoff=1.0, concurrency=None, cache=None, batch_size=1,
+                 batch_max_chars=2000, rule_cleaner=True, classifier=None, splitter='punctuation',
+                 keep_alive=None, api='generate', endpoints=None, eject_time=30.0,
+                 adaptive_concurrency=False, initial_concurrency=None):
         self.headers = {"Content-Type": "application/json"}
         self.model = model
         
-        # 初始化prompt
-        self.init_prompt = """你是一个航空领域的文本处理专家。
-        请回复：模型初始化完成。"""
+        # 请求超时（秒）：连接超时和读取超时分开设置，避免单个请求永久挂起
+        self.timeout = (connect_timeout, read_timeout)
+        # 连接失败、超时和5xx/429等暂时性错误的重试次数及退避基数（秒）
+        self.max_retries = max_retries
+        self.backoff = backoff
+        
+        # 请求接口：generate把处理要求和句子拼成一个prompt；chat把每个阶段的处理要求作为固定的系统消息，
+        # 句子作为用户消息，同一阶段的请求前缀完全相同，Ollama可以复用已缓存的前缀计算结果
+        self.api = api
+        
+        # 响应缓存（ResponseCache），为None时不使用缓存
+        self.cache = cache
+        
+        # 批量模式：每个请求最多打包batch_size个句子、总长度不超过batch_max_chars个字符；
+        # batch_size为1时每个句子单独请求
+        self.batch_size = max(1, batch_size)
+        self.batch_max_chars = batch_max_chars
+        
+        # 初步分句和第三阶段拆分句子的方式（SENTENCE_SPLITTERS中的键）
+        self.splitter = splitter
+        
+        # 第四阶段先用规则清理，只有仍不满足要求的句子才请求模型
+        self.rule_cleaner = rule_cleaner
+        
+        # 第三阶段的本地分类器（StageClassifier），为None时全部交给模型判断
+        self.classifier = classifier
+        
+        # 各类计数（如规则清理避免的模型调用次数）
+        self.counters = {}
+        
+        # 分类请求（流式）的首token时间统计：[次数, 总秒数]
+        self.first_token_stats = [0, 0.0]
+        # 各阶段的prompt评估统计：{阶段: [次数, 总token数, 总秒数]}
+        self.prompt_eval_stats = {}
+        self.stats_lock = threading.Lock()
+        
+        # 同时发送给模型的请求数上限，所有文件、所有阶段共享；排队的请求短作业优先，
+        # 启用自适应并发时实际的上限在1到concurrency之间根据延迟和错误调整。
+        # 没有指定时为1，启用自适应并发时为每个服务ADAPTIVE_CONCURRENCY_PER_ENDPOINT个
+        endpoints = endpoints or [DEFAULT_ENDPOINT]
+        if concurrency is None:
+            concurrency = ADAPTIVE_CONCURRENCY_PER_ENDPOINT * len(endpoints) if adaptive_concurrency else 1
+        self.concurrency = max(1, concurrency)
+        self.scheduler = RequestScheduler(self.concurrency, initial_concurrency, adaptive_concurrency)
+        
+        # 共享的连接池会话，复用keep-alive连接（requests在用到时才导入，加快启动）
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        pool_size = max(10, self.concurrency)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        
+        # Ollama服务池：按正在进行的请求数分配请求，失败的服务暂时移出轮换；健康检查使用较短的超时
+        health_timeout = tuple(min(timeout, HEALTH_CHECK_TIMEOUT) for timeout in self.timeout)
+        self.pool = EndpointPool(endpoints, self.session, health_timeout, eject_time)
         
         # 第一次迭代的prompt - 处理原始文本
         self.first_prompt = """你是一个航空领域的专家，精通直升机、发动机、航空电子等专业知识。你的任务是优化文本格式并补充必要的专业细节：
@@ -92,49 +564,477 @@ class LLMProcessor:
 
         只返回处理后的句子，不要添加任何说明。"""
         
-        self._init_model()
+        # 模型生命周期管理：可用性检查、预加载和卸载
+        self.lifecycle = ModelLifecycle(self, keep_alive)
     
-    def _init_model(self):
-        try:
-            # 使用first_prompt进行初始化测试
-            response = self._generate_completion(self.first_prompt)
-            print("模型初始化完成")
-        except Exception as e:
-            print(f"❌ 初始化错误: {str(e)}")
+    def make_prompt(self, template, text):
+        """用单句prompt模板和句子构造 (系统消息, prompt)
+        
+        generate接口把句子填入模板，没有系统消息；chat接口把模板作为系统消息，句子单独作为prompt。
+        template为None时直接发送句子。
+        """
+        if template is None:
+            return None, text
+        if self.api == 'chat':
+            return template.format(text=CHAT_TEXT_PLACEHOLDER), text
+        return None, template.format(text=text)
     
-    def _generate_completion(self, prompt):
-        url = f"{self.base_url}/generate"
-        data = {
+    def _request(self, prompt, system=None, stream=False):
+        """构造请求，返回 (接口路径, 请求数据)"""
+        if self.api == 'chat':
+            messages = [{"role": "user", "content": prompt}]
+            if system:
+                messages.insert(0, {"role": "system", "content": system})
+            return "/chat", {
+                "model": self.model,
+                "messages": messages,
+                "stream": stream
+            }
+        return "/generate", {
             "model": self.model,
             "prompt": prompt,
-            "stream": False
+            "stream": stream
         }
-        response = requests.post(url, headers=self.headers, json=data)
-        return response.json().get('response', '')
+    
+    def _generate_completion(self, prompt, system=None, stage=None):
+        """发送生成请求，返回模型输出（可能为空字符串）
+        
+        启用缓存时，相同的请求直接返回缓存的结果，不再调用模型。
+        stage为统计prompt评估时间时使用的阶段。
+        """
+        path, data = self._request(prompt, system)
+        
+        if self.cache is None:
+            return self._post_with_retry(path, data, stage)
+        
+        key = self.cache.make_key(data)
+        response = self.cache.get(key)
+        if response is None:
+            response = self._post_with_retry(path, data, stage)
+            self.cache.put(key, response)
+        return response
+    
+    def _classify(self, prompt, labels, system=None, stage=None):
+        """发送分类请求，返回识别出的标签，无法识别时返回空字符串
+        
+        使用流式接口，一旦在已生成的内容中识别出标签就断开连接，不等模型生成完整回复。
+        """
+        path, data = self._request(prompt, system, stream=True)
+        
+        if self.cache is None:
+            return self._stream_until_label(path, data, labels, stage)
+        
+        key = self.cache.make_key(dict(data, labels=list(labels)))
+        label = self.cache.get(key)
+        if label is None:
+            label = self._stream_until_label(path, data, labels, stage)
+            self.cache.put(key, label)
+        return label
+    
+    def _stream_until_label(self, path, data, labels, stage=None):
+        """读取Ollama的NDJSON流式响应，识别出标签后立即停止；重试策略与_post_with_retry相同"""
+        import requests
+        
+        for attempt in range(self.max_retries + 1):
+            endpoint = self.pool.acquire(self.model)
+            failed = True
+            start_time = time.perf_counter()
+            first_token = True
+            text = ''
+            try:
+                with self.session.post(f"{endpoint.url}{path}", json=self.lifecycle.request_data(data),
+                                       timeout=self.timeout, stream=True) as response:
+                    if response.status_code in RETRY_STATUS_CODES:
+                        error = LLMError(f"HTTP {response.status_code}（{endpoint.url}）: {response.text[:200]}")
+                    elif response.status_code != 200:
+                        failed = False
+                        raise LLMError(f"HTTP {response.status_code}（{endpoint.url}）: {response.text[:200]}")
+                    else:
+                        failed = False
+                        for line in response.iter_lines():
+                            if not line:
+                                continue
+                            try:
+                                chunk = json.loads(line)
+                            except ValueError:
+                                raise LLMError(f"流式响应不是合法的JSON: {line[:200]!r}")
+                            if 'error' in chunk:
+                                raise LLMError(f"模型返回错误: {chunk['error']}")
+                            
+                            piece = self._response_text(chunk)
+                            if piece and first_token:
+                                first_token = False
+                                self._record_first_token(time.perf_counter() - start_time)
+                            text += piece
+                            # 提前停止时收不到最后一块，也就没有prompt评估统计
+                            if chunk.get('done'):
+                                self._record_prompt_eval(stage, chunk)
+                            
+                            # 识别出标签即返回，关闭连接后Ollama会停止生成
+                            label = parse_label(text, labels)
+                            if label or chunk.get('done'):
+                                return label
+                        return parse_label(text, labels)
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                failed = True
+                error = LLMError(f"请求失败（{endpoint.url}）: {e}")
+            finally:
+                self.pool.release(endpoint, failed)
+                self.scheduler.record(stage, time.perf_counter() - start_time, not failed)
+            
+            # 还有其他可用的服务时立即换一个服务重试，否则退避后重试
+            if attempt < self.max_retries and not self.pool.available(self.model):
+                time.sleep(self.backoff * (2 ** attempt) * (0.5 + random.random()))
+        
+        raise error
+    
+    def add_count(self, name, count=1):
+        """累加一个计数"""
+        with self.stats_lock:
+            self.counters[name] = self.counters.get(name, 0) + count
+    
+    def _record_first_token(self, seconds):
+        """记录一次首token时间"""
+        with self.stats_lock:
+            self.first_token_stats[0] += 1
+            self.first_token_stats[1] += seconds
+    
+    def average_first_token_time(self):
+        """分类请求的平均首token时间（秒），还没有记录时返回None"""
+        with self.stats_lock:
+            count, total = self.first_token_stats
+        return total / count if count else None
+    
+    def prompt_eval_summary(self):
+        """各阶段的prompt评估统计，按阶段顺序返回 [(阶段, 次数, 平均token数, 平均秒数)]"""
+        with self.stats_lock:
+            stats = dict(self.prompt_eval_stats)
+        return [(stage, stats[stage][0], stats[stage][1] / stats[stage][0], stats[stage][2] / stats[stage][0])
+                for stage in STAGE_NAMES if stage in stats]
+    
+    def _record_prompt_eval(self, stage, result):
+        """记录一次请求的prompt评估token数和耗时（Ollama返回的prompt_eval_count/prompt_eval_duration）"""
+        if stage is None or 'prompt_eval_duration' not in result:
+            return
+        with self.stats_lock:
+            stats = self.prompt_eval_stats.setdefault(stage, [0, 0, 0.0])
+            stats[0] += 1
+            stats[1] += result.get('prompt_eval_count', 0)
+            stats[2] += result['prompt_eval_duration'] / 1e9
+    
+    def _post_with_retry(self, path, data, stage=None):
+        """从服务池中选择一个服务发送请求并解析响应
+        
+        暂时性错误按指数退避加随机抖动重试（有其他可用的服务时立即换一个服务重试）；
+        重试耗尽、HTTP错误或响应格式错误时抛出LLMError，以便与模型正常返回空内容区分开。
+        """
+        import requests
+        
+        for attempt in range(self.max_retries + 1):
+            endpoint = self.pool.acquire(self.model)
+            start_time = time.perf_counter()
+            try:
+                response = self.session.post(f"{endpoint.url}{path}", json=self.lifecycle.request_data(data),
+                                             timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.pool.release(endpoint, failed=True)
+                self.scheduler.record(stage, ok=False)
+                error = LLMError(f"请求失败（{endpoint.url}）: {e}")
+            else:
+                failed = response.status_code in RETRY_STATUS_CODES
+                self.pool.release(endpoint, failed)
+                self.scheduler.record(stage, time.perf_counter() - start_time, not failed)
+                if not failed:
+                    return self._parse_response(response, stage)
+                error = LLMError(f"HTTP {response.status_code}（{endpoint.url}）: {response.text[:200]}")
+            
+            if attempt < self.max_retries and not self.pool.available(self.model):
+                # 指数退避，乘以0.5~1.5的随机因子，避免多个请求同时重试
+                time.sleep(self.backoff * (2 ** attempt) * (0.5 + random.random()))
+        
+        raise error
+    
+    def _response_text(self, result):
+        """取出响应（或流式响应的一块）中模型生成的文本"""
+        if self.api == 'chat':
+            return (result.get('message') or {}).get('content', '')
+        return result.get('response', '')
+    
+    def _parse_response(self, response, stage=None):
+        """解析Ollama的响应，HTTP错误或格式错误时抛出LLMError"""
+        if response.status_code != 200:
+            raise LLMError(f"HTTP {response.status_code}: {response.text[:200]}")
+        try:
+            result = response.json()
+        except ValueError:
+            raise LLMError(f"响应不是合法的JSON: {response.text[:200]}")
+        field = 'message' if self.api == 'chat' else 'response'
+        if not isinstance(result, dict) or field not in result:
+            raise LLMError(f"响应缺少{field}字段: {str(result)[:200]}")
+        self._record_prompt_eval(stage, result)
+        return self._response_text(result)
+    
+    def map_completions(self, prompts, callback=None, stage=None):
+        """并发发送多个生成请求，按prompts的顺序返回结果
+        
+        请求由共享的调度器执行，同时进行的请求数不超过concurrency，短的prompt先执行；
+        每完成一个请求调用一次callback(序号, 结果)（用于更新进度、记录日志），
+        任一请求失败时取消其余请求并抛出异常。
+        """
+        futures = [self.scheduler.submit(len(prompt), self._generate_completion, prompt, None, stage)
+                   for prompt in prompts]
+        return self._collect(futures, callback)
+    
+    def _collect(self, futures, callback=None):
+        """等待所有请求完成，按提交顺序返回结果；任一请求失败时取消其余请求并抛出异常"""
+        indexes = {future: i for i, future in enumerate(futures)}
+        try:
+            for future in as_completed(futures):
+                result = future.result()
+                if callback:
+                    callback(indexes[future], result)
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+        return [future.result() for future in futures]
+    
+    def map_prompt(self, template, texts, callback=None, labels=None, stage=None):
+        """用同一个单句prompt模板处理多条文本，按texts的顺序返回结果
+        
+        启用批量模式时，多条文本打包到一个请求中，要求模型返回按id对应的JSON数组；
+        否则每条文本单独请求。每处理完一条文本调用一次callback(序号, 结果)。
+        labels不为None时为分类请求，结果是识别出的标签（无法识别时为空字符串），
+        单条请求使用流式接口，识别出标签后立即停止生成。
+        """
+        if self.batch_size <= 1:
+            futures = []
+            for text in texts:
+                system, prompt = self.make_prompt(template, text)
+                cost = len(prompt) + len(system or '')
+                if labels is None:
+                    futures.append(self.scheduler.submit(cost, self._generate_completion, prompt, system, stage))
+                else:
+                    futures.append(self.scheduler.submit(cost, self._classify, prompt, labels, system, stage))
+            return self._collect(futures, callback)
+        
+        # 按数量和长度上限把文本分批
+        batches = []
+        batch = []
+        batch_chars = 0
+        for i, text in enumerate(texts):
+            if batch and (len(batch) >= self.batch_size or batch_chars + len(text) > self.batch_max_chars):
+                batches.append(batch)
+                batch = []
+                batch_chars = 0
+            batch.append((i + 1, text))
+            batch_chars += len(text)
+        if batch:
+            batches.append(batch)
+        
+        futures = [self.scheduler.submit(len(template) + sum(len(text) for _, text in batch),
+                                         self._complete_batch, template, batch, stage)
+                   for batch in batches]
+        results = {}
+        try:
+            for future in as_completed(futures):
+                for item_id, result in future.result().items():
+                    if labels is not None:
+                        result = parse_label(result, labels)
+                    results[item_id] = result
+                    if callback:
+                        callback(item_id - 1, result)
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+        return [results[i + 1] for i in range(len(texts))]
+    
+    def _complete_batch(self, template, items, stage=None):
+        """处理一批 (id, 文本)，返回 {id: 结果}
+        
+        回复不是合法的JSON数组或id对不上时，把这一批拆成两半分别重试；
+        只剩一条文本时退回单句prompt。chat接口中JSON数组作为用户消息，其余部分作为系统消息。
+        """
+        if len(items) == 1:
+            item_id, text = items[0]
+            system, prompt = self.make_prompt(template, text)
+            return {item_id: self._generate_completion(prompt, system, stage)}
+        
+        instructions = template.format(text=BATCH_TEXT_PLACEHOLDER)
+        items_json = json.dumps([{"id": item_id, "text": text} for item_id, text in items],
+                                ensure_ascii=False, indent=1)
+        if self.api == 'chat':
+            system = BATCH_PROMPT.format(instructions=instructions, items=CHAT_TEXT_PLACEHOLDER)
+            prompt = items_json
+        else:
+            system = None
+            prompt = BATCH_PROMPT.format(instructions=instructions, items=items_json)
+        results = parse_batch_response(self._generate_completion(prompt, system, stage),
+                                       [item_id for item_id, _ in items])
+        if results is not None:
+            return results
+        
+        middle = len(items) // 2
+        results = self._complete_batch(template, items[:middle], stage)
+        results.update(self._complete_batch(template, items[middle:], stage))
+        return results
+    
+    def close(self):
+        """关闭调度器、连接池和响应缓存"""
+        self.scheduler.shutdown()
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
 
     def initialize(self) -> bool:
-        """确保模型完全初始化"""
-        try:
-            print("正在初始化模型...", end=' ', flush=True)
-            response = self._generate_completion(self.init_prompt)
-            if response and "模型初始化完成" in response:
-                print("✓")
-                return True
-            else:
-                print("✗")
-                return False
-        except Exception as e:
-            print(f"✗\n初始化失败: {str(e)}")
+        """检查模型可用并预加载到内存，不依赖模型输出的文字"""
+        print("正在检查模型...", end=' ', flush=True)
+        error = self.lifecycle.check_available()
+        if error:
+            print(f"✗\n{error}")
             return False
+        print("✓")
+        
+        # 多个服务时列出每个服务的状态，不可用或没有该模型的服务不会收到请求
+        if len(self.pool.endpoints) > 1:
+            for endpoint in self.pool.endpoints:
+                if endpoint.error:
+                    state = f"✗ 无法访问: {endpoint.error}"
+                elif self.model not in endpoint.models:
+                    state = "✗ 没有该模型"
+                else:
+                    state = "✓"
+                print(f"  - {endpoint.url}: {state}")
+        
+        print("正在加载模型...", end=' ', flush=True)
+        error = self.lifecycle.preload()
+        if error:
+            print(f"✗\n{error}")
+            return False
+        print("✓")
+        return True
+
+def parse_keep_alive(value):
+    """解析keep_alive参数：纯数字按秒数（-1表示一直保留），否则按Ollama的时长字符串（如"30m"）"""
+    if value is None:
+        return None
+    value = str(value).strip()
+    return int(value) if re.fullmatch(r'-?\d+', value) else value
+
+class ModelLifecycle:
+    """Ollama模型的生命周期管理
+    
+    通过模型列表接口（/api/tags）检查服务和模型是否可用；发送空请求预加载模型，并用keep_alive
+    控制模型在内存中保留多久（每个请求都带上keep_alive，模型在文件之间、多次运行之间保持加载）；
+    需要时在退出前卸载模型（keep_alive为0）。使用多个服务时对每个提供该模型的服务分别操作。
+    """
+    
+    def __init__(self, processor, keep_alive=None):
+        self.processor = processor
+        self.keep_alive = parse_keep_alive(keep_alive)
+    
+    def request_data(self, data):
+        """给请求加上keep_alive设置（不影响缓存键）"""
+        if self.keep_alive is None:
+            return data
+        return dict(data, keep_alive=self.keep_alive)
+    
+    def check_available(self):
+        """检查至少有一个服务可以访问且已下载模型，正常时返回None，否则返回错误说明"""
+        pool = self.processor.pool
+        model = self.processor.model
+        if not pool.check_all():
+            errors = "; ".join(f"{endpoint.url}: {endpoint.error}" for endpoint in pool.endpoints)
+            return f"无法访问Ollama服务（{errors}）"
+        if not pool.serving(model):
+            return f"模型 {model} 不存在，请先执行 ollama pull {model}"
+        return None
+    
+    def _post_all(self, data):
+        """向每个提供该模型的服务发送同一个请求，返回 (服务数, [(失败的服务, 错误说明)])"""
+        processor = self.processor
+        endpoints = processor.pool.serving(processor.model)
+        failures = []
+        for endpoint in endpoints:
+            try:
+                response = processor.session.post(f"{endpoint.url}/generate", json=data,
+                                                   timeout=processor.timeout)
+            except Exception as e:
+                failures.append((endpoint, str(e)))
+                continue
+            if response.status_code != 200:
+                failures.append((endpoint, f"HTTP {response.status_code}: {response.text[:200]}"))
+        return len(endpoints), failures
+    
+    def preload(self):
+        """发送不带prompt的请求，让Ollama把模型加载到内存；成功时返回None，否则返回错误说明
+        
+        部分服务加载失败时把它们移出轮换，其余服务照常使用。
+        """
+        count, failures = self._post_all(self.request_data({"model": self.processor.model}))
+        for endpoint, _ in failures:
+            self.processor.pool.eject(endpoint)
+        if failures and len(failures) == count:
+            errors = "; ".join(f"{endpoint.url}: {error}" for endpoint, error in failures)
+            return f"预加载模型失败: {errors}"
+        return None
+    
+    def unload(self):
+        """请求Ollama立即把模型移出内存，返回是否全部成功"""
+        _, failures = self._post_all({"model": self.processor.model, "keep_alive": 0})
+        return not failures
+
+def parse_label(response, labels=SENTENCE_LABELS):
+    """从模型回复中识别第一个出现的标签（忽略大小写、空白和多余的说明文字），识别不出时返回空字符串"""
+    match = re.search(r'(?<![A-Za-z])(' + '|'.join(labels) + r')(?![A-Za-z])', response or '', re.I)
+    return match.group(1).upper() if match else ''
 
-def clean_text(text: str) -> str:
-    """清理文本，去除markdown标记和特殊符号"""
-    # 去除markdown标题标记
-    text = re.sub(r'^#+\s*', '', text)
+def parse_batch_response(response, ids):
+    """解析批量请求的回复，返回 {id: 结果}；格式不对或id与输入不一致时返回None"""
+    match = JSON_ARRAY_PATTERN.search(response or '')
+    if not match:
+        return None
+    try:
+        items = json.loads(match.group())
+    except ValueError:
+        return None
+    if not isinstance(items, list):
+        return None
     
-    # 去除markdown列表标记
-    text = re.sub(r'^\s*[-*]\s*', '', text)  # 无序列表标记 - 和 *
-    text = re.sub(r'^\s*\d+\.\s*', '', text)  # 有序列表标记 1. 2. 等
+    results = {}
+    for item in items:
+        if not isinstance(item, dict) or not isinstance(item.get('result'), str):
+            return None
+        try:
+            item_id = int(item.get('id'))
+        except (TypeError, ValueError):
+            return None
+        results[item_id] = item['result'].strip()
+    
+    if len(items) != len(ids) or set(results) != set(ids):
+        return None
+    return results
+
+# 句末标点
+SENTENCE_END_CHARS = '。！？；!?;'
+
+# 流式读取时窗口的切分位置（见split_sentences.find_window_cut）：优先切在后面紧跟换行的句末标点之后，
+# markdown标记不会跨越这个位置；缓冲区过大时退而切在最后一个句末标点之后
+WINDOW_CUT_PATTERNS = (re.compile(r'[。！？；?!;](?=\n)'), re.compile(r'[。！？；?!;]'))
+
+def clean_text(text: str, at_start: bool = True) -> str:
+    """清理文本，去除markdown标记和特殊符号
+    
+    at_start为False表示text是流式读取中间的一段，不处理只针对全文开头的标记。
+    """
+    if at_start:
+        # 去除markdown标题标记
+        text = re.sub(r'^#+\s*', '', text)
+        
+        # 去除markdown列表标记
+        text = re.sub(r'^\s*[-*]\s*', '', text)  # 无序列表标记 - 和 *
+        text = re.sub(r'^\s*\d+\.\s*', '', text)  # 有序列表标记 1. 2. 等
     
     # 去除markdown加粗和斜体标记
     text = re.sub(r'\*\*(.+?)\*\*', r'\1', text)
@@ -146,10 +1046,235 @@ def clean_text(text: str) -> str:
     
     return text.strip()
 
-def split_sentences_with_jieba(text: str) -> List[str]:
+# 第四阶段规则清理使用的模式
+# 句首的编号和符号：1. 1.2. 1、 1) (1) （一） 一、 ① • 以及markdown的 - * # > 等；数字后面必须是编号标点，
+# 不会删掉句首的数量和小数（如“10 号螺栓”“1.5毫米”）。- * # > 后面必须有空白（markdown列表和标题），
+# 编号和符号直接跟着数字或“号”时不删除（如“-40℃”“#3发动机”“一、二号发动机”）
+LEADING_MARK_PATTERN = re.compile(
+    r'^(?:\s+|[-*#>]+\s+|(?:[•·]|\d+(?:\.\d+)*(?:[.．](?!\d)|[、)）])|[(（][\d一二三四五六七八九十]+[)）]'
+    r'|[一二三四五六七八九十]+[、.．]|[①-⑳])(?!\d|[一二三四五六七八九十]*号))'
+)
+# markdown加粗标记
+MARKDOWN_BOLD_PATTERN = re.compile(r'\*\*(.+?)\*\*')
+# 中文后面的半角标点
+HALF_WIDTH_PUNCTUATION = {',': '，', ';': '；', ':': '：', '?': '？', '!': '！'}
+HALF_WIDTH_PATTERN = re.compile(r'(?<=[\u4e00-\u9fff])[,;:?!]')
+# 中文后面句末的半角句号
+HALF_WIDTH_PERIOD_PATTERN = re.compile(r'(?<=[\u4e00-\u9fff])\.$')
+# 重复的标点，以及句末标点前多余的逗号顿号等
+DUPLICATE_PUNCTUATION_PATTERN = re.compile(r'([，。！？；：、])\1+')
+REDUNDANT_PUNCTUATION_PATTERN = re.compile(r'[，、；：]+([。！？])')
+CHINESE_START_PATTERN = re.compile(r'^[\u4e00-\u9fff]')
+
+def rule_clean(sentence: str) -> str:
+    """第四阶段的确定性规则清理：去掉句首编号和符号、统一中文标点、去掉重复标点"""
+    text = MARKDOWN_BOLD_PATTERN.sub(r'\1', sentence.strip())
+    while True:
+        cleaned = LEADING_MARK_PATTERN.sub('', text)
+        if cleaned == text:
+            break
+        text = cleaned
+    
+    text = HALF_WIDTH_PATTERN.sub(lambda m: HALF_WIDTH_PUNCTUATION[m.group()], text)
+    text = HALF_WIDTH_PERIOD_PATTERN.sub('。', text)
+    text = DUPLICATE_PUNCTUATION_PATTERN.sub(r'\1', text)
+    text = REDUNDANT_PUNCTUATION_PATTERN.sub(r'\1', text)
+    return text
+
+def passes_rule_checks(sentence: str) -> bool:
+    """规则清理后的句子是否已满足第四阶段的格式要求（满足时不再请求模型）"""
+    return (bool(CHINESE_START_PATTERN.match(sentence))
+            and not HALF_WIDTH_PATTERN.search(sentence)
+            and not DUPLICATE_PUNCTUATION_PATTERN.search(sentence)
+            and not REDUNDANT_PUNCTUATION_PATTERN.search(sentence)
+            and '**' not in sentence and '#' not in sentence)
+
+# 第三阶段本地分类使用的特征
+STEP_VERBS = ('拆下', '拆卸', '安装', '检查', '清洗', '更换', '校准', '紧固', '润滑', '测量', '调整', '连接',
+              '断开', '打开', '关闭', '拧紧', '取下', '装上', '确认', '记录', '按下', '启动', '复位', '插入',
+              '拔出', '拆除', '放置', '固定', '清洁', '涂抹')
+SEQUENCE_WORDS = ('然后', '随后', '接着', '之后', '最后', '其次', '再次', '完成后')
+STEP_NUMBER_PATTERN = re.compile(r'(?:^|[，；。：\s])[(（]?\d+[.)）、]')
+INNER_END_PATTERN = re.compile(r'[。！？；](?=.)')
+CHINESE_CHAR_PATTERN = re.compile(r'[一-鿿]')
+
+def sentence_features(sentence: str) -> dict:
+    """提取第三阶段分类用的特征"""
+    text = sentence.strip()
+    chinese = len(CHINESE_CHAR_PATTERN.findall(text))
+    return {
+        'length': len(text),
+        'chinese': chinese,
+        'chinese_ratio': chinese / len(text) if text else 0.0,
+        'inner_ends': len(INNER_END_PATTERN.findall(text)),
+        'commas': text.count('，'),
+        'verbs': sum(text.count(verb) for verb in STEP_VERBS),
+        'sequences': sum(text.count(word) for word in SEQUENCE_WORDS),
+        'step_numbers': len(STEP_NUMBER_PATTERN.findall(text)),
+    }
+
+class StageClassifier:
+    """第三阶段 SINGLE/MULTIPLE/INVALID 的本地分类器
+    
+    默认使用启发式规则；model_path指向的朴素贝叶斯模型存在时使用模型（由decision日志中模型的判断训练得到）。
+    置信度不低于threshold时直接采用本地结果，否则交给模型判断。
+    每次判断都追加写入log_path，便于之后用模型的判断重新训练。
+    """
+    
+    def __init__(self, threshold=0.8, model_path=None, log_path=None):
+        self.threshold = threshold
+        self.model = None
+        self.log_path = log_path
+        self.lock = threading.Lock()
+        if model_path and os.path.exists(model_path):
+            with open(model_path, 'r', encoding='utf-8') as f:
+                self.model = json.load(f)
+    
+    def predict(self, sentence: str) -> Tuple[str, float]:
+        """返回 (标签, 置信度)"""
+        if self.model is not None:
+            return self._predict_model(sentence)
+        return self._predict_heuristic(sentence_features(sentence))
+    
+    @staticmethod
+    def _predict_heuristic(features: dict) -> Tuple[str, float]:
+        """启发式规则：标点、操作动词、顺序词和长度"""
+        if features['chinese'] == 0:
+            return 'INVALID', 0.95
+        if features['chinese_ratio'] < 0.3:
+            # 带英文部件名、件号的操作步骤中文比例也很低，含操作动词时交给模型判断
+            return ('INVALID', 0.85) if features['verbs'] == 0 else ('SINGLE', 0.5)
+        # 很短的句子可能是“检查”“复位”这类有效的操作，交给模型判断
+        if features['chinese'] < 4:
+            return 'INVALID', 0.5
+        if features['step_numbers'] >= 2:
+            return 'MULTIPLE', 0.9
+        if features['inner_ends'] >= 1 and features['verbs'] >= 2:
+            return 'MULTIPLE', 0.9
+        if features['sequences'] >= 1 and features['verbs'] >= 2:
+            return 'MULTIPLE', 0.85
+        if features['verbs'] >= 3 and features['commas'] >= 2:
+            return 'MULTIPLE', 0.7
+        if features['verbs'] <= 1 and features['inner_ends'] == 0 and features['length'] <= 80:
+            return 'SINGLE', 0.9
+        if features['verbs'] == 2 and features['sequences'] == 0 and features['inner_ends'] == 0:
+            return 'SINGLE', 0.6
+        return 'SINGLE', 0.5
+    
+    @staticmethod
+    def model_tokens(sentence: str) -> List[str]:
+        """朴素贝叶斯模型使用的特征：分桶后的数值特征和字符二元组"""
+        features = sentence_features(sentence)
+        tokens = [
+            f"length:{min(features['length'] // 20, 10)}",
+            f"ratio:{int(features['chinese_ratio'] * 5)}",
+            f"inner_ends:{min(features['inner_ends'], 3)}",
+            f"commas:{min(features['commas'], 4)}",
+            f"verbs:{min(features['verbs'], 4)}",
+            f"sequences:{min(features['sequences'], 2)}",
+            f"step_numbers:{min(features['step_numbers'], 3)}",
+        ]
+        text = sentence.strip()
+        tokens.extend(text[i:i + 2] for i in range(len(text) - 1))
+        return tokens
+    
+    def _predict_model(self, sentence: str) -> Tuple[str, float]:
+        """用朴素贝叶斯模型计算各标签的后验概率，返回概率最大的标签"""
+        scores = {}
+        vocabulary_size = self.model['vocabulary_size']
+        for label, stats in self.model['labels'].items():
+            score = math.log(stats['prior'])
+            denominator = stats['total'] + vocabulary_size
+            for token in self.model_tokens(sentence):
+                score += math.log((stats['counts'].get(token, 0) + 1) / denominator)
+            scores[label] = score
+        best = max(scores, key=scores.get)
+        total = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1 / total
+    
+    def log_decision(self, sentence: str, label: str, confidence: float, source: str, local_label: str):
+        """记录一次判断；source为local（本地分类）或llm（交给模型）"""
+        if not self.log_path:
+            return
+        line = json.dumps({"text": sentence, "label": label, "source": source, "local_label": local_label,
+                           "confidence": round(confidence, 4)}, ensure_ascii=False)
+        with self.lock:
+            if os.path.dirname(self.log_path):
+                os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+            with open(self.log_path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+    
+    @classmethod
+    def train(cls, log_path: str, model_path: str) -> int:
+        """用日志中模型给出的判断训练朴素贝叶斯模型并保存，返回训练样本数"""
+        counts = {label: {} for label in SENTENCE_LABELS}
+        documents = {label: 0 for label in SENTENCE_LABELS}
+        seen = set()
+        with open(log_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get('source') != 'llm' or entry.get('label') not in counts:
+                    continue
+                if entry['text'] in seen:
+                    continue
+                seen.add(entry['text'])
+                documents[entry['label']] += 1
+                label_counts = counts[entry['label']]
+                for token in cls.model_tokens(entry['text']):
+                    label_counts[token] = label_counts.get(token, 0) + 1
+        
+        samples = sum(documents.values())
+        if samples == 0:
+            return 0
+        vocabulary = set()
+        for label_counts in counts.values():
+            vocabulary.update(label_counts)
+        model = {
+            'vocabulary_size': len(vocabulary),
+            'labels': {
+                label: {
+                    'prior': (documents[label] + 1) / (samples + len(SENTENCE_LABELS)),
+                    'total': sum(counts[label].values()),
+                    'counts': counts[label],
+                }
+                for label in SENTENCE_LABELS
+            },
+        }
+        with open(model_path, 'w', encoding='utf-8') as f:
+            json.dump(model, f, ensure_ascii=False)
+        return samples
+
+def split_sentences_by_punctuation(text: str, at_start: bool = True) -> List[str]:
+    """按句末标点逐字符分句，不需要分词器，结果与split_sentences_with_jieba相同"""
+    # 确保标点符号后换行
+    text = clean_text(text, at_start)
+    
+    sentences = []
+    for line in text.split('\n'):
+        start = 0
+        for i, char in enumerate(line):
+            if char in SENTENCE_END_CHARS:
+                sentence = line[start:i + 1].strip()
+                if sentence:
+                    sentences.append(sentence)
+                start = i + 1
+        
+        # 处理最后一个句子
+        sentence = line[start:].strip()
+        if sentence:
+            sentences.append(sentence)
+    
+    return sentences
+
+def split_sentences_with_jieba(text: str, at_start: bool = True) -> List[str]:
     """使用jieba进行分句"""
+    import jieba  # 只有选择jieba分句时才导入，避免启动时加载词典
+    
     # 确保标点符号后换行
-    text = clean_text(text)
+    text = clean_text(text, at_start)
     
     # 使用jieba分词
     sentences = []
@@ -163,7 +1288,7 @@ def split_sentences_with_jieba(text: str) -> List[str]:
         
         for word in words:
             current_sentence.append(word)
-            if word in '。！？；!?;':
+            if word in SENTENCE_END_CHARS:
                 sentence = ''.join(current_sentence).strip()
                 if sentence:
                     sentences.append(sentence)
@@ -177,6 +1302,36 @@ def split_sentences_with_jieba(text: str) -> List[str]:
     
     return sentences
 
+def iter_sentences_from_file(input_path: str, window_size: int = CHUNK_SIZE,
+                             splitter: str = 'punctuation') -> Iterator[str]:
+    """分块读取文件并逐句产出初步分句结果，内存占用只与窗口大小有关
+    
+    窗口在句末标点之后切开，跨窗口的半个句子保留到下一个窗口，结果与整篇分句一致；
+    没有句末标点的超长文本会被强制切开，缓冲区大小有上限。splitter为SENTENCE_SPLITTERS中的分句方式。
+    """
+    split = SENTENCE_SPLITTERS[splitter]
+    buffer = ''
+    at_start = True
+    for chunk in iter_text_chunks(input_path, window_size):
+        buffer += chunk
+        if at_start:
+            buffer = buffer.lstrip()
+        cut = find_window_cut(buffer, window_size, WINDOW_CUT_PATTERNS)
+        if cut == 0:
+            continue
+        yield from split(buffer[:cut], at_start)
+        buffer = buffer[cut:]
+        at_start = False
+    
+    if buffer.strip():
+        yield from split(buffer, at_start)
+
+# 可选的分句方式
+SENTENCE_SPLITTERS = {
+    'punctuation': split_sentences_by_punctuation,
+    'jieba': split_sentences_with_jieba,
+}
+
 def create_done_marker(input_path: str, output_dir: str):
     """创建处理完成标记文件"""
     # 在输出目录创建.done文件
@@ -203,119 +1358,269 @@ def is_file_processed(input_path: str, output_dir: str) -> bool:
     
     return False
 
-def process_text_iteratively(text: str, llm_processor: LLMProcessor, output_dir: str, progress_bar: tqdm) -> bool:
-    """四次迭代处理文本"""
+class SentenceRecord:
+    """流水线中的一个句子：lineage为来源编号（如"3"、MULTIPLE拆分后的"3-2"），
+    history按顺序记录修改过它的阶段及修改前的内容"""
+    __slots__ = ('lineage', 'source', 'text', 'label', 'history')
+    
+    def __init__(self, lineage: str, source: str, text: str, history: list = None):
+        self.lineage = lineage
+        self.source = source
+        self.text = text
+        self.label = ''
+        self.history = history if history is not None else []
+    
+    def update(self, stage: str, new_text: str) -> bool:
+        """模型返回了不同的非空内容时更新句子（去掉首尾空白），返回是否有修改"""
+        new_text = (new_text or '').strip()
+        if not new_text or new_text == self.text:
+            return False
+        self.history.append((stage, self.text))
+        self.text = new_text
+        return True
+
+class SentenceJournal:
+    """单个输入文件的处理日志（追加写入的JSONL）
+    
+    首行记录输入文件的签名（大小、修改时间）和模型名称，之后每行记录一个 (阶段, 句子编号) 的模型结果。
+    重新运行时签名一致则回放已有结果，从中断处继续；签名不一致（输入或模型变了）则清空重来。
+    """
+    
+    def __init__(self, path: str, signature: dict):
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+        
+        if os.path.exists(path):
+            self._replay(signature)
+        
+        if self.entries:
+            self.file = open(path, 'a', encoding='utf-8')
+        else:
+            self.file = open(path, 'w', encoding='utf-8')
+            self.file.write(json.dumps(signature, ensure_ascii=False) + '\n')
+            self.file.flush()
+    
+    def _replay(self, signature: dict):
+        """读取已有日志；签名不一致时忽略
+        
+        最后一行写了一半（崩溃时）时把它从文件中截掉，之后追加的记录才会从新的一行开始。
+        """
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        complete = data.rfind(b'\n') + 1
+        lines = data[:complete].decode('utf-8').split('\n')
+        try:
+            if json.loads(lines[0]) != signature:
+                return
+        except ValueError:
+            return
+        if complete < len(data):
+            os.truncate(self.path, complete)
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            self.entries[(entry['stage'], entry['key'])] = entry['result']
+    
+    def get(self, stage: str, key: str):
+        """查询已记录的结果，没有时返回None"""
+        return self.entries.get((stage, key))
+    
+    def record(self, stage: str, key: str, result: str):
+        """追加记录一个结果"""
+        line = json.dumps({"stage": stage, "key": key, "result": result}, ensure_ascii=False)
+        with self.lock:
+            self.entries[(stage, key)] = result
+            self.file.write(line + '\n')
+            self.file.flush()
+    
+    def close(self):
+        self.file.close()
+    
+    def compact(self):
+        """结果已写入最终输出后删除日志"""
+        self.close()
+        os.remove(self.path)
+
+def journal_path(output_dir: str) -> str:
+    """输出目录对应的处理日志路径（与输出目录同级的隐藏文件）"""
+    parent_dir = os.path.dirname(os.path.abspath(output_dir))
+    return os.path.join(parent_dir, f".{os.path.basename(output_dir)}{JOURNAL_SUFFIX}")
+
+def run_stage(llm_processor: LLMProcessor, journal: SentenceJournal, stage: str, records: list,
+              template: str = None, callback=None, labels=None) -> List[str]:
+    """对records执行一个阶段的模型请求，返回与records一一对应的结果
+    
+    日志中已有的结果直接复用，其余的并发请求模型，每得到一个结果立即写入日志。
+    template为None时直接把句子作为prompt。
+    """
+    results = [journal.get(stage, record.lineage) if journal else None for record in records]
+    pending = [i for i, result in enumerate(results) if result is None]
+    if callback:
+        for _ in range(len(records) - len(pending)):
+            callback()
+    
+    def on_result(index, result):
+        i = pending[index]
+        results[i] = result
+        if journal:
+            journal.record(stage, records[i].lineage, result)
+        if callback:
+            callback()
+    
+    texts = [records[i].text for i in pending]
+    if template is None:
+        llm_processor.map_completions(texts, on_result, stage)
+    else:
+        llm_processor.map_prompt(template, texts, on_result, labels, stage)
+    return results
+
+def process_text_iteratively(text: str, llm_processor: LLMProcessor, progress_bar: 'tqdm',
+                             sentences: Iterator[str] = None,
+                             journal: SentenceJournal = None) -> List[SentenceRecord]:
+    """四次迭代处理文本，返回最终的句子记录列表（按原文顺序），出错时返回None
+    
+    sentences不为None时直接使用这些（可以是惰性产出的）初步分句结果，忽略text。
+    所有阶段都在内存中进行，每个阶段内的句子并发发送给模型（并发数由LLMProcessor控制）。
+    journal不为None时每个结果都写入处理日志，日志中已有的结果不再请求模型。
+    """
     try:
         # 第一次迭代：先分句，再处理每个句子
         progress_bar.set_description("第一阶段：分句和格式优化")
         
-        # 先使用jieba进行初步分句
-        initial_sentences = split_sentences_with_jieba(text)
-        
-        # 对每个句子使用first_prompt进行处理
-        first_iter_files = []
-        for i, sentence in enumerate(initial_sentences, 1):
-            # 使用first_prompt处理每个句子
-            processed = llm_processor._generate_completion(sentence)
-            if not processed:
-                processed = sentence
-                
-            # 保存处理结果
-            file_path = os.path.join(output_dir, f"{i}.txt")
-            with open(file_path, 'w', encoding='utf-8') as f:
-                f.write(processed)
-            first_iter_files.append(file_path)
+        # 先进行初步分句
+        split = SENTENCE_SPLITTERS[llm_processor.splitter]
+        # 分批取用时必须是迭代器：对列表反复islice会一直从头开始
+        initial_sentences = iter(split(text) if sentences is None else sentences)
+        
+        # 对每个句子使用first_prompt进行处理，分批并发以保持内存占用有界；
+        # generate接口保持原来的做法直接发送句子，chat接口把first_prompt作为系统消息
+        first_template = llm_processor.first_prompt if llm_processor.api == 'chat' else None
+        records = []
+        batch_size = llm_processor.concurrency * 4
+        while True:
+            batch = [SentenceRecord(str(len(records) + i), sentence, sentence)
+                     for i, sentence in enumerate(itertools.islice(initial_sentences, batch_size), 1)]
+            if not batch:
+                break
+            results = run_stage(llm_processor, journal, "1", batch, first_template)
+            for record, processed in zip(batch, results):
+                record.update("第一阶段", processed)
+            records.extend(batch)
             
         progress_bar.update(33)
         
         # 第二次迭代：检查每个句子
         progress_bar.set_description("第二阶段：优化句子完整性")
-        for i, file_path in enumerate(first_iter_files):
-            with open(file_path, 'r', encoding='utf-8') as f:
-                sentence = f.read().strip()
-            
-            # 处理句子
-            prompt = llm_processor.second_prompt.format(text=sentence)
-            second_processed = llm_processor._generate_completion(prompt)
-            
-            if second_processed and second_processed != sentence:
-                # 如果内容有修改，创建新文件
-                new_file_path = os.path.join(output_dir, f"{i+1}-1.txt")
-                with open(new_file_path, 'w', encoding='utf-8') as f:
-                    f.write(second_processed)
-                # 删除原文件
-                os.remove(file_path)
-            
-            progress_bar.update(33 / len(first_iter_files))
+        results = run_stage(llm_processor, journal, "2", records, llm_processor.second_prompt,
+                            lambda: progress_bar.update(33 / len(records)))
+        for record, second_processed in zip(records, results):
+            record.update("第二阶段", second_processed)
         
         # 第三次迭代：判断分句
         progress_bar.set_description("第三阶段：最终分句检查")
-        second_iter_files = [f for f in os.listdir(output_dir) if f.endswith('.txt') and f != '0.txt']
         
-        for file_name in second_iter_files:
-            file_path = os.path.join(output_dir, file_name)
-            with open(file_path, 'r', encoding='utf-8') as f:
-                sentence = f.read().strip()
-            
-            # 判断是否需要分句
-            prompt = llm_processor.third_prompt.format(text=sentence)
-            sentence_type = llm_processor._generate_completion(prompt)
-            
-            if sentence_type == "INVALID":
-                os.remove(file_path)
+        def show_first_token_time():
+            first_token_time = llm_processor.average_first_token_time()
+            if first_token_time is not None:
+                progress_bar.set_postfix_str(f"首token {first_token_time:.2f}秒")
+        
+        # 本地分类器置信度足够时直接采用，其余交给模型判断
+        classifier = llm_processor.classifier
+        llm_records = records
+        predictions = {}
+        if classifier is not None:
+            llm_records = []
+            for record in records:
+                label, confidence = classifier.predict(record.text)
+                if confidence >= classifier.threshold:
+                    record.label = label
+                    classifier.log_decision(record.text, label, confidence, 'local', label)
+                else:
+                    predictions[record.lineage] = (label, confidence)
+                    llm_records.append(record)
+            llm_processor.add_count('local_classified', len(records) - len(llm_records))
+        
+        sentence_types = run_stage(llm_processor, journal, "3", llm_records, llm_processor.third_prompt,
+                                   show_first_token_time, labels=SENTENCE_LABELS)
+        for record, sentence_type in zip(llm_records, sentence_types):
+            record.label = sentence_type
+            if classifier is not None:
+                local_label, confidence = predictions[record.lineage]
+                classifier.log_decision(record.text, sentence_type, confidence, 'llm', local_label)
+        
+        # 判断为SINGLE的句子检查是否需要优化
+        single_records = [record for record in records if record.label == "SINGLE"]
+        results = run_stage(llm_processor, journal, "3-single", single_records, llm_processor.second_prompt)
+        for record, final_processed in zip(single_records, results):
+            record.update("第三阶段", final_processed)
+        
+        # 删除无效句子，需要分句的拆成多个句子
+        third_records = []
+        for record in records:
+            if record.label == "INVALID":
                 continue
-                
-            base_name = os.path.splitext(file_name)[0]
-            
-            if sentence_type == "MULTIPLE":
-                # 需要分句，创建多个新文件
-                sub_sentences = split_sentences_with_jieba(sentence)
+            if record.label == "MULTIPLE":
+                sub_sentences = split(record.text)
                 for j, sub_sentence in enumerate(sub_sentences, 1):
-                    new_file_path = os.path.join(output_dir, f"{base_name}-{j}.txt")
-                    with open(new_file_path, 'w', encoding='utf-8') as f:
-                        f.write(sub_sentence)
-                # 删除原文件
-                os.remove(file_path)
-            elif sentence_type == "SINGLE":
-                # 检查是否需要优化
-                prompt = llm_processor.second_prompt.format(text=sentence)
-                final_processed = llm_processor._generate_completion(prompt)
-                
-                if final_processed and final_processed != sentence:
-                    new_file_path = os.path.join(output_dir, f"{base_name}-1.txt")
-                    with open(new_file_path, 'w', encoding='utf-8') as f:
-                        f.write(final_processed)
-                    os.remove(file_path)
+                    history = record.history + [("第三阶段拆分", record.text)]
+                    third_records.append(SentenceRecord(f"{record.lineage}-{j}", record.source, sub_sentence,
+                                                        history))
+            else:
+                third_records.append(record)
+        records = third_records
         
         # 第四次迭代：最终清理
         progress_bar.set_description("第四阶段：最终格式清理")
-        third_iter_files = [f for f in os.listdir(output_dir) if f.endswith('.txt') and f != '0.txt']
         
-        for file_name in third_iter_files:
-            file_path = os.path.join(output_dir, file_name)
-            with open(file_path, 'r', encoding='utf-8') as f:
-                sentence = f.read().strip()
-            
-            # 最终清理
-            prompt = llm_processor.fourth_prompt.format(text=sentence)
-            final_processed = llm_processor._generate_completion(prompt)
-            
-            if final_processed and final_processed != sentence:
-                # 如果内容有修改，创建新文件
-                base_name = os.path.splitext(file_name)[0]
-                new_file_path = os.path.join(output_dir, f"{base_name}-1.txt")
-                with open(new_file_path, 'w', encoding='utf-8') as f:
-                    f.write(final_processed)
-                # 删除原文件
-                os.remove(file_path)
-            
-            progress_bar.update((100 - progress_bar.n) / len(third_iter_files))
+        # 先用规则清理，仍不满足格式要求的句子才请求模型（发送规则清理前的句子，避免规则误删的内容无法恢复）
+        if llm_processor.rule_cleaner:
+            llm_records = []
+            for record in records:
+                cleaned = rule_clean(record.text)
+                if passes_rule_checks(cleaned):
+                    record.update("第四阶段规则清理", cleaned)
+                else:
+                    llm_records.append(record)
+            llm_processor.add_count('rule_cleaned', len(records) - len(llm_records))
+        else:
+            llm_records = records
         
-        return True
+        results = run_stage(llm_processor, journal, "4", llm_records, llm_processor.fourth_prompt,
+                            lambda: progress_bar.update((100 - progress_bar.n) / len(llm_records)))
+        for record, final_processed in zip(llm_records, results):
+            record.update("第四阶段", final_processed)
+        
+        return records
         
     except Exception as e:
         print(f"\n处理文本时出错: {str(e)}")
-        return False
+        return None
+
+def save_records(records: List[SentenceRecord], input_path: str, output_dir: str):
+    """一次性保存处理结果：N.txt为最终句子，0.txt为索引（每个句子的来源和修改阶段），并写入完成标记
+    
+    先写入同级的临时目录，全部完成后再替换输出目录，中途崩溃不会留下不完整的结果。
+    """
+    parent_dir = os.path.dirname(os.path.abspath(output_dir))
+    tmp_dir = os.path.join(parent_dir, f".{os.path.basename(output_dir)}.{os.getpid()}{TMP_SUFFIX}")
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    
+    index_lines = [f"本目录下的处理结果来自文件：{os.path.basename(input_path)}"]
+    for i, record in enumerate(records, 1):
+        with open(os.path.join(tmp_dir, f"{i}.txt"), 'w', encoding='utf-8') as f:
+            f.write(record.text)
+        stages = '、'.join(stage for stage, _ in record.history) or '无'
+        index_lines.append(f"{i}.txt\t来源句子：{record.lineage}\t修改阶段：{stages}")
+    with open(os.path.join(tmp_dir, '0.txt'), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(index_lines))
+    
+    create_done_marker(input_path, tmp_dir)
+    replace_output(tmp_dir, output_dir)
 
 def process_file(input_path: str, output_dir: str, llm_processor: LLMProcessor) -> Tuple[bool, float]:
     """处理单个文件
@@ -328,62 +1633,88 @@ def process_file(input_path: str, output_dir: str, llm_processor: LLMProcessor)
         if is_file_processed(input_path, output_dir):
             return True, 0
         
-        # 读取文件
-        with open(input_path, 'r', encoding='utf-8') as f:
-            text = f.read().strip()
-        
-        if not text:
+        # 流式读取文件并初步分句，不把整个文件读入内存
+        sentences = iter_sentences_from_file(input_path, splitter=llm_processor.splitter)
+        first_sentence = next(sentences, None)
+        if first_sentence is None:
             return False, 0
-        
-        # 创建输出目录
-        os.makedirs(output_dir, exist_ok=True)
+        sentences = itertools.chain([first_sentence], sentences)
         
         print(f"\n处理文件：{os.path.basename(input_path)}")
         print(f"输出目录：{output_dir}")
         
+        # 打开处理日志：上次中断时已得到的结果直接回放
+        stat = os.stat(input_path)
+        signature = {"input": os.path.basename(input_path), "size": stat.st_size,
+                     "mtime": stat.st_mtime_ns, "model": llm_processor.model, "api": llm_processor.api}
+        journal = SentenceJournal(journal_path(output_dir), signature)
+        if journal.entries:
+            print(f"从处理日志恢复 {len(journal.entries)} 条结果")
+        
         # 更新进度条总量为125（为第四次迭代预留25%）
+        from tqdm import tqdm
         with tqdm(total=125, desc="初始化处理", unit="%") as pbar:
-            success = process_text_iteratively(text, llm_processor, output_dir, pbar)
+            with llm_processor.scheduler.job(stat.st_size):
+                records = process_text_iteratively(None, llm_processor, pbar, sentences, journal)
         
-        if success:
-            # 创建处理完成标记
-            create_done_marker(input_path, output_dir)
-            elapsed_time = time.time() - start_time
-            print(f"✓ 成功处理：{os.path.basename(input_path)}")
-            print(f"处理耗时：{elapsed_time:.2f}秒")
-            
-            # 打印最终文件列表
-            final_files = [f for f in os.listdir(output_dir) if f.endswith('.txt') and f != '0.txt']
-            print(f"生成文件：{len(final_files)} 个")
-            for f in sorted(final_files):
-                file_path = os.path.join(output_dir, f)
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    content = file.read().strip()
-                print(f"  - {f}: {content[:50]}...")
+        if records is None:
+            journal.close()
+            return False, time.time() - start_time
+        
+        # 一次性保存结果和处理完成标记，然后删除已经合并到结果中的日志
+        save_records(records, input_path, output_dir)
+        journal.compact()
+        elapsed_time = time.time() - start_time
+        print(f"✓ 成功处理：{os.path.basename(input_path)}")
+        print(f"处理耗时：{elapsed_time:.2f}秒")
         
-        return success, time.time() - start_time
+        # 打印最终文件列表
+        print(f"生成文件：{len(records)} 个")
+        for i, record in enumerate(records, 1):
+            print(f"  - {i}.txt: {record.text[:50]}...")
+        
+        return True, time.time() - start_time
         
     except Exception as e:
         print(f"\n✗ 处理文件时出错: {str(e)}")
         return False, time.time() - start_time
 
-def process_directory(input_dir: str, output_dir: str):
-    """处理整个目录"""
+def process_directory(input_dir: str, output_dir: str, llm_options: dict = None, file_workers: int = 1,
+                      unload_on_exit: bool = False):
+    """处理整个目录
+    
+    llm_options为创建LLMProcessor时的参数（超时、重试、并发数等）；
+    file_workers大于1时同时处理多个文件，所有文件共享LLMProcessor的请求并发上限。
+    unload_on_exit为True时，处理结束（包括出错或中断）后把模型移出内存。
+    """
     total_start_time = time.time()
     print(f"\n=== 文本处理工具 ===")
     print(f"开始时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     
     # 初始化LLM处理器
-    llm_processor = LLMProcessor()
+    llm_processor = LLMProcessor(**(llm_options or {}))
     if not llm_processor.initialize():
         print("模型初始化失败，程序退出")
+        llm_processor.close()
         return
         
-    # 初始化jieba
-    print("正在初始化分词模型...", end=' ', flush=True)
-    import jieba
-    _ = jieba.lcut("初始化测试")  # 触发jieba初始化
-    print("✓")
+    try:
+        process_files(input_dir, output_dir, llm_processor, file_workers, total_start_time)
+    finally:
+        if unload_on_exit:
+            print("正在卸载模型...", end=' ', flush=True)
+            print("✓" if llm_processor.lifecycle.unload() else "✗")
+        llm_processor.close()
+
+def process_files(input_dir: str, output_dir: str, llm_processor: LLMProcessor, file_workers: int,
+                  total_start_time: float):
+    """处理目录下的所有txt文件并打印统计信息"""
+    # 使用jieba分句时预先加载词典
+    if llm_processor.splitter == 'jieba':
+        print("正在初始化分词模型...", end=' ', flush=True)
+        import jieba
+        _ = jieba.lcut("初始化测试")  # 触发jieba初始化
+        print("✓")
     
     # 创建输出目录
     os.makedirs(output_dir, exist_ok=True)
@@ -409,14 +1740,26 @@ def process_directory(input_dir: str, output_dir: str):
     processed_files = 0
     file_times = []  # 记录每个文件的处理时间
     
+    # 创建对应的输出目录
+    output_subdirs = {}
     for input_path in txt_files:
-        # 创建对应的输出目录
         rel_path = os.path.relpath(input_path, input_dir)
         output_subdir = os.path.join(output_dir, os.path.splitext(rel_path)[0])
         os.makedirs(os.path.dirname(output_subdir), exist_ok=True)
-        
-        # 处理文件
-        success, elapsed_time = process_file(input_path, output_subdir, llm_processor)
+        output_subdirs[input_path] = output_subdir
+    
+    # 清理之前中断的运行留下的临时结果
+    for parent_dir in sorted({os.path.dirname(os.path.abspath(d)) for d in output_subdirs.values()}):
+        remove_stale_outputs(parent_dir)
+    
+    # 处理文件：小文件先开始（多个文件并行时，结果仍按文件列表顺序汇总）
+    with ThreadPoolExecutor(max_workers=max(1, file_workers)) as executor:
+        futures = {input_path: executor.submit(process_file, input_path, output_subdirs[input_path], llm_processor)
+                   for input_path in sorted(txt_files, key=os.path.getsize)}
+        results = [futures[input_path].result() for input_path in txt_files]
+    
+    for input_path, (success, elapsed_time) in zip(txt_files, results):
+        output_subdir = output_subdirs[input_path]
         if success:
             success_count += 1
             file_times.append((os.path.basename(input_path), elapsed_time))
@@ -434,6 +1777,29 @@ def process_directory(input_dir: str, output_dir: str):
     print(f"成功处理: {success_count}/{len(txt_files)} 个文件")
     print(f"生成文件: {processed_files} 个")
     print(f"输出目录: {os.path.abspath(output_dir)}")
+    if llm_processor.classifier is not None:
+        print(f"本地分类避免的模型调用: {llm_processor.counters.get('local_classified', 0)} 次")
+    if llm_processor.rule_cleaner:
+        print(f"规则清理避免的模型调用: {llm_processor.counters.get('rule_cleaned', 0)} 次")
+    first_token_time = llm_processor.average_first_token_time()
+    if first_token_time is not None:
+        print(f"分类请求平均首token时间: {first_token_time:.2f}秒")
+    prompt_eval_summary = llm_processor.prompt_eval_summary()
+    if prompt_eval_summary:
+        print("各阶段prompt评估（平均每个请求）:")
+        for stage, count, tokens, seconds in prompt_eval_summary:
+            print(f"  - {STAGE_NAMES[stage]}: {count} 次请求，{tokens:.0f} token，{seconds:.3f}秒")
+    scheduler = llm_processor.scheduler
+    if scheduler.adaptive:
+        print(f"自适应并发: 结束时上限 {int(scheduler.limit)}，"
+              f"运行中 {int(scheduler.limit_range[0])}~{int(scheduler.limit_range[1])}（最大 {scheduler.max_limit}）")
+    if len(llm_processor.pool.endpoints) > 1:
+        print("各服务请求数:")
+        for endpoint in llm_processor.pool.endpoints:
+            print(f"  - {endpoint.url}: {endpoint.requests} 次")
+    if llm_processor.cache is not None:
+        cache = llm_processor.cache
+        print(f"响应缓存: 命中 {cache.hits} 次，未命中 {cache.misses} 次（{cache.path}）")
     
     # 打印每个文件的处理时间
     if file_times:
@@ -449,14 +1815,145 @@ def main():
     parser.add_argument('--output_dir', '-o',
                       default='output/llm_split_output',
                       help='输出文件夹路径 (默认: output/llm_split_output)')
+    parser.add_argument('--endpoints',
+                      nargs='+',
+                      default=[DEFAULT_ENDPOINT],
+                      help=f'Ollama服务地址，可以指定多个，请求按负载分配到提供该模型的服务 (默认: {DEFAULT_ENDPOINT})')
+    parser.add_argument('--eject-time',
+                      type=float,
+                      default=30.0,
+                      help='请求失败的服务移出轮换的时间（秒），到期后健康检查通过才重新使用，默认为30')
+    parser.add_argument('--connect-timeout',
+                      type=float,
+                      default=5.0,
+                      help='连接Ollama服务的超时时间（秒），默认为5')
+    parser.add_argument('--read-timeout',
+                      type=float,
+                      default=300.0,
+                      help='等待模型响应的超时时间（秒），默认为300')
+    parser.add_argument('--keep-alive',
+                      default='30m',
+                      help='模型在最后一次请求后保留在内存中的时间，如30m、1h；-1表示一直保留 (默认: 30m)')
+    parser.add_argument('--unload-on-exit',
+                      action='store_true',
+                      help='处理结束后立即把模型移出内存')
+    parser.add_argument('--api',
+                      choices=['generate', 'chat'],
+                      default='generate',
+                      help='请求接口：generate（默认）；chat把每个阶段的处理要求作为固定的系统消息，'
+                           '句子作为用户消息，便于Ollama复用缓存的prompt前缀，第一阶段也会应用处理要求')
+    parser.add_argument('--splitter',
+                      choices=['punctuation', 'jieba'],
+                      default='punctuation',
+                      help='分句方式：punctuation按句末标点分句，不需要分词器（默认）；jieba使用jieba分词')
+    parser.add_argument('--concurrency', '-c',
+                      type=int,
+                      default=None,
+                      help='同时发送给模型的最大请求数（应不超过Ollama的OLLAMA_NUM_PARALLEL）；默认为1，'
+                           f'启用自适应并发时为每个服务{ADAPTIVE_CONCURRENCY_PER_ENDPOINT}个')
+    parser.add_argument('--adaptive-concurrency',
+                      action='store_true',
+                      help='根据延迟和错误自动调整同时发送的请求数（AIMD），--concurrency 作为上限（必须大于1）')
+    parser.add_argument('--initial-concurrency',
+                      type=int,
+                      default=None,
+                      help='自适应并发的初始值；默认使用本机环境变量OLLAMA_NUM_PARALLEL乘以本机服务数'
+                           '（只是本机服务配置的提示，远程服务不计入），无法得知时从1开始')
+    parser.add_argument('--file-workers',
+                      type=int,
+                      default=1,
+                      help='同时处理的文件数，默认为1；所有文件共享 --concurrency 的请求上限')
+    parser.add_argument('--batch-size', '-b',
+                      type=int,
+                      default=1,
+                      help='第二到第四阶段每个请求打包的句子数，大于1时启用批量模式，默认为1')
+    parser.add_argument('--batch-max-chars',
+                      type=int,
+                      default=2000,
+                      help='批量模式下每个请求中句子的总字符数上限，默认为2000')
+    parser.add_argument('--no-rule-cleaner',
+                      action='store_true',
+                      help='第四阶段不使用规则清理，所有句子都交给模型处理')
+    parser.add_argument('--local-classifier',
+                      action='store_true',
+                      help='第三阶段先用本地分类器判断SINGLE/MULTIPLE/INVALID，置信度不足时才请求模型')
+    parser.add_argument('--classifier-threshold',
+                      type=float,
+                      default=0.8,
+                      help='本地分类结果的最低置信度，默认为0.8；设为大于1时只记录判断日志、全部交给模型')
+    parser.add_argument('--classifier-model',
+                      default='output/stage3_classifier.json',
+                      help='本地分类模型文件，存在时代替启发式规则 (默认: output/stage3_classifier.json)')
+    parser.add_argument('--classifier-log',
+                      default='output/stage3_decisions.jsonl',
+                      help='第三阶段判断日志 (默认: output/stage3_decisions.jsonl)')
+    parser.add_argument('--train-classifier',
+                      action='store_true',
+                      help='用判断日志中模型给出的结果训练本地分类模型并退出')
+    parser.add_argument('--cache-path',
+                      default='output/llm_cache.sqlite',
+                      help='模型响应缓存文件路径 (默认: output/llm_cache.sqlite)')
+    parser.add_argument('--cache-max-size',
+                      type=float,
+                      default=500,
+                      help='响应缓存的大小上限（MB），超出时淘汰最久未使用的记录，默认为500')
+    parser.add_argument('--cache-max-age',
+                      type=float,
+                      default=30,
+                      help='响应缓存记录的有效期（天），默认为30')
+    parser.add_argument('--no-cache',
+                      action='store_true',
+                      help='不读取也不写入响应缓存，所有请求都发送给模型')
+    parser.add_argument('--retries',
+                      type=int,
+                      default=3,
+                      help='连接失败、超时或服务端暂时性错误时的重试次数，默认为3')
     
     args = parser.parse_args()
+    if args.adaptive_concurrency and args.concurrency is not None and args.concurrency <= 1:
+        parser.error('--adaptive-concurrency 需要 --concurrency 大于1（它是自适应并发的上限）')
+    
+    if args.train_classifier:
+        if not os.path.exists(args.classifier_log):
+            print(f"错误：判断日志 '{args.classifier_log}' 不存在")
+            return
+        samples = StageClassifier.train(args.classifier_log, args.classifier_model)
+        if samples:
+            print(f"✓ 使用 {samples} 条模型判断训练完成，模型已保存到：{args.classifier_model}")
+        else:
+            print("✗ 判断日志中没有模型给出的判断，无法训练")
+        return
     
     if not os.path.exists(args.input_dir):
         print(f"错误：输入目录 '{args.input_dir}' 不存在")
         return
     
-    process_directory(args.input_dir, args.output_dir)
+    llm_options = {
+        'connect_timeout': args.connect_timeout,
+        'read_timeout': args.read_timeout,
+        'max_retries': args.retries,
+        'concurrency': args.concurrency,
+        'batch_size': args.batch_size,
+        'batch_max_chars': args.batch_max_chars,
+        'rule_cleaner': not args.no_rule_cleaner,
+        'splitter': args.splitter,
+        'keep_alive': args.keep_alive,
+        'api': args.api,
+        'endpoints': args.endpoints,
+        'eject_time': args.eject_time,
+        'adaptive_concurrency': args.adaptive_concurrency,
+        'initial_concurrency': args.initial_concurrency,
+    }
+    if args.adaptive_concurrency and args.initial_concurrency is None:
+        llm_options['initial_concurrency'] = server_parallelism(args.endpoints) or 1
+    if args.local_classifier:
+        llm_options['classifier'] = StageClassifier(args.classifier_threshold, args.classifier_model,
+                                                    args.classifier_log)
+    if not args.no_cache:
+        llm_options['cache'] = ResponseCache(args.cache_path,
+                                             max_size=int(args.cache_max_size * 1024 * 1024),
+                                             max_age=args.cache_max_age * 24 * 3600)
+    process_directory(args.input_dir, args.output_dir, llm_options, args.file_workers, args.unload_on_exit)
 
 if __name__ == "__main__":
     main()
@@ -1,28 +1,106 @@
 import os
 import re
+import bisect
+import gzip
+import json
 import shutil  # 用于删除目录
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# 句子存储（JSONL）文件后缀
+STORE_SUFFIX = '.jsonl'
+
+# 写入过程中临时结果的后缀
+TMP_SUFFIX = '.tmp'
+
+# 流式分句时每次读取/处理的字符数
+CHUNK_SIZE = 1024 * 1024
+
+# 表格标记（与extract_text.py的输出一致）
+TABLE_START = '=== 表格开始 ==='
+TABLE_END = '=== 表格结束 ==='
+
+# 指令/快捷键特征
+KEYBOARD_PATTERNS = [re.compile(p) for p in (
+    r'CTRL\+',
+    r'ALT\+',
+    r'SHIFT\+',
+    r'\([^)]*键\)',
+    r'[A-Z]\+[A-Z]',
+)]
+
+# 词典特征
+PHONETIC_PATTERNS = [re.compile(p) for p in (
+    r'\[.*?\]',  # 匹配音标
+    r'英音.*?美音',  # 匹配音标说明
+    r'名词 n\.',  # 匹配词性标注
+)]
+
+# 操作指南特征
+OPERATION_PATTERNS = [re.compile(p) for p in (
+    r'[A-Z][a-z]+ Arrow',  # 方向键
+    r'Ctrl \-',  # Ctrl组合键
+    r'Alt \-',   # Alt组合键
+    r'Shift \-', # Shift组合键
+    r'Key Pad',  # 小键盘
+    r'F\d+',     # 功能键
+)]
+
+# 需要按特征识别的内容类型，按判断优先级排列；命中其中至少2个特征即认为是该类型
+FEATURE_TYPES = [
+    ('operation', OPERATION_PATTERNS),
+    ('command', KEYBOARD_PATTERNS),
+    ('dictionary', PHONETIC_PATTERNS),
+]
+
+FEATURE_PATTERNS = dict(FEATURE_TYPES)
+
+# 普通句子的句末标点
+SENTENCE_END_PATTERN = re.compile('[。！？；]')
+
+# 表格块：从开始标记行到结束标记行（缺少结束标记时到文本末尾）
+TABLE_PATTERN = re.compile(
+    rf'^[^\S\n]*{TABLE_START}[^\S\n]*$.*?(?:^[^\S\n]*{TABLE_END}[^\S\n]*$|\Z)',
+    re.M | re.S
+)
+
+# 空行（只含空白字符的行）
+BLANK_LINES_PATTERN = re.compile(r'\n[^\S\n]*\n(?:[^\S\n]*\n)*')
+WHITESPACE_PATTERN = re.compile(r'\s*')
+
+# 各分句函数使用的模式
+COMMAND_LINE_PATTERN = re.compile(r'^(.+?)\s+([A-Z0-9+\s\(\)]+(?:键)?|[^a-z]+)$')
+TABLE_ITEM_PATTERN = re.compile(r'(\d+)\.\s*(.+)')
+BRACKET_PHONETIC_PATTERN = re.compile(r'英音：\[.*?\]美音：\[.*?\]')
+PHONETIC_PATTERN = re.compile(r'英音：.*?美音：.*?(?=\s|$)')
+PART_OF_SPEECH_PATTERN = re.compile(r'(?:名词 n\.|形容词 a\.|动词 v\.)\s*')
+DATE_PATTERN = re.compile(r'\d{4}-\d{1,2}-\d{1,2}')
+UPPERCASE_PATTERN = re.compile(r'[A-Z]')
+SPACES_PATTERN = re.compile(r'\s+')
+PARENTHESES_PATTERN = re.compile(r'\(([^)]+)\)')
+
+def count_pattern_matches(patterns, text):
+    """统计文本命中的特征数量"""
+    return sum(1 for pattern in patterns if pattern.search(text))
 
 def is_command_content(text):
     """判断是否为指令/快捷键类型的内容"""
     # 检查是否包含大量快捷键特征
-    keyboard_patterns = [
-        r'CTRL\+',
-        r'ALT\+',
-        r'SHIFT\+',
-        r'\([^)]*键\)',
-        r'[A-Z]\+[A-Z]'
-    ]
-    
-    pattern_matches = sum(1 for pattern in keyboard_patterns if re.search(pattern, text))
-    return pattern_matches >= 2
+    return count_pattern_matches(KEYBOARD_PATTERNS, text) >= 2
 
-def split_command_content(text):
-    """处理指令/快捷键内容的分句逻辑"""
-    lines = text.split('\n')
-    entries = []
+def iter_lines(text):
+    """逐行产出 (行内容, 行起点, 行终点)，偏移量相对于text"""
+    start = 0
+    for line in text.split('\n'):
+        end = start + len(line)
+        yield line, start, end
+        start = end + 1
+
+def iter_command_content(text):
+    """处理指令/快捷键内容的分句逻辑，产出 (条目, start, end)"""
     current_section = None
     
-    for line in lines:
+    for line, start, end in iter_lines(text):
         line = line.strip()
         if not line:
             continue
@@ -35,173 +113,549 @@ def split_command_content(text):
         # 处理快捷键行
         if ' - ' in line:  # 已经是格式化的内容
             if current_section:
-                entries.append(f"{current_section} - {line}")
+                yield f"{current_section} - {line}", start, end
             else:
-                entries.append(line)
+                yield line, start, end
         else:
             # 处理未格式化的内容
-            match = re.match(r'^(.+?)\s+([A-Z0-9+\s\(\)]+(?:键)?|[^a-z]+)$', line)
+            match = COMMAND_LINE_PATTERN.match(line)
             if match:
                 description, shortcut = match.groups()
                 if current_section:
-                    entries.append(f"{current_section} - {description.strip()} - {shortcut.strip()}")
+                    yield f"{current_section} - {description.strip()} - {shortcut.strip()}", start, end
                 else:
-                    entries.append(f"{description.strip()} - {shortcut.strip()}")
-    
-    return entries
+                    yield f"{description.strip()} - {shortcut.strip()}", start, end
+
+def split_command_content(text):
+    """处理指令/快捷键内容的分句逻辑"""
+    return [entry for entry, _, _ in iter_command_content(text)]
 
 def is_table_content(text):
     """判断是否为表格内容"""
-    return text.strip().startswith('=== 表格开始 ===')
+    return text.strip().startswith(TABLE_START)
 
-def split_table_content(text):
-    """处理表格内容的分句逻辑"""
-    lines = text.split('\n')
-    entries = []
-    current_entry = []
-    
-    for line in lines:
+def iter_table_content(text):
+    """处理表格内容的分句逻辑，产出 (条目, start, end)"""
+    for line, start, end in iter_lines(text):
         line = line.strip()
-        if not line or line == '=== 表格开始 ===' or line == '=== 表格结束 ===':
+        if not line or line == TABLE_START or line == TABLE_END:
             continue
             
         # 分割每行的多个条目
         items = [item.strip() for item in line.split('|')]
         for item in items:
             # 使用正则提取编号和内容
-            match = re.match(r'(\d+)\.\s*(.+)', item.strip())
+            match = TABLE_ITEM_PATTERN.match(item.strip())
             if match:
                 number, content = match.groups()
-                entries.append(f"{number}. {content.strip()}")
-    
-    return entries
+                yield f"{number}. {content.strip()}", start, end
 
-def split_normal_content(text):
-    """处理普通文本的分句逻辑"""
+def split_table_content(text):
+    """处理表格内容的分句逻辑"""
+    return [entry for entry, _, _ in iter_table_content(text)]
+
+# 普通文本的分句标点符号
+NORMAL_DELIMITERS = ['。', '！', '？', '；', '\n\n']
+NORMAL_DELIMITER_PATTERN = re.compile(f"({'|'.join(map(re.escape, NORMAL_DELIMITERS))})")
+
+def iter_normal_content(text, keep_tail=False):
+    """处理普通文本的分句逻辑，产出 (句子, start, end)
+    
+    末尾没有以分句标点结束的文本默认丢弃，keep_tail为True时作为最后一个句子产出。
+    """
     # 使用更严格的分句标点符号
-    delimiters = ['。', '！', '？', '；', '\n\n']
-    pattern = '|'.join(map(re.escape, delimiters))
-    sentences = re.split(f'({pattern})', text)
+    sentences = NORMAL_DELIMITER_PATTERN.split(text)
     
-    result = []
+    start = 0
     for i in range(0, len(sentences)-1, 2):
+        sentence = sentences[i] + sentences[i+1]
         if sentences[i].strip():
-            result.append(sentences[i] + (sentences[i+1] if i+1 < len(sentences) else ''))
+            yield sentence, start, start + len(sentence)
+        start += len(sentence)
     
-    return result
+    if keep_tail and sentences[-1].strip():
+        yield sentences[-1], start, len(text)
+
+def split_normal_content(text):
+    """处理普通文本的分句逻辑"""
+    return [sentence for sentence, _, _ in iter_normal_content(text)]
 
 def is_dictionary_content(text):
     """判断是否为词典类内容"""
     # 检查是否包含音标特征
-    phonetic_patterns = [
-        r'\[.*?\]',  # 匹配音标
-        r'英音.*?美音',  # 匹配音标说明
-        r'名词 n\.',  # 匹配词性标注
-    ]
-    
-    pattern_matches = sum(1 for pattern in phonetic_patterns if re.search(pattern, text))
-    return pattern_matches >= 2
+    return count_pattern_matches(PHONETIC_PATTERNS, text) >= 2
 
-def split_dictionary_content(text):
-    """处理词典类内容的分句逻辑"""
-    lines = text.split('\n')
-    entries = []
-    
-    for line in lines:
+def iter_dictionary_content(text):
+    """处理词典类内容的分句逻辑，产出 (条目, start, end)"""
+    for line, start, end in iter_lines(text):
         line = line.strip()
         if not line:
             continue
             
         # 移除音标和发音说明
-        line = re.sub(r'英音：\[.*?\]美音：\[.*?\]', '', line)
-        line = re.sub(r'英音：.*?美音：.*?(?=\s|$)', '', line)
+        line = BRACKET_PHONETIC_PATTERN.sub('', line)
+        line = PHONETIC_PATTERN.sub('', line)
         
         # 提取词条信息
         # 处理带词性标注的情况
         if '名词 n.' in line or '形容词 a.' in line or '动词 v.' in line:
-            parts = re.split(r'(?:名词 n\.|形容词 a\.|动词 v\.)\s*', line, 1)
+            parts = PART_OF_SPEECH_PATTERN.split(line, 1)
             if len(parts) == 2:
                 term, definition = parts
-                entries.append(f"{term.strip()} - {definition.strip()}")
+                yield f"{term.strip()} - {definition.strip()}", start, end
         # 处理固定词组
         elif '固定词组 ph.' in line:
             parts = line.split('固定词组 ph.', 1)
             if len(parts) == 2:
                 term, definition = parts
-                entries.append(f"{term.strip()} - {definition.strip()}")
+                yield f"{term.strip()} - {definition.strip()}", start, end
         # 处理普通定义
         else:
             parts = line.split(' ', 1)
             if len(parts) == 2:
                 term, definition = parts
-                entries.append(f"{term.strip()} - {definition.strip()}")
-    
-    return entries
+                yield f"{term.strip()} - {definition.strip()}", start, end
+
+def split_dictionary_content(text):
+    """处理词典类内容的分句逻辑"""
+    return [entry for entry, _, _ in iter_dictionary_content(text)]
 
 def is_operation_guide(text):
     """判断是否为操作指南类内容"""
     # 检查是否包含大量快捷键特征
-    patterns = [
-        r'[A-Z][a-z]+ Arrow',  # 方向键
-        r'Ctrl \-',  # Ctrl组合键
-        r'Alt \-',   # Alt组合键
-        r'Shift \-', # Shift组合键
-        r'Key Pad',  # 小键盘
-        r'F\d+',     # 功能键
-    ]
-    
-    pattern_matches = sum(1 for pattern in patterns if re.search(pattern, text))
-    return pattern_matches >= 2
+    return count_pattern_matches(OPERATION_PATTERNS, text) >= 2
 
-def split_operation_guide(text):
-    """处理操作指南类内容的分句逻辑"""
-    lines = text.split('\n')
-    entries = []
+def iter_operation_guide(text):
+    """处理操作指南类内容的分句逻辑，产出 (条目, start, end)"""
     current_section = None
     
-    for line in lines:
+    for line, start, end in iter_lines(text):
         line = line.strip()
         if not line:
             continue
             
         # 跳过日期时间等无关信息
-        if re.match(r'\d{4}-\d{1,2}-\d{1,2}', line):
+        if DATE_PATTERN.match(line):
             continue
             
         # 检查是否是章节标题
-        if line.endswith('：') or line.endswith(':') or (len(line) < 30 and not re.search(r'[A-Z]', line)):
+        if line.endswith('：') or line.endswith(':') or (len(line) < 30 and not UPPERCASE_PATTERN.search(line)):
             current_section = line.rstrip('：:')
             continue
             
         # 处理快捷键行
-        if re.search(r'[A-Z]', line):  # 包含大写字母（可能是快捷键）
+        if UPPERCASE_PATTERN.search(line):  # 包含大写字母（可能是快捷键）
             # 移除多余的空格
-            line = re.sub(r'\s+', ' ', line).strip()
+            line = SPACES_PATTERN.sub(' ', line).strip()
             
             # 处理带括号的补充说明
-            line = re.sub(r'\(([^)]+)\)', r'（\1）', line)  # 统一括号格式
+            line = PARENTHESES_PATTERN.sub(r'（\1）', line)  # 统一括号格式
             
             if current_section:
-                entries.append(f"{current_section} - {line}")
+                yield f"{current_section} - {line}", start, end
             else:
-                entries.append(line)
+                yield line, start, end
+
+def split_operation_guide(text):
+    """处理操作指南类内容的分句逻辑"""
+    return [entry for entry, _, _ in iter_operation_guide(text)]
+
+def table_spans(text):
+    """查找所有表格，返回 [(start, marker_end, end)]
+    
+    start为表格开始标记所在行的行首，marker_end为表格结束标记之后的位置，
+    end为表格之后下一个内容行的行首（表格后的空行归入表格块）。
+    """
+    spans = []
+    for m in TABLE_PATTERN.finditer(text):
+        content_start = WHITESPACE_PATTERN.match(text, m.end()).end()
+        if content_start == len(text):
+            end = content_start
+        else:
+            end = text.rfind('\n', m.end(), content_start) + 1 or content_start
+        spans.append((m.start(), m.end(), end))
+    return spans
+
+def block_starts(text, tables=None):
+    """切分文本块，返回 (各块起点列表, 表格块下标列表)
+    
+    文本块由空行或表格标记分隔，块之间的空行归入前一个块，
+    第一个块从文本开头开始，所有块首尾相接覆盖全文。
+    只对全文做两次正则扫描，不逐行遍历。
+    """
+    content_end = len(text.rstrip())
+    if content_end == 0:
+        return [], []
+    
+    if tables is None:
+        tables = table_spans(text)
+    if not tables:
+        starts = [m.end() for m in BLANK_LINES_PATTERN.finditer(text) if m.end() < content_end]
+        if starts and not text[:starts[0]].strip():
+            starts[0] = 0  # 开头只有空白时并入第一个块
+        else:
+            starts.insert(0, 0)
+        return starts, []
+    
+    table_starts = [start for start, _, _ in tables]
+    boundaries = {start: True for start in table_starts}
+    for _, _, end in tables:
+        if end < content_end:
+            boundaries.setdefault(end, False)
+    for m in BLANK_LINES_PATTERN.finditer(text):
+        i = bisect.bisect_right(table_starts, m.start()) - 1
+        if i >= 0 and m.start() < tables[i][1]:
+            continue  # 表格内的空行不分块
+        if m.end() < content_end:
+            boundaries.setdefault(m.end(), False)
+    
+    positions = sorted(boundaries)
+    first_is_table = False
+    if positions and not text[:positions[0]].strip():
+        # 开头只有空白时并入第一个块
+        first_is_table = boundaries[positions.pop(0)]
+    
+    starts = [0] + positions
+    table_indexes = [0] if first_is_table else []
+    table_indexes.extend(i for i, position in enumerate(positions, 1) if boundaries[position])
+    return starts, table_indexes
+
+def iter_blocks(text):
+    """逐个产出文本块 (start, end, is_table)"""
+    starts, table_indexes = block_starts(text)
+    table_indexes = set(table_indexes)
+    ends = starts[1:] + [len(text)]
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        yield start, end, i in table_indexes
+
+def classify_blocks(text):
+    """对全文分块并逐块识别内容类型，相邻同类型的块合并为一段
+    
+    块内命中某类型至少2个特征时直接判定为该类型；只命中1个特征且不含句末标点时，
+    若该类型与全文主类型或上一个块的类型一致则沿用，
+    这样分散在多个小块中的快捷键列表、词条等不会被当作普通文本，
+    而正文中偶然出现的方括号、功能键编号等不会让整段正文被其他类型的分句函数丢弃。
+    前后紧挨着的无特征、无句末标点的块（标题、无音标的词条）归入该类型，
+    只有一种类型的文件与整篇判断的结果相同。
+    不可能含有特殊内容的文本与原先一样只需扫描少量几次即可判定为普通文本。
+    返回 [(类型, start, end)]，类型为 table/operation/command/dictionary/normal。
+    """
+    if not text.strip():
+        return []
+    
+    # 全文层面可能出现的类型：块内要命中某类型至少2个特征，全文必然也命中至少2个，
+    # 因此先按原先整篇判断的规则筛选（命中即停止），不可能出现的类型无需逐块统计
+    possible_types = [
+        content_type for content_type, patterns in FEATURE_TYPES
+        if count_pattern_matches(patterns, text) >= 2
+    ]
+    document_type = possible_types[0] if possible_types else None
+    tables = table_spans(text) if TABLE_START in text else []
+    if not tables and not possible_types:
+        # 整篇都是普通文本，无需分块
+        return [('normal', 0, len(text))]
+    
+    starts, table_indexes = block_starts(text, tables)
+    ends = starts[1:] + [len(text)]
+    
+    # 统计各块命中的特征：每个特征在一个块内命中后直接跳到下一个块继续查找
+    table_set = set(table_indexes)
+    matched = {}
+    for content_type in possible_types:
+        for j, pattern in enumerate(FEATURE_PATTERNS[content_type]):
+            m = pattern.search(text)
+            while m is not None:
+                i = bisect.bisect_right(starts, m.start()) - 1
+                if i not in table_set:
+                    block_matched = matched.get(i)
+                    if block_matched is None:
+                        block_matched = matched[i] = {name: set() for name in possible_types}
+                    block_matched[content_type].add(j)
+                m = pattern.search(text, ends[i])
+    feature_indexes = matched.keys()
+    
+    types = {i: 'table' for i in table_indexes}  # 非普通文本块的类型
+    for i in sorted(feature_indexes):
+        block_matched = matched[i]
+        previous_type = types.get(i - 1)
+        content_type = next(
+            (candidate for candidate in possible_types if len(block_matched[candidate]) >= 2),
+            None
+        )
+        if content_type is None and not SENTENCE_END_PATTERN.search(text, starts[i], ends[i]):
+            # 只命中1个特征的非正文块，沿用全文主类型或上一个块的类型
+            content_type = next(
+                (candidate for candidate in (document_type, previous_type)
+                 if candidate in block_matched and block_matched[candidate]),
+                None
+            )
+        if content_type is None:
+            continue
+        types[i] = content_type
+        
+        # 之后没有任何特征、也不含句末标点的短条目（如无音标的词条）延续该类型
+        j = i + 1
+        while (j < len(starts) and j not in matched and j not in types
+               and not SENTENCE_END_PATTERN.search(text, starts[j], ends[j])):
+            types[j] = content_type
+            j += 1
+    
+    # 之前没有任何特征、也不含句末标点的块（如单独成块的章节标题）归入后面的块，
+    # 与整篇判断时一样由该类型的分句函数作为标题处理（表格的分句函数不处理标题，不归入表格）
+    for i in sorted(types, reverse=True):
+        if types[i] == 'table':
+            continue
+        j = i - 1
+        while (j >= 0 and j not in matched and j not in types
+               and not SENTENCE_END_PATTERN.search(text, starts[j], ends[j])):
+            types[j] = types[i]
+            j -= 1
+    
+    segments = []
+    
+    def add_segment(content_type, start, end):
+        if segments and segments[-1][0] == content_type:
+            segments[-1][2] = end
+        else:
+            segments.append([content_type, start, end])
+    
+    next_index = 0
+    for i in sorted(types):
+        if i > next_index:
+            add_segment('normal', starts[next_index], starts[i])
+        add_segment(types[i], starts[i], ends[i])
+        next_index = i + 1
+    if next_index < len(starts):
+        add_segment('normal', starts[next_index], len(text))
+    
+    return [tuple(segment) for segment in segments]
+
+# 各内容类型对应的分句函数，产出 (句子, start, end)
+SENTENCE_ITERATORS = {
+    'table': iter_table_content,
+    'operation': iter_operation_guide,
+    'command': iter_command_content,
+    'dictionary': iter_dictionary_content,
+    'normal': iter_normal_content,
+}
+
+def iter_sentence_records(text):
+    """按块识别内容类型并分句，产出 (句子, 类型, start, end)
     
-    return entries
+    start/end为句子来源在text中的字符偏移：普通文本为句子本身的范围，
+    其他类型为条目所在行的范围。
+    """
+    segments = classify_blocks(text)
+    for index, (content_type, start, end) in enumerate(segments):
+        segment = text[start:end]
+        if content_type == 'normal':
+            # 后面还有其他类型的内容时，段落边界视为句子结束
+            entries = iter_normal_content(segment, keep_tail=index < len(segments) - 1)
+        else:
+            entries = SENTENCE_ITERATORS[content_type](segment)
+        for sentence, sentence_start, sentence_end in entries:
+            yield sentence, content_type, start + sentence_start, start + sentence_end
 
 def split_sentences(text):
-    """主分句函数"""
-    if is_table_content(text):
-        return split_table_content(text)
-    elif is_operation_guide(text):
-        return split_operation_guide(text)
-    elif is_command_content(text):
-        return split_command_content(text)
-    elif is_dictionary_content(text):
-        return split_dictionary_content(text)
+    """主分句函数：按块识别内容类型，每段使用对应的分句策略"""
+    return [sentence for sentence, _, _, _ in iter_sentence_records(text)]
+
+def iter_text_chunks(input_path, chunk_size=CHUNK_SIZE):
+    """分块读取UTF-8文本文件，逐块产出字符串（多字节字符不会被截断）"""
+    with open(input_path, 'r', encoding='utf-8') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+# 流式分句时窗口的切分位置，按优先级排列：表格之外、前后都是正文字符的空行分隔符（\n\n）之后，
+# 该位置既是文本块边界也是普通文本的句子边界，切开前后的分句结果与整篇处理一致；其次是句末标点之后
+WINDOW_CUT_PATTERNS = (re.compile(r'(?<=\S)\n\n(?=\S)'), SENTENCE_END_PATTERN)
+
+# 缓冲区达到窗口大小的这些倍数时依次放宽切分条件：使用后面的切分模式、强制切分
+SENTENCE_CUT_FACTOR = 4
+FORCE_CUT_FACTOR = 8
+
+def find_window_cut(buffer, window_size, patterns=WINDOW_CUT_PATTERNS):
+    """在缓冲区中找一个切开窗口的位置，暂不切开时返回0
+    
+    缓冲区达到window_size后切在patterns中第一个模式最后一次匹配的结束位置；达到SENTENCE_CUT_FACTOR倍
+    仍找不到时依次尝试其余模式。这两种情况都不会切在未闭合的表格内部。
+    达到FORCE_CUT_FACTOR倍仍找不到时（没有空行和句末标点的超长文本、超大的表格），强制切在最后一个
+    换行之后，没有换行时切开整个缓冲区，切开处前后的分句结果可能与整篇处理不同，但内存占用有上限。
+    """
+    if len(buffer) < window_size:
+        return 0
+    
+    # 不能切在表格内部：未闭合的表格之前才可以切
+    limit = len(buffer)
+    table_start = buffer.rfind(TABLE_START)
+    if table_start >= 0 and buffer.find(TABLE_END, table_start) < 0:
+        limit = table_start
+    
+    usable_patterns = patterns if len(buffer) >= window_size * SENTENCE_CUT_FACTOR else patterns[:1]
+    for pattern in usable_patterns:
+        cut = 0
+        for match in pattern.finditer(buffer, 0, limit):
+            cut = match.end()
+        if cut > 0:
+            return cut
+    
+    if len(buffer) < window_size * FORCE_CUT_FACTOR:
+        return 0
+    return buffer.rfind('\n') + 1 or len(buffer)
+
+def iter_sentence_records_stream(chunks, window_size=CHUNK_SIZE):
+    """流式分句：从文本块迭代器中逐句产出 (句子, 类型, start, end)
+    
+    输入被切成约window_size大小的窗口，窗口优先在空行处切开（见find_window_cut），跨窗口的半个句子
+    会保留到下一个窗口，因此句子和偏移量与整篇处理一致；内容类型按窗口识别。
+    缓冲区最多约为window_size的FORCE_CUT_FACTOR倍，峰值内存与输入大小无关。
+    """
+    buffer = ''
+    base = 0  # buffer起点在全文中的偏移
+    for chunk in chunks:
+        buffer += chunk
+        cut = find_window_cut(buffer, window_size)
+        if cut <= 0:
+            continue
+        for sentence, content_type, start, end in iter_sentence_records(buffer[:cut]):
+            yield sentence, content_type, base + start, base + end
+        buffer = buffer[cut:]
+        base += cut
+    
+    for sentence, content_type, start, end in iter_sentence_records(buffer):
+        yield sentence, content_type, base + start, base + end
+
+def sentence_store_path(output_directory, base_name, compress=False):
+    """句子存储文件路径：<输出目录>/<文件名>.jsonl[.gz]"""
+    return os.path.join(output_directory, base_name + STORE_SUFFIX + ('.gz' if compress else ''))
+
+def write_sentence_store(records, store_path, source, compress=None):
+    """把句子记录写入JSONL句子存储，返回写入的句子数
+    
+    首行记录来源文件 {"source": ...}，之后每行一个句子
+    {"id", "type", "start", "end", "text"}。compress为True时使用gzip压缩；
+    为None时根据路径是否以.gz结尾判断（写入临时文件时必须显式指定）。
+    """
+    if compress is None:
+        compress = store_path.endswith('.gz')
+    opener = gzip.open if compress else open
+    count = 0
+    with opener(store_path, 'wt', encoding='utf-8') as f:
+        f.write(json.dumps({'source': source}, ensure_ascii=False) + '\n')
+        for sentence, content_type, start, end in records:
+            count += 1
+            record = {
+                'id': count,
+                'type': content_type,
+                'start': start,
+                'end': end,
+                'text': sentence.strip(),
+            }
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    return count
+
+def iter_sentence_store(store_path):
+    """逐条读取句子存储中的句子记录（dict），不会一次性载入整个文件"""
+    opener = gzip.open if store_path.endswith('.gz') else open
+    with opener(store_path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            if 'id' in record:  # 跳过来源信息
+                yield record
+
+def save_sentences_to_directory(sentences, output_subdir, filename):
+    """按目录格式保存：0.txt为索引文件，每个句子保存为单独的N.txt；返回句子数"""
+    # 创建输出子目录
+    os.makedirs(output_subdir, exist_ok=True)
+    
+    # 创建索引文件
+    index_file_path = os.path.join(output_subdir, '0.txt')
+    with open(index_file_path, 'w', encoding='utf-8') as f:
+        f.write(f'本目录下的分句结果来自文件：{filename}')
+    
+    # 保存句子（sentences可以是生成器，逐个写入）
+    count = 0
+    for count, sentence in enumerate(sentences, 1):
+        output_path = os.path.join(output_subdir, f'{count}.txt')
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write(sentence.strip())
+    
+    return count
+
+def split_file(input_path, output_directory, output_format='dir', compress=False, stream=False):
+    """对单个txt文件分句并保存，返回 (句子数, 输出位置, 错误信息)
+    
+    先写入输出目录中的临时目录/临时文件，完成后再重命名为最终名称，
+    进程中途崩溃也不会留下写了一半的结果。stream为True时分块读取输入并逐句写出，
+    内存占用与文件大小无关。定义在模块顶层，以便在进程池中执行。
+    """
+    filename = os.path.basename(input_path)
+    base_name = os.path.splitext(filename)[0]
+    if output_format == 'jsonl':
+        output_target = sentence_store_path(output_directory, base_name, compress)
     else:
-        return split_normal_content(text)
+        output_target = os.path.join(output_directory, base_name)
+    tmp_target = os.path.join(
+        output_directory, f".{os.path.basename(output_target)}.{os.getpid()}{TMP_SUFFIX}")
+    
+    try:
+        if stream:
+            records = iter_sentence_records_stream(iter_text_chunks(input_path))
+        else:
+            # 读取输入文件
+            with open(input_path, 'r', encoding='utf-8') as f:
+                text = f.read()
+            records = iter_sentence_records(text)
+        
+        # 分句并保存到临时位置
+        if output_format == 'jsonl':
+            count = write_sentence_store(records, tmp_target, filename, compress)
+        else:
+            sentences = (sentence for sentence, _, _, _ in records)
+            count = save_sentences_to_directory(sentences, tmp_target, filename)
+        
+        # 检查是否提取到句子
+        if count == 0:
+            remove_output(tmp_target)
+            remove_output(output_target)
+            return 0, output_target, "未能提取到有效句子"
+        
+        replace_output(tmp_target, output_target)
+        return count, output_target, None
+        
+    except Exception as e:
+        # 删除未完成的临时结果
+        remove_output(tmp_target)
+        return 0, output_target, str(e)
+
+def replace_output(tmp_target, output_target):
+    """用临时结果替换最终输出"""
+    if os.path.isdir(output_target):
+        # 目录无法直接覆盖：先把旧目录移走，再重命名新目录
+        old_target = f"{tmp_target}.old"
+        os.rename(output_target, old_target)
+        os.rename(tmp_target, output_target)
+        shutil.rmtree(old_target)
+    else:
+        os.replace(tmp_target, output_target)
 
-def split_and_save(input_directory, output_directory):
+def remove_stale_outputs(output_directory):
+    """清理之前中断的运行留下的临时结果"""
+    for name in os.listdir(output_directory):
+        if name.startswith('.') and (name.endswith(TMP_SUFFIX) or name.endswith(TMP_SUFFIX + '.old')):
+            remove_output(os.path.join(output_directory, name))
+
+def split_and_save(input_directory, output_directory, output_format='dir', compress=False, workers=1,
+                   stream=False):
+    """对目录下的所有txt文件分句并保存
+    
+    output_format为'dir'时每个输入文件对应一个目录、每个句子一个文件；
+    为'jsonl'时每个输入文件对应一个JSONL句子存储，compress为True时使用gzip压缩。
+    workers大于1时使用进程池并行处理多个文件；stream为True时流式分句，适合超大文件。
+    """
     # 获取所有需要处理的txt文件
     txt_files = [f for f in os.listdir(input_directory) if f.endswith('.txt')]
     total_files = len(txt_files)
@@ -215,67 +669,64 @@ def split_and_save(input_directory, output_directory):
     
     # 创建输出目录
     os.makedirs(output_directory, exist_ok=True)
+    remove_stale_outputs(output_directory)
     
     success_count = 0
     failed_count = 0
     failed_files = []
+    sentence_count = 0
     
-    # 处理每个文件
-    for index, filename in enumerate(txt_files, 1):
-        print(f"\n正在处理第 {index}/{total_files} 个文件: {filename}")
+    if workers > 1 and total_files > 1:
+        # 大文件优先提交，避免最后只剩一个大文件占用单个核心
+        txt_files.sort(key=lambda f: os.path.getsize(os.path.join(input_directory, f)), reverse=True)
+        workers = min(workers, total_files)
+        print(f"使用 {workers} 个进程并行处理")
         
-        input_path = os.path.join(input_directory, filename)
-        base_name = os.path.splitext(filename)[0]
-        output_subdir = os.path.join(output_directory, base_name)
-        
-        try:
-            # 创建输出子目录
-            os.makedirs(output_subdir, exist_ok=True)
-            
-            # 创建索引文件
-            index_file_path = os.path.join(output_subdir, '0.txt')
-            with open(index_file_path, 'w', encoding='utf-8') as f:
-                f.write(f'本目录下的分句结果来自文件：{filename}')
-            
-            # 读取输入文件
-            with open(input_path, 'r', encoding='utf-8') as f:
-                text = f.read()
-            
-            # 分句
-            sentences = split_sentences(text)
-            
-            # 保存句子
-            for i, sentence in enumerate(sentences, 1):
-                output_path = os.path.join(output_subdir, f'{i}.txt')
-                with open(output_path, 'w', encoding='utf-8') as f:
-                    f.write(sentence.strip())
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(split_file, os.path.join(input_directory, filename),
+                                output_directory, output_format, compress, stream): filename
+                for filename in txt_files
+            }
+            for index, future in enumerate(as_completed(futures), 1):
+                filename = futures[future]
+                try:
+                    count, output_target, error = future.result()
+                except Exception as e:  # 工作进程异常退出
+                    count, error = 0, str(e)
+                
+                if error is None:
+                    success_count += 1
+                    sentence_count += count
+                    print(f"✓ [{index}/{total_files}] {filename}：共分出 {count} 个句子 -> {output_target}")
+                else:
+                    failed_count += 1
+                    failed_files.append(filename)
+                    print(f"✗ [{index}/{total_files}] 文件 '{filename}' 分句失败：{error}")
+    else:
+        # 处理每个文件
+        for index, filename in enumerate(txt_files, 1):
+            print(f"\n正在处理第 {index}/{total_files} 个文件: {filename}")
             
-            # 检查是否只有索引文件
-            files_in_dir = os.listdir(output_subdir)
-            if len(files_in_dir) <= 1:  # 只有0.txt或空目录
-                shutil.rmtree(output_subdir)  # 删除整个目录
-                print(f"✗ 文件 '{filename}' 分句失败：未能提取到有效句子")
+            input_path = os.path.join(input_directory, filename)
+            count, output_target, error = split_file(input_path, output_directory, output_format,
+                                                     compress, stream)
+            if error is None:
+                print(f"✓ 已完成分句，共分出 {count} 个句子")
+                print(f"✓ 输出位置：{output_target}")
+                success_count += 1
+                sentence_count += count
+            else:
+                print(f"✗ 文件 '{filename}' 分句失败：{error}")
                 failed_count += 1
                 failed_files.append(filename)
-            else:
-                print(f"✓ 已完成分句，共分出 {len(sentences)} 个句子")
-                print(f"✓ 输出目录：{output_subdir}")
-                success_count += 1
-            
-        except Exception as e:
-            print(f"✗ 处理文件 '{filename}' 时出错: {str(e)}")
-            failed_count += 1
-            failed_files.append(filename)
-            # 如果目录已创建，则删除
-            if os.path.exists(output_subdir):
-                shutil.rmtree(output_subdir)
-            continue
 
     # 输出最终处理结果统计
     print("\n" + "=" * 50)
     print(f"处理完成！总计处理 {total_files} 个文件")
     print(f"成功：{success_count} 个")
     print(f"失败：{failed_count} 个")
+    print(f"句子总数：{sentence_count} 个")
     
     if failed_files:
         print("\n以下文件处理失败：")
@@ -284,23 +735,54 @@ def split_and_save(input_directory, output_directory):
     
     print(f"\n分句结果已保存到目录：{os.path.abspath(output_directory)}")
 
-if __name__ == "__main__":
-    # 设置输入输出路径
-    input_directory = "output/docx_output"
-    output_directory = "output/split_output"
+def remove_output(output_target):
+    """删除输出目录或句子存储文件"""
+    if os.path.isdir(output_target):
+        shutil.rmtree(output_target)  # 删除整个目录
+    elif os.path.exists(output_target):
+        os.remove(output_target)
+
+def main():
+    parser = argparse.ArgumentParser(description='文本分句处理工具')
+    parser.add_argument('--input_dir', '-i',
+                      default='output/docx_output',
+                      help='输入文件夹路径 (默认: output/docx_output)')
+    parser.add_argument('--output_dir', '-o',
+                      default='output/split_output',
+                      help='输出文件夹路径 (默认: output/split_output)')
+    parser.add_argument('--format', '-f',
+                      choices=['dir', 'jsonl'],
+                      default='dir',
+                      help='输出格式：dir为每个句子一个文件，jsonl为每个输入文件一个JSONL句子存储 (默认: dir)')
+    parser.add_argument('--compress', '-z',
+                      action='store_true',
+                      help='jsonl格式下使用gzip压缩 (.jsonl.gz)')
+    parser.add_argument('--stream', '-s',
+                      action='store_true',
+                      help='流式分句：分块读取输入并逐句写出，内存占用与文件大小无关，适合超大文件')
+    parser.add_argument('--workers', '-w',
+                      type=int,
+                      default=1,
+                      help='并行处理的进程数 (默认: 1，即串行处理)')
+    
+    args = parser.parse_args()
     
     print("\n=== 文本分句处理工具 ===")
-    print(f"输入目录：{os.path.abspath(input_directory)}")
-    print(f"输出目录：{os.path.abspath(output_directory)}")
+    print(f"输入目录：{os.path.abspath(args.input_dir)}")
+    print(f"输出目录：{os.path.abspath(args.output_dir)}")
     
     # 检查输入目录是否存在
-    if not os.path.exists(input_directory):
-        print(f"\n错误：输入目录 '{input_directory}' 不存在")
+    if not os.path.exists(args.input_dir):
+        print(f"\n错误：输入目录 '{args.input_dir}' 不存在")
         exit(1)
     
     try:
-        split_and_save(input_directory, output_directory)
+        split_and_save(args.input_dir, args.output_dir, args.format, args.compress, args.workers,
+                       args.stream)
         print("\n" + "=" * 50)
-        print(f"处理完成！分句结果已保存到目录：{os.path.abspath(output_directory)}")
+        print(f"处理完成！分句结果已保存到目录：{os.path.abspath(args.output_dir)}")
     except Exception as e:
         print(f"\n处理过程中出现错误：{str(e)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import os
+import sys
+
+import pytest
+
+# 测试直接导入仓库根目录下的脚本模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def make_docx():
+    """生成测试用的DOCX文件：blocks中的字符串为段落，列表为表格（行的列表）"""
+    from docx import Document
+
+    def make(path, blocks):
+        doc = Document()
+        for block in blocks:
+            if isinstance(block, str):
+                doc.add_paragraph(block)
+            else:
+                table = doc.add_table(rows=len(block), cols=len(block[0]))
+                for i, row in enumerate(block):
+                    for j, text in enumerate(row):
+                        table.cell(i, j).text = text
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        doc.save(path)
+        return path
+
+    return make
+
+
+@pytest.fixture
+def fake_ollama():
+    """启动本地的Ollama替身（见fake_ollama.FakeOllama），测试结束后停止"""
+    from fake_ollama import FakeOllama
+
+    servers = []
+
+    def start(**kwargs):
+        server = FakeOllama(**kwargs)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
@@ -0,0 +1,175 @@
+"""测试用的Ollama替身：在本机随机端口上用http.server实现 /api/tags、/api/generate 和 /api/chat"""
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_MODEL = 'qwen2.5-coder:7b'
+
+
+def echo(prompt):
+    return prompt
+
+
+class FakeOllama:
+    """一个Ollama服务的替身
+
+    reply(prompt)返回模型输出的文本，返回bytes时原样作为响应体（用于构造格式错误的响应）；
+    chat接口中prompt为把用户消息填回系统消息后的文本，与generate接口的prompt相同。
+    statuses中的HTTP状态码依次代替正常响应（用于模拟暂时性错误），用完后正常响应。
+    流式响应每块3个字符，块之间间隔chunk_delay秒；客户端提前断开的流式响应计入aborted。
+    stop()后连接被拒绝，start()在原端口上重新启动。
+    """
+
+    def __init__(self, models=(DEFAULT_MODEL,), reply=echo, delay=0.0):
+        self.models = list(models)
+        self.reply = reply
+        self.delay = delay
+        self.chunk_delay = 0.0
+        self.statuses = []
+        # 收到的请求 (方法, 路径, 请求数据)、建立过的连接数、同时处理的生成请求数
+        self.requests = []
+        self.connections = 0
+        self.inflight = 0
+        self.max_inflight = 0
+        self.aborted = 0
+        self.lock = threading.Lock()
+        self.sockets = set()
+        self.port = 0
+        self.server = None
+        self.start()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.port}'
+
+    def start(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', self.port), self._make_handler())
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        """停止服务并断开已有的keep-alive连接"""
+        self.server.shutdown()
+        self.server.server_close()
+        with self.lock:
+            sockets, self.sockets = self.sockets, set()
+        for sock in sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def prompts(self):
+        """收到的生成请求的prompt（chat接口为用户消息），按收到的顺序"""
+        with self.lock:
+            return [data['prompt'] if 'prompt' in data else data['messages'][-1]['content']
+                    for method, _, data in self.requests
+                    if method == 'POST' and ('prompt' in data or 'messages' in data)]
+
+    def paths(self, method=None):
+        with self.lock:
+            return [path for m, path, _ in self.requests if method is None or m == method]
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                with fake.lock:
+                    fake.connections += 1
+                    fake.sockets.add(self.connection)
+
+            def send_body(self, status, body):
+                if not isinstance(body, bytes):
+                    body = json.dumps(body, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                with fake.lock:
+                    fake.requests.append(('GET', self.path, None))
+                if self.path != '/api/tags':
+                    return self.send_body(404, {'error': 'not found'})
+                self.send_body(200, {'models': [{'name': name} for name in fake.models]})
+
+            def do_POST(self):
+                data = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with fake.lock:
+                    fake.requests.append(('POST', self.path, data))
+                    status = fake.statuses.pop(0) if fake.statuses else 200
+                if status != 200:
+                    return self.send_body(status, {'error': f'status {status}'})
+                if data.get('model') not in fake.models:
+                    return self.send_body(404, {'error': f"model '{data.get('model')}' not found"})
+                if 'prompt' not in data and 'messages' not in data:
+                    # 预加载、卸载模型的请求
+                    return self.send_body(200, {'model': data['model'], 'response': '', 'done': True})
+
+                with fake.lock:
+                    fake.inflight += 1
+                    fake.max_inflight = max(fake.max_inflight, fake.inflight)
+                try:
+                    if fake.delay:
+                        time.sleep(fake.delay)
+                    self.generate(data)
+                finally:
+                    with fake.lock:
+                        fake.inflight -= 1
+
+            def generate(self, data):
+                chat = 'messages' in data
+                if chat:
+                    messages = data['messages']
+                    system = messages[0]['content'] if messages[0]['role'] == 'system' else ''
+                    user = messages[-1]['content']
+                    prompt = system.replace('（见用户消息）', user) if '（见用户消息）' in system else user
+                    evaluated = len(system) + len(user)
+                else:
+                    prompt = data['prompt']
+                    evaluated = len(prompt)
+                text = fake.reply(prompt)
+                if isinstance(text, bytes):
+                    return self.send_body(200, text)
+
+                def chunk(piece, done):
+                    result = {'message': {'role': 'assistant', 'content': piece}} if chat else {'response': piece}
+                    result['done'] = done
+                    if done:
+                        result.update(prompt_eval_count=evaluated, prompt_eval_duration=evaluated * 1000)
+                    return result
+
+                if not data.get('stream', True):
+                    return self.send_body(200, chunk(text, True))
+
+                # 流式响应：NDJSON，客户端提前断开时停止
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                pieces = [chunk(text[i:i + 3], False) for i in range(0, len(text), 3)] + [chunk('', True)]
+                try:
+                    for piece in pieces:
+                        line = (json.dumps(piece, ensure_ascii=False) + '\n').encode('utf-8')
+                        self.wfile.write(b'%x\r\n%s\r\n' % (len(line), line))
+                        self.wfile.flush()
+                        if fake.chunk_delay:
+                            time.sleep(fake.chunk_delay)
+                    self.wfile.write(b'0\r\n\r\n')
+                except OSError:
+                    self.close_connection = True
+                    with fake.lock:
+                        fake.aborted += 1
+
+        return Handler
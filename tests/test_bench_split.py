@@ -0,0 +1,62 @@
+import pytest
+
+import bench_split
+
+
+@pytest.mark.parametrize('name', sorted(bench_split.BENCHMARKS))
+def test_generate_corpus_is_deterministic(name):
+    text = bench_split.generate_corpus(name, 20_000, 42)
+    assert text == bench_split.generate_corpus(name, 20_000, 42)
+    assert text != bench_split.generate_corpus(name, 20_000, 43)
+    assert len(text.encode('utf-8')) >= 20_000
+
+
+@pytest.mark.parametrize('name', sorted(bench_split.BENCHMARKS))
+def test_run_benchmark_counts_sentences(name):
+    text = bench_split.generate_corpus(name, 20_000, 42)
+    _, splitter = bench_split.BENCHMARKS[name]
+    result = bench_split.run_benchmark(name, text, repeat=1)
+    assert result['sentences'] == len(splitter(text)) > 0
+    assert result['mb_per_sec'] > 0 and result['peak_memory_mb'] > 0
+
+
+def _result(sentences=10, mb_per_sec=10.0, peak_memory_mb=10.0):
+    return {'sentences': sentences, 'mb_per_sec': mb_per_sec, 'peak_memory_mb': peak_memory_mb}
+
+
+def test_find_regressions():
+    baseline = {'results': {'normal': _result(), 'table': _result()}}
+    results = {
+        'normal': _result(mb_per_sec=7.5, peak_memory_mb=12.5),  # 阈值以内
+        'table': _result(sentences=11, mb_per_sec=6.0, peak_memory_mb=14.0),
+        'command': _result(),  # 基线中没有
+    }
+    assert bench_split.find_regressions(results, baseline, 0.3) == [
+        ('table', 'sentences', 10, 11),
+        ('table', 'mb_per_sec', 10.0, 6.0),
+        ('table', 'peak_memory_mb', 10.0, 14.0),
+    ]
+
+
+def test_baseline_round_trip(tmp_path):
+    path = str(tmp_path / 'baseline.json')
+    assert bench_split.load_baseline(path) is None
+    bench_split.save_baseline(path, {'normal': _result()}, 1024, 7)
+    baseline = bench_split.load_baseline(path)
+    assert baseline['results'] == {'normal': _result()}
+    assert (baseline['size'], baseline['seed']) == (1024, 7)
+
+
+def test_main_exits_on_regression(tmp_path, monkeypatch):
+    path = str(tmp_path / 'baseline.json')
+    argv = ['bench_split.py', '--size', '0.01', '--repeat', '1', '--only', 'normal', '--baseline', path]
+    monkeypatch.setattr('sys.argv', argv + ['--save-baseline'])
+    bench_split.main()
+
+    baseline = bench_split.load_baseline(path)
+    baseline['results']['normal']['sentences'] += 1
+    bench_split.save_baseline(path, baseline['results'], baseline['size'], baseline['seed'])
+    monkeypatch.setattr('sys.argv', argv)
+    with pytest.raises(SystemExit) as excinfo:
+        bench_split.main()
+    assert excinfo.value.code == 1
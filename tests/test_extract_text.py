@@ -0,0 +1,210 @@
+import io
+
+import extract_text
+
+
+def test_streaming_matches_document_when_tables_follow_paragraphs(tmp_path, make_docx):
+    path = make_docx(tmp_path / 'a.docx', [
+        '拆下燃油喷嘴。', '', '检查密封圈。',
+        [['部件', '数量'], ['螺栓', '4']],
+    ])
+    writer = io.StringIO()
+    extract_text.extract_text_streaming(str(path), writer)
+    assert writer.getvalue() == extract_text.extract_text_from_docx(str(path))
+
+
+def test_streaming_keeps_document_order(tmp_path, make_docx):
+    path = make_docx(tmp_path / 'a.docx', ['第一段。', [['表格']], '第二段。'])
+    blocks = list(extract_text.iter_docx_blocks(str(path)))
+    assert blocks[0] == '第一段。\n'
+    assert '=== 表格开始 ===' in blocks[1]
+    assert blocks[2] == '第二段。\n'
+
+
+def test_stream_to_file_creates_output_directory(tmp_path, make_docx):
+    path = make_docx(tmp_path / 'a.docx', ['第一段。'])
+    extract_text.stream_to_file(str(path), str(tmp_path / 'out' / 'sub'), 'a.txt')
+    assert (tmp_path / 'out' / 'sub' / 'a.txt').read_text(encoding='utf-8') == '第一段。\n'
+
+
+def test_parallel_extraction_matches_serial(tmp_path, make_docx):
+    for i in range(3):
+        make_docx(tmp_path / 'in' / f'{i}.docx', [f'第{i}个文件。', [['a', str(i)]]])
+    extract_text.extract_and_save(str(tmp_path / 'in'), str(tmp_path / 'serial'))
+    extract_text.extract_and_save(str(tmp_path / 'in'), str(tmp_path / 'parallel'), workers=2)
+    for i in range(3):
+        serial = (tmp_path / 'serial' / f'{i}.txt').read_text(encoding='utf-8')
+        assert (tmp_path / 'parallel' / f'{i}.txt').read_text(encoding='utf-8') == serial
+
+
+def _baseline_table_text(table):
+    """原先基于python-docx row.cells的表格渲染，用于对照"""
+    text = "\n=== 表格开始 ===\n"
+    col_widths = []
+    for col in range(len(table.columns)):
+        col_widths.append(max(len(cell.text) for row in table.rows for cell in row.cells[col:col + 1]))
+    for row in table.rows:
+        text += ' | '.join(cell.text.ljust(col_widths[i]) for i, cell in enumerate(row.cells)) + '\n'
+    return text + "=== 表格结束 ===\n\n"
+
+
+def test_table_grid_matches_python_docx_cells_with_merges(tmp_path):
+    from docx import Document
+
+    doc = Document()
+    table = doc.add_table(rows=3, cols=3)
+    for i in range(3):
+        for j in range(3):
+            table.cell(i, j).text = f'格{i}{j}'
+    table.cell(0, 0).merge(table.cell(0, 1))  # 横向合并
+    table.cell(1, 2).merge(table.cell(2, 2))  # 纵向合并
+    table.cell(2, 0).text = '较长的单元格内容'
+    path = tmp_path / 'merged.docx'
+    doc.save(path)
+
+    table = Document(path).tables[0]
+    expected = _baseline_table_text(table)
+    assert extract_text._render_table(*extract_text._read_table_grid(table._tbl)) == expected
+
+
+def _count_extractions(monkeypatch):
+    extracted = []
+    extract_one = extract_text.extract_one
+
+    def counting(source, output_dir, stream=False):
+        extracted.append(source)
+        return extract_one(source, output_dir, stream)
+
+    monkeypatch.setattr(extract_text, 'extract_one', counting)
+    return extracted
+
+
+def test_manifest_skips_unchanged_and_touched_files(tmp_path, make_docx, monkeypatch):
+    import os
+
+    path = make_docx(tmp_path / 'in' / 'a.docx', ['第一段。'])
+    out = str(tmp_path / 'out')
+    extract_text.extract_and_save(str(tmp_path / 'in'), out)
+    extracted = _count_extractions(monkeypatch)
+
+    extract_text.extract_and_save(str(tmp_path / 'in'), out)
+    os.utime(path, ns=(0, 10 ** 18))  # 只修改时间，内容不变
+    extract_text.extract_and_save(str(tmp_path / 'in'), out)
+    assert extracted == []
+
+    extract_text.extract_and_save(str(tmp_path / 'in'), out, force=True)
+    assert len(extracted) == 1
+
+
+def test_manifest_reextracts_changed_and_removes_deleted(tmp_path, make_docx, monkeypatch):
+    make_docx(tmp_path / 'in' / 'a.docx', ['旧内容。'])
+    b = make_docx(tmp_path / 'in' / 'b.docx', ['另一个文件。'])
+    out = tmp_path / 'out'
+    extract_text.extract_and_save(str(tmp_path / 'in'), str(out))
+    extracted = _count_extractions(monkeypatch)
+
+    make_docx(tmp_path / 'in' / 'a.docx', ['新内容，长度也不同。'])
+    b.unlink()
+    extract_text.extract_and_save(str(tmp_path / 'in'), str(out))
+
+    assert len(extracted) == 1
+    assert (out / 'a.txt').read_text(encoding='utf-8') == '新内容，长度也不同。\n'
+    assert not (out / 'b.txt').exists()
+    assert set(extract_text.load_manifest(str(out))) == {str(tmp_path / 'in' / 'a.docx')}
+
+
+def test_switching_to_stream_mode_reextracts(tmp_path, make_docx, monkeypatch):
+    make_docx(tmp_path / 'in' / 'a.docx', ['第一段。'])
+    extract_text.extract_and_save(str(tmp_path / 'in'), str(tmp_path / 'out'))
+    extracted = _count_extractions(monkeypatch)
+    extract_text.extract_and_save(str(tmp_path / 'in'), str(tmp_path / 'out'), stream=True)
+    assert len(extracted) == 1
+
+
+def _make_zip(path, members):
+    import zipfile
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with zipfile.ZipFile(path, 'w') as zf:
+        for name, source in members.items():
+            zf.write(source, name)
+    return path
+
+
+def test_archive_members_are_extracted_with_their_directories(tmp_path, make_docx):
+    a = make_docx(tmp_path / 'src' / 'a.docx', ['归档中的文件。'])
+    _make_zip(tmp_path / 'in' / 'bundle.zip', {
+        'manuals/a.docx': a,
+        'manuals/~$a.docx': a,  # Word临时文件
+        '__MACOSX/manuals/a.docx': a,
+        'readme.txt': a,
+    })
+    extract_text.extract_and_save(str(tmp_path / 'in'), str(tmp_path / 'out'))
+    extract_text.close_archives()
+
+    outputs = sorted(p.relative_to(tmp_path / 'out').as_posix()
+                     for p in (tmp_path / 'out').rglob('*.txt'))
+    assert outputs == ['bundle/manuals/a.txt']
+    assert (tmp_path / 'out' / 'bundle' / 'manuals' / 'a.txt').read_text(encoding='utf-8') == '归档中的文件。\n'
+
+
+def test_archive_member_paths_cannot_escape_output_directory(tmp_path):
+    source = str(tmp_path / 'x.zip') + extract_text.ARCHIVE_SEP + '../../etc/a.docx'
+    assert extract_text.source_output_name(source) == 'x/etc/a.txt'
+
+
+def test_collect_sources_ignores_extension_case(tmp_path, make_docx):
+    make_docx(tmp_path / 'in' / 'REPORT.DOCX', ['大写扩展名。'])
+    a = make_docx(tmp_path / 'src' / 'a.docx', ['归档中的文件。'])
+    _make_zip(tmp_path / 'in' / 'BUNDLE.ZIP', {'A.DOCX': a})
+    sources = extract_text.collect_sources(str(tmp_path / 'in'))
+    extract_text.close_archives()
+    assert [extract_text.source_output_name(source) for source in sources] == ['BUNDLE/A.txt', 'REPORT.txt']
+
+
+class _StopWatching(Exception):
+    pass
+
+
+def _run_watch_with_file_created_during_initial_pass(tmp_path, make_docx, monkeypatch, use_inotify):
+    make_docx(tmp_path / 'in' / 'a.docx', ['启动前已有的文件。'])
+    calls = []
+    extract_and_save = extract_text.extract_and_save
+
+    def initial_pass(*args, **kwargs):
+        calls.append(kwargs)
+        extract_and_save(*args, **kwargs)
+        make_docx(tmp_path / 'in' / 'b.docx', ['首次提取期间新增的文件。'])
+
+    def extract_changes(input_dir, output_dir, names, stream, workers):
+        calls.append(sorted(names))
+        raise _StopWatching
+
+    monkeypatch.setattr(extract_text, 'extract_and_save', initial_pass)
+    monkeypatch.setattr(extract_text, '_extract_changes', extract_changes)
+    if not use_inotify:
+        monkeypatch.setattr(extract_text, '_inotify_open', lambda directory: None)
+    try:
+        extract_text.watch_and_extract(str(tmp_path / 'in'), str(tmp_path / 'out'),
+                                       interval=0.05, settle=0.05, force=True)
+    except _StopWatching:
+        pass
+    return calls
+
+
+def test_watch_sees_files_created_during_initial_pass_with_polling(tmp_path, make_docx, monkeypatch):
+    calls = _run_watch_with_file_created_during_initial_pass(tmp_path, make_docx, monkeypatch, False)
+    assert calls[0]['force'] is True
+    assert calls[1] == ['b.docx']
+
+
+def test_watch_sees_files_created_during_initial_pass_with_inotify(tmp_path, make_docx, monkeypatch):
+    import os
+    import pytest
+
+    fd = extract_text._inotify_open(str(tmp_path))
+    if fd is None:
+        pytest.skip("当前系统不支持inotify")
+    os.close(fd)
+    calls = _run_watch_with_file_created_during_initial_pass(tmp_path, make_docx, monkeypatch, True)
+    assert calls[1] == ['b.docx']
@@ -0,0 +1,885 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import types
+
+import pytest
+
+import bench_split
+import llm_split_sentence
+import split_sentences
+
+
+@pytest.fixture
+def make_processor():
+    """创建连接到指定服务的LLMProcessor（默认不退避），测试结束后关闭"""
+    processors = []
+
+    def make(*servers, **kwargs):
+        kwargs.setdefault('backoff', 0)
+        processor = llm_split_sentence.LLMProcessor(endpoints=[server.url for server in servers], **kwargs)
+        processors.append(processor)
+        return processor
+
+    yield make
+    for processor in processors:
+        processor.close()
+
+
+def test_iter_sentences_from_file_matches_whole_text(tmp_path):
+    text = bench_split.generate_corpus('normal', 100_000, 1)
+    path = tmp_path / 'a.txt'
+    path.write_text(text, encoding='utf-8')
+    sentences = list(llm_split_sentence.iter_sentences_from_file(str(path), window_size=4096))
+    assert sentences == llm_split_sentence.split_sentences_by_punctuation(text)
+
+
+@pytest.mark.parametrize('text', ['没有标点的一整行' * 5000, '没有标点的一行\n' * 5000],
+                         ids=['line', 'lines'])
+def test_iter_sentences_from_file_buffer_is_bounded(tmp_path, monkeypatch, text):
+    window_size = 1024
+    path = tmp_path / 'a.txt'
+    path.write_text(text, encoding='utf-8')
+    windows = []
+    split = llm_split_sentence.SENTENCE_SPLITTERS['punctuation']
+
+    def recording(window, at_start=True):
+        windows.append(window)
+        return split(window, at_start)
+
+    monkeypatch.setitem(llm_split_sentence.SENTENCE_SPLITTERS, 'punctuation', recording)
+    sentences = list(llm_split_sentence.iter_sentences_from_file(str(path), window_size))
+
+    assert len(windows) > 1
+    assert max(map(len, windows)) < window_size * (split_sentences.FORCE_CUT_FACTOR + 1)
+    assert ''.join(''.join(sentences).split()) == ''.join(text.split())
+
+
+def test_requests_reuse_one_connection(fake_ollama, make_processor):
+    server = fake_ollama()
+    processor = make_processor(server)
+    for i in range(5):
+        assert processor._generate_completion(f'第{i}句。') == f'第{i}句。'
+    assert server.connections == 1
+
+
+def test_transient_errors_are_retried(fake_ollama, make_processor):
+    server = fake_ollama()
+    server.statuses = [503, 429]
+    processor = make_processor(server, max_retries=2)
+    assert processor._generate_completion('一句话。') == '一句话。'
+    assert server.prompts() == ['一句话。'] * 3
+
+
+def test_retries_exhausted_raise_llm_error(fake_ollama, make_processor):
+    server = fake_ollama()
+    server.statuses = [503] * 3
+    processor = make_processor(server, max_retries=2)
+    with pytest.raises(llm_split_sentence.LLMError, match='503'):
+        processor._generate_completion('一句话。')
+    assert len(server.prompts()) == 3
+
+
+def test_retry_backs_off_exponentially(fake_ollama, make_processor, monkeypatch):
+    server = fake_ollama()
+    server.statuses = [503] * 3
+    processor = make_processor(server, max_retries=3, backoff=1.0)
+    sleeps = []
+    monkeypatch.setattr(llm_split_sentence.time, 'sleep', sleeps.append)
+    assert processor._generate_completion('一句话。') == '一句话。'
+    assert len(sleeps) == 3
+    for attempt, seconds in enumerate(sleeps):
+        assert 0.5 * 2 ** attempt <= seconds <= 1.5 * 2 ** attempt
+
+
+def test_client_errors_are_not_retried(fake_ollama, make_processor):
+    server = fake_ollama()
+    server.statuses = [400]
+    processor = make_processor(server, max_retries=2)
+    with pytest.raises(llm_split_sentence.LLMError, match='400'):
+        processor._generate_completion('一句话。')
+    assert len(server.prompts()) == 1
+
+
+@pytest.mark.parametrize('body, message', [
+    (b'not json', '不是合法的JSON'),
+    (b'{"done": true}', '缺少response字段'),
+], ids=['invalid-json', 'missing-field'])
+def test_malformed_response_raises_llm_error(fake_ollama, make_processor, body, message):
+    server = fake_ollama(reply=lambda prompt: body)
+    processor = make_processor(server)
+    with pytest.raises(llm_split_sentence.LLMError, match=message):
+        processor._generate_completion('一句话。')
+
+
+def test_empty_response_is_not_an_error(fake_ollama, make_processor):
+    server = fake_ollama(reply=lambda prompt: '')
+    assert make_processor(server)._generate_completion('一句话。') == ''
+
+
+def test_read_timeout_raises_llm_error(fake_ollama, make_processor):
+    server = fake_ollama(delay=1.0)
+    processor = make_processor(server, read_timeout=0.1, max_retries=1)
+    with pytest.raises(llm_split_sentence.LLMError, match='请求失败'):
+        processor._generate_completion('一句话。')
+    assert len(server.prompts()) == 2
+
+
+def test_connection_refused_raises_llm_error(fake_ollama, make_processor):
+    server = fake_ollama()
+    server.stop()
+    processor = make_processor(server, max_retries=1)
+    with pytest.raises(llm_split_sentence.LLMError, match='请求失败'):
+        processor._generate_completion('一句话。')
+
+
+def test_map_completions_keeps_order_with_concurrency(fake_ollama, make_processor):
+    server = fake_ollama(delay=0.05)
+    processor = make_processor(server, concurrency=4)
+    prompts = [f'第{i}句。' * (i % 5 + 1) for i in range(16)]
+    done = []
+    results = processor.map_completions(prompts, lambda index, result: done.append(index))
+    assert results == prompts
+    assert sorted(done) == list(range(16))
+    assert server.max_inflight == 4
+
+
+def test_map_completions_failure_raises(fake_ollama, make_processor):
+    server = fake_ollama(reply=lambda prompt: b'not json' if prompt == '坏' else prompt)
+    processor = make_processor(server, concurrency=2)
+    with pytest.raises(llm_split_sentence.LLMError):
+        processor.map_completions(['好', '坏', '好'])
+
+
+def _classify_single(prompt):
+    """第三阶段回复SINGLE，其余阶段返回空（不修改句子）"""
+    return 'SINGLE' if 'MULTIPLE' in prompt else ''
+
+
+def _read_outputs(output_dir):
+    return {str(path.relative_to(output_dir)): path.read_text(encoding='utf-8')
+            for path in sorted(output_dir.rglob('*.txt'))}
+
+
+def test_parallel_files_match_serial_output(tmp_path, fake_ollama):
+    server = fake_ollama(reply=_classify_single, delay=0.01)
+    input_dir = tmp_path / 'in'
+    (input_dir / 'sub').mkdir(parents=True)
+    for i in range(4):
+        path = input_dir / ('sub' if i % 2 else '') / f'{i}.txt'
+        path.write_text(''.join(f'文件{i}的第{j}句。' for j in range(i + 3)), encoding='utf-8')
+
+    options = {'endpoints': [server.url], 'backoff': 0}
+    llm_split_sentence.process_directory(str(input_dir), str(tmp_path / 'serial'), dict(options, concurrency=1))
+    max_inflight = server.max_inflight
+    llm_split_sentence.process_directory(str(input_dir), str(tmp_path / 'parallel'), dict(options, concurrency=4),
+                                         file_workers=3)
+
+    serial = _read_outputs(tmp_path / 'serial')
+    assert serial == _read_outputs(tmp_path / 'parallel')
+    assert serial['sub/1/1.txt'] == '文件1的第0句。'
+    assert len([name for name in serial if name.startswith('2/')]) == 1 + 5
+    assert max_inflight == 1 < server.max_inflight <= 4
+
+
+def test_response_cache_hits_and_persists(tmp_path):
+    path = str(tmp_path / 'cache' / 'llm.sqlite')
+    cache = llm_split_sentence.ResponseCache(path)
+    key = cache.make_key({'model': 'm', 'prompt': '一句话。', 'stream': False})
+    assert key == cache.make_key({'stream': False, 'prompt': '一句话。', 'model': 'm'})
+    assert key != cache.make_key({'model': 'other', 'prompt': '一句话。', 'stream': False})
+    assert cache.get(key) is None
+    cache.put(key, '')
+    assert cache.get(key) == ''
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.close()
+
+    cache = llm_split_sentence.ResponseCache(path)
+    assert cache.get(key) == ''
+    cache.close()
+
+
+def test_response_cache_expires_old_entries(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llm_split_sentence.time, 'time', lambda: now[0])
+    cache = llm_split_sentence.ResponseCache(str(tmp_path / 'llm.sqlite'), max_age=60)
+    cache.put('a', '结果')
+    now[0] += 59
+    assert cache.get('a') == '结果'
+    now[0] += 2
+    assert cache.get('a') is None
+    assert cache.evict() == 1
+    cache.close()
+
+
+def test_response_cache_evicts_least_recently_used(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llm_split_sentence.time, 'time', lambda: now[0])
+    cache = llm_split_sentence.ResponseCache(str(tmp_path / 'llm.sqlite'), max_size=25)
+    for key in 'abc':
+        now[0] += 1
+        cache.put(key, key * 10)
+    now[0] += 1
+    cache.get('a')
+    assert cache.evict() == 1
+    assert [cache.get(key) is not None for key in 'abc'] == [True, False, True]
+    cache.close()
+
+
+def test_warm_rerun_makes_no_model_calls(tmp_path, fake_ollama):
+    server = fake_ollama(reply=_classify_single)
+    input_dir = tmp_path / 'in'
+    input_dir.mkdir()
+    (input_dir / 'a.txt').write_text('第一句。第二句。第三句。', encoding='utf-8')
+    cache_path = str(tmp_path / 'llm.sqlite')
+
+    for output in ('cold', 'warm'):
+        options = {'endpoints': [server.url], 'cache': llm_split_sentence.ResponseCache(cache_path)}
+        llm_split_sentence.process_directory(str(input_dir), str(tmp_path / output), options)
+        if output == 'cold':
+            calls = len(server.prompts())
+
+    assert calls > 0 and len(server.prompts()) == calls
+    assert _read_outputs(tmp_path / 'cold') == _read_outputs(tmp_path / 'warm')
+
+
+@pytest.mark.parametrize('response, expected', [
+    ('[{"id": 1, "result": " 甲 "}, {"id": "2", "result": "乙"}]', {1: '甲', 2: '乙'}),
+    ('好的：\n```json\n[{"id": 2, "result": "乙"}, {"id": 1, "result": "甲"}]\n```', {1: '甲', 2: '乙'}),
+    ('[{"id": 1, "result": "甲"}]', None),
+    ('[{"id": 1, "result": "甲"}, {"id": 3, "result": "丙"}]', None),
+    ('[{"id": 1, "result": "甲"}, {"id": 1, "result": "甲"}]', None),
+    ('[{"id": 1, "result": "甲"}, {"id": 2, "result": null}]', None),
+    ('[{"id": 1, "result": "甲"}, {"id": 2, "result": "乙"', None),
+    ('', None),
+], ids=['plain', 'fenced', 'missing', 'wrong-id', 'duplicate', 'not-string', 'truncated', 'empty'])
+def test_parse_batch_response(response, expected):
+    assert llm_split_sentence.parse_batch_response(response, [1, 2]) == expected
+
+
+REWRITE_TEMPLATE = '改写下面的句子：{text}'
+
+
+def _rewrite(max_batch=None):
+    """单句请求在句子后加“（改）”；批量请求按id返回同样的结果，超过max_batch条时回复格式错误的内容"""
+    def reply(prompt):
+        if 'JSON数组中有多条文本' not in prompt:
+            return prompt.split('：', 1)[1] + '（改）'
+        items = json.loads(prompt.split('输入：\n', 1)[1].split('\n\n只返回', 1)[0])
+        if max_batch is not None and len(items) > max_batch:
+            return '[{"id": 1, "result": "截断'
+        return json.dumps([{'id': item['id'], 'result': item['text'] + '（改）'} for item in items],
+                          ensure_ascii=False)
+    return reply
+
+
+@pytest.mark.parametrize('api', ['generate', 'chat'])
+def test_batch_mode_packs_sentences(fake_ollama, make_processor, api):
+    server = fake_ollama(reply=_rewrite())
+    processor = make_processor(server, batch_size=4, batch_max_chars=1000, api=api)
+    texts = [f'第{i}句。' for i in range(10)]
+    assert processor.map_prompt(REWRITE_TEMPLATE, texts) == [text + '（改）' for text in texts]
+    # 4 + 4 + 2
+    assert len(server.prompts()) == 3
+
+
+def test_batch_mode_respects_char_budget(fake_ollama, make_processor):
+    server = fake_ollama(reply=_rewrite())
+    processor = make_processor(server, batch_size=10, batch_max_chars=12)
+    texts = ['一二三四五。'] * 6
+    assert processor.map_prompt(REWRITE_TEMPLATE, texts) == ['一二三四五。（改）'] * 6
+    assert len(server.prompts()) == 3
+
+
+def test_malformed_batch_is_split_and_retried(fake_ollama, make_processor):
+    server = fake_ollama(reply=_rewrite(max_batch=2))
+    processor = make_processor(server, batch_size=5, batch_max_chars=1000)
+    texts = [f'第{i}句。' for i in range(5)]
+    done = []
+    results = processor.map_prompt(REWRITE_TEMPLATE, texts, lambda index, result: done.append(index))
+    assert results == [text + '（改）' for text in texts]
+    assert sorted(done) == list(range(5))
+    # 5条失败 -> 2条成功 + 3条失败 -> 1条单句 + 2条成功
+    prompts = server.prompts()
+    assert len(prompts) == 5
+    assert prompts[-2] == REWRITE_TEMPLATE.format(text='第2句。')
+
+
+def test_batch_classification_parses_labels(fake_ollama, make_processor):
+    def reply(prompt):
+        items = json.loads(prompt.split('输入：\n', 1)[1].split('\n\n只返回', 1)[0])
+        return json.dumps([{'id': item['id'], 'result': ' single。' if item['id'] % 2 else '答案：INVALID'}
+                           for item in items], ensure_ascii=False)
+
+    server = fake_ollama(reply=reply)
+    processor = make_processor(server, batch_size=4)
+    results = processor.map_prompt('判断：{text}', ['甲', '乙', '丙'], labels=llm_split_sentence.SENTENCE_LABELS)
+    assert results == ['SINGLE', 'INVALID', 'SINGLE']
+
+
+@pytest.mark.parametrize('response, expected', [
+    ('SINGLE', 'SINGLE'),
+    ('  multiple\n', 'MULTIPLE'),
+    ('答案：Invalid，因为这不是维修内容', 'INVALID'),
+    ('SINGLE或MULTIPLE', 'SINGLE'),
+    ('SINGLES', ''),
+    ('', ''),
+    (None, ''),
+])
+def test_parse_label(response, expected):
+    assert llm_split_sentence.parse_label(response) == expected
+
+
+def test_classification_stops_streaming_at_label(fake_ollama, make_processor):
+    server = fake_ollama(reply=lambda prompt: '答案：MULTIPLE。' + '这是一段很长的解释' * 20)
+    server.chunk_delay = 0.01
+    processor = make_processor(server)
+    start = time.perf_counter()
+    label = processor._classify('判断：甲', llm_split_sentence.SENTENCE_LABELS, stage='3')
+    assert label == 'MULTIPLE'
+    assert time.perf_counter() - start < 0.5
+    assert processor.average_first_token_time() is not None
+    for _ in range(100):
+        if server.aborted:
+            break
+        time.sleep(0.01)
+    assert server.aborted == 1
+
+
+def test_classification_without_label_reads_whole_stream(fake_ollama, make_processor):
+    server = fake_ollama(reply=lambda prompt: '无法判断')
+    processor = make_processor(server)
+    assert processor._classify('判断：甲', llm_split_sentence.SENTENCE_LABELS, stage='3') == ''
+    # 读完整个流时记录了prompt评估统计
+    assert [stage for stage, *_ in processor.prompt_eval_summary()] == ['3']
+
+
+def test_classification_stream_retries_and_errors(fake_ollama, make_processor):
+    server = fake_ollama(reply=lambda prompt: 'SINGLE')
+    server.statuses = [503]
+    processor = make_processor(server, max_retries=1)
+    assert processor._classify('判断：甲', llm_split_sentence.SENTENCE_LABELS) == 'SINGLE'
+    server.statuses = [400]
+    with pytest.raises(llm_split_sentence.LLMError, match='400'):
+        processor._classify('判断：甲', llm_split_sentence.SENTENCE_LABELS)
+    assert len(server.prompts()) == 3
+
+
+def test_process_text_iteratively_accepts_text(fake_ollama, make_processor):
+    from tqdm import tqdm
+
+    server = fake_ollama(reply=_classify_single)
+    processor = make_processor(server, concurrency=2)
+    text = ''.join(f'第{i}句。' for i in range(10))
+    with tqdm(total=125, disable=True) as progress_bar:
+        records = llm_split_sentence.process_text_iteratively(text, processor, progress_bar)
+    assert [record.text for record in records] == [f'第{i}句。' for i in range(10)]
+
+
+
+def _pipeline_reply(prompt):
+    """第一阶段把一句扩写成两步，第二阶段改写一句，第三阶段按内容分类，其余不修改"""
+    if 'SINGLE 或 MULTIPLE' in prompt:
+        return 'INVALID' if '订阅' in prompt else 'MULTIPLE' if '；' in prompt else 'SINGLE'
+    if prompt == '拆下螺栓并检查。':
+        return '拆下螺栓；检查螺栓。'
+    if '请判断并优化下面这句话' in prompt and '安装滤芯。' in prompt:
+        return '安装新滤芯。'
+    return ''
+
+
+def test_process_text_iteratively_tracks_lineage(fake_ollama, make_processor):
+    from tqdm import tqdm
+
+    server = fake_ollama(reply=_pipeline_reply)
+    processor = make_processor(server, concurrency=2)
+    with tqdm(total=125, disable=True) as progress_bar:
+        records = llm_split_sentence.process_text_iteratively(
+            '安装滤芯。拆下螺栓并检查。欢迎订阅本公众号。', processor, progress_bar)
+
+    assert [(record.lineage, record.source, record.text) for record in records] == [
+        ('1', '安装滤芯。', '安装新滤芯。'),
+        ('2-1', '拆下螺栓并检查。', '拆下螺栓；'),
+        ('2-2', '拆下螺栓并检查。', '检查螺栓。'),
+    ]
+    assert [stage for stage, _ in records[0].history] == ['第二阶段']
+    assert records[1].history == [('第一阶段', '拆下螺栓并检查。'), ('第三阶段拆分', '拆下螺栓；检查螺栓。')]
+
+
+def test_save_records_replaces_output_at_once(tmp_path):
+    output_dir = tmp_path / 'out' / 'a'
+    output_dir.mkdir(parents=True)
+    (output_dir / '1-1-1.txt').write_text('旧的中间结果', encoding='utf-8')
+    record = llm_split_sentence.SentenceRecord('2-1', '原句。', '原句。')
+    record.update('第四阶段', '新句。')
+    records = [llm_split_sentence.SentenceRecord('1', '甲。', '甲。'), record]
+
+    llm_split_sentence.save_records(records, str(tmp_path / 'a.txt'), str(output_dir))
+
+    assert sorted(p.name for p in output_dir.iterdir()) == ['.done', '0.txt', '1.txt', '2.txt']
+    assert (output_dir / '2.txt').read_text(encoding='utf-8') == '新句。'
+    assert (output_dir / '0.txt').read_text(encoding='utf-8').split('\n') == [
+        '本目录下的处理结果来自文件：a.txt',
+        '1.txt\t来源句子：1\t修改阶段：无',
+        '2.txt\t来源句子：2-1\t修改阶段：第四阶段',
+    ]
+    assert [p.name for p in (tmp_path / 'out').iterdir()] == ['a']
+
+
+def test_process_file_writes_output_and_removes_journal(tmp_path, fake_ollama, make_processor):
+    server = fake_ollama(reply=_pipeline_reply)
+    processor = make_processor(server)
+    input_path = tmp_path / 'a.txt'
+    input_path.write_text('安装滤芯。拆下螺栓并检查。欢迎订阅本公众号。', encoding='utf-8')
+    output_dir = tmp_path / 'out' / 'a'
+    output_dir.parent.mkdir()
+
+    success, _ = llm_split_sentence.process_file(str(input_path), str(output_dir), processor)
+
+    assert success
+    assert [(output_dir / f'{i}.txt').read_text(encoding='utf-8') for i in (1, 2, 3)] == [
+        '安装新滤芯。', '拆下螺栓；', '检查螺栓。']
+    assert not (output_dir / '4.txt').exists()
+    assert [p.name for p in (tmp_path / 'out').iterdir()] == ['a']
+
+    # 已处理的文件直接跳过
+    calls = len(server.prompts())
+    assert llm_split_sentence.process_file(str(input_path), str(output_dir), processor) == (True, 0)
+    assert len(server.prompts()) == calls
+
+
+SIGNATURE = {'input': 'a.txt', 'size': 1, 'mtime': 1, 'model': 'm', 'api': 'generate'}
+
+
+def _read_journal(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f.read().split('\n') if line]
+
+
+def test_journal_resumes_after_truncated_line(tmp_path):
+    path = str(tmp_path / '.a.journal.jsonl')
+    journal = llm_split_sentence.SentenceJournal(path, SIGNATURE)
+    journal.record('1', '1', '甲。')
+    journal.record('1', '2', '乙。')
+    journal.close()
+    # 崩溃时最后一行只写了一半
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"stage": "1", "key": "3", "res')
+
+    journal = llm_split_sentence.SentenceJournal(path, SIGNATURE)
+    assert journal.entries == {('1', '1'): '甲。', ('1', '2'): '乙。'}
+    journal.record('1', '3', '丙。')
+    journal.close()
+
+    assert _read_journal(path)[1:] == [
+        {'stage': '1', 'key': '1', 'result': '甲。'},
+        {'stage': '1', 'key': '2', 'result': '乙。'},
+        {'stage': '1', 'key': '3', 'result': '丙。'},
+    ]
+    journal = llm_split_sentence.SentenceJournal(path, SIGNATURE)
+    assert journal.get('1', '3') == '丙。'
+    journal.close()
+
+
+def test_journal_restarts_when_signature_changes(tmp_path):
+    path = str(tmp_path / '.a.journal.jsonl')
+    journal = llm_split_sentence.SentenceJournal(path, SIGNATURE)
+    journal.record('1', '1', '甲。')
+    journal.close()
+
+    journal = llm_split_sentence.SentenceJournal(path, dict(SIGNATURE, size=2))
+    assert journal.entries == {}
+    journal.close()
+    assert _read_journal(path) == [dict(SIGNATURE, size=2)]
+
+
+def test_process_file_resumes_from_journal(tmp_path, fake_ollama, make_processor):
+    failing = {'第2句。'}
+
+    def reply(prompt):
+        if prompt in failing:
+            return b'not json'
+        return _classify_single(prompt)
+
+    server = fake_ollama(reply=reply)
+    processor = make_processor(server, max_retries=0)
+    input_path = tmp_path / 'a.txt'
+    input_path.write_text(''.join(f'第{i}句。' for i in range(4)), encoding='utf-8')
+    output_dir = tmp_path / 'out' / 'a'
+    output_dir.parent.mkdir()
+
+    success, _ = llm_split_sentence.process_file(str(input_path), str(output_dir), processor)
+    assert not success
+    assert not output_dir.exists()
+    journal = llm_split_sentence.journal_path(str(output_dir))
+    assert sorted(entry['key'] for entry in _read_journal(journal)[1:]) == ['1', '2']
+
+    failing.clear()
+    success, _ = llm_split_sentence.process_file(str(input_path), str(output_dir), processor)
+    assert success
+    # 上次已完成的句子不再请求第一阶段
+    assert server.prompts().count('第0句。') == server.prompts().count('第1句。') == 1
+    assert '第2句。' in server.prompts()[3:]
+    assert not os.path.exists(journal)
+    assert [(output_dir / f'{i + 1}.txt').read_text(encoding='utf-8') for i in range(4)] == [
+        f'第{i}句。' for i in range(4)]
+
+
+@pytest.mark.parametrize('sentence, expected', [
+    ('1. 拆下螺栓。', '拆下螺栓。'),
+    ('1.2. 拆下螺栓。', '拆下螺栓。'),
+    ('3、拆下螺栓。', '拆下螺栓。'),
+    ('2) 拆下螺栓。', '拆下螺栓。'),
+    ('（1）拆下螺栓。', '拆下螺栓。'),
+    ('(二)拆下螺栓。', '拆下螺栓。'),
+    ('一、拆下螺栓。', '拆下螺栓。'),
+    ('① 拆下螺栓。', '拆下螺栓。'),
+    ('- * 拆下螺栓。', '拆下螺栓。'),
+    ('## 拆下螺栓。', '拆下螺栓。'),
+    ('•拆下螺栓。', '拆下螺栓。'),
+    ('**1. 拆下螺栓**。', '拆下螺栓。'),
+    ('10 号螺栓需要更换。', '10 号螺栓需要更换。'),
+    ('1.5毫米的间隙。', '1.5毫米的间隙。'),
+    ('24V电源断开后检查。', '24V电源断开后检查。'),
+    ('-40℃时检查滑油。', '-40℃时检查滑油。'),
+    ('#3发动机停车。', '#3发动机停车。'),
+    ('一、二号发动机同时启动。', '一、二号发动机同时启动。'),
+    ('1、2号发动机同时启动。', '1、2号发动机同时启动。'),
+    ('拆下螺栓,检查垫圈.', '拆下螺栓，检查垫圈。'),
+    ('拆下螺栓，，检查垫圈，。', '拆下螺栓，检查垫圈。'),
+])
+def test_rule_clean(sentence, expected):
+    assert llm_split_sentence.rule_clean(sentence) == expected
+
+
+def test_rule_checks_send_only_unclean_sentences_to_model(fake_ollama, make_processor):
+    from tqdm import tqdm
+
+    server = fake_ollama(reply=_classify_single)
+    processor = make_processor(server)
+    with tqdm(total=125, disable=True) as progress_bar:
+        records = llm_split_sentence.process_text_iteratively(
+            '1. 拆下螺栓。\n10 号螺栓需要更换。\n- 10 号螺栓需要拆下。', processor, progress_bar)
+
+    assert [record.text for record in records] == ['拆下螺栓。', '10 号螺栓需要更换。', '- 10 号螺栓需要拆下。']
+    assert processor.counters['rule_cleaned'] == 1
+    # 只有不以中文开头的句子请求了第四阶段，发送的是规则清理前的句子
+    fourth = [prompt for prompt in server.prompts() if '文本清理专家' in prompt]
+    assert len(fourth) == 2
+    assert '10 号螺栓需要更换。' in fourth[0] and '- 10 号螺栓需要拆下。' in fourth[1]
+    assert all(stage != '第四阶段规则清理' for stage, _ in records[2].history)
+
+
+@pytest.mark.parametrize('sentence, label, confident', [
+    ('Figure 3', 'INVALID', True),
+    ('see Fig. 3 and Table 2 图', 'INVALID', True),
+    ('检查。', 'INVALID', False),
+    ('检查APU BLEED VALVE的开度。', 'SINGLE', False),
+    ('更换O-ring。', 'SINGLE', False),
+    ('拆下P/N 3214-567-89 螺栓。', 'SINGLE', False),
+    ('拆下螺栓。', 'SINGLE', True),
+    ('1. 拆下螺栓；2. 取下垫圈。', 'MULTIPLE', True),
+    ('拆下螺栓。然后安装新的密封圈。', 'MULTIPLE', True),
+])
+def test_heuristic_classifier(sentence, label, confident):
+    classifier = llm_split_sentence.StageClassifier()
+    predicted, confidence = classifier.predict(sentence)
+    assert predicted == label
+    assert (confidence >= classifier.threshold) == confident
+
+
+def test_classifier_defers_uncertain_sentences_to_model(tmp_path, fake_ollama, make_processor):
+    from tqdm import tqdm
+
+    server = fake_ollama(reply=_classify_single)
+    log_path = str(tmp_path / 'decisions.jsonl')
+    classifier = llm_split_sentence.StageClassifier(log_path=log_path)
+    processor = make_processor(server, classifier=classifier)
+    with tqdm(total=125, disable=True) as progress_bar:
+        records = llm_split_sentence.process_text_iteratively('拆下螺栓。检查。', processor, progress_bar)
+
+    assert [(record.text, record.label) for record in records] == [('拆下螺栓。', 'SINGLE'), ('检查。', 'SINGLE')]
+    assert processor.counters['local_classified'] == 1
+    classified = [prompt for prompt in server.prompts() if 'MULTIPLE' in prompt]
+    assert len(classified) == 1 and '检查。' in classified[0]
+    assert [(entry['text'], entry['source'], entry['label'], entry['local_label'])
+            for entry in _read_journal(log_path)] == [
+        ('拆下螺栓。', 'local', 'SINGLE', 'SINGLE'), ('检查。', 'llm', 'SINGLE', 'INVALID')]
+
+
+def test_classifier_trains_from_model_decisions(tmp_path):
+    log_path = str(tmp_path / 'decisions.jsonl')
+    model_path = str(tmp_path / 'model.json')
+    logger = llm_split_sentence.StageClassifier(log_path=log_path)
+    for i in range(5):
+        logger.log_decision(f'拆下第{i}个固定螺栓。', 'SINGLE', 0.5, 'llm', 'SINGLE')
+        logger.log_decision(f'拆下第{i}个螺栓，然后安装垫圈；再检查。', 'MULTIPLE', 0.5, 'llm', 'SINGLE')
+        logger.log_decision(f'欢迎订阅第{i}期。', 'INVALID', 0.9, 'local', 'INVALID')
+    assert llm_split_sentence.StageClassifier.train(log_path, model_path) == 10
+
+    classifier = llm_split_sentence.StageClassifier(model_path=model_path)
+    assert classifier.predict('拆下第7个固定螺栓。')[0] == 'SINGLE'
+    assert classifier.predict('拆下第7个螺栓，然后安装垫圈；再检查。')[0] == 'MULTIPLE'
+
+
+SPLITTER_TEXTS = [
+    '# 标题\n\n**拆下**螺栓。检查垫圈！是否损坏？\n- 安装；(1) 紧固\n\n| 表格 | 内容 |\n结束',
+    'Remove the bolt. 然后 check!  \n\n\n  最后一句没有标点',
+    bench_split.generate_corpus('mixed', 20_000, 3),
+]
+
+
+@pytest.mark.parametrize('text', SPLITTER_TEXTS, ids=['markdown', 'english', 'corpus'])
+@pytest.mark.parametrize('at_start', [True, False])
+def test_punctuation_splitter_matches_jieba(text, at_start):
+    assert (llm_split_sentence.split_sentences_by_punctuation(text, at_start)
+            == llm_split_sentence.split_sentences_with_jieba(text, at_start))
+
+
+def test_heavy_modules_are_imported_lazily():
+    code = ("import sys, llm_split_sentence; "
+            "print(sorted(m for m in ('jieba', 'requests', 'tqdm') if m in sys.modules))")
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(llm_split_sentence.__file__))).stdout
+    assert output.strip() == '[]'
+
+
+@pytest.mark.parametrize('value, expected', [(None, None), ('300', 300), ('-1', -1), (' 30m ', '30m'), (0, 0)])
+def test_parse_keep_alive(value, expected):
+    assert llm_split_sentence.parse_keep_alive(value) == expected
+
+
+def _lifecycle_posts(server):
+    return [data for method, _, data in server.requests
+            if method == 'POST' and 'prompt' not in data and 'messages' not in data]
+
+
+def test_initialize_checks_tags_and_preloads_without_generating(fake_ollama, make_processor):
+    server = fake_ollama(models=['qwen2.5-coder:7b', 'llama3:latest'])
+    processor = make_processor(server, keep_alive='30m')
+    assert processor.initialize()
+    assert server.paths('GET') == ['/api/tags']
+    assert server.prompts() == []
+    assert _lifecycle_posts(server) == [{'model': 'qwen2.5-coder:7b', 'keep_alive': '30m'}]
+
+    # 每个请求都带上keep_alive
+    processor._generate_completion('一句话。')
+    assert server.requests[-1][2]['keep_alive'] == '30m'
+
+    assert processor.lifecycle.unload()
+    assert _lifecycle_posts(server)[-1] == {'model': 'qwen2.5-coder:7b', 'keep_alive': 0}
+
+
+def test_model_without_tag_matches_latest(fake_ollama, make_processor):
+    server = fake_ollama(models=['llama3:latest'])
+    processor = make_processor(server, model='llama3')
+    assert processor.lifecycle.check_available() is None
+
+
+def test_missing_model_is_reported(fake_ollama, make_processor, capsys):
+    server = fake_ollama(models=['llama3:latest'])
+    processor = make_processor(server)
+    assert not processor.initialize()
+    assert 'ollama pull qwen2.5-coder:7b' in capsys.readouterr().out
+    assert _lifecycle_posts(server) == []
+
+
+def test_unreachable_server_is_reported(fake_ollama, make_processor):
+    server = fake_ollama()
+    server.stop()
+    processor = make_processor(server)
+    assert processor.lifecycle.check_available().startswith('无法访问Ollama服务')
+
+
+def test_failed_preload_is_reported(fake_ollama, make_processor):
+    server = fake_ollama()
+    server.statuses = [500]
+    processor = make_processor(server)
+    assert processor.lifecycle.check_available() is None
+    assert processor.lifecycle.preload().startswith('预加载模型失败')
+
+
+def test_chat_mode_sends_stable_system_messages(fake_ollama, make_processor):
+    from tqdm import tqdm
+
+    server = fake_ollama(reply=_classify_single)
+    processor = make_processor(server, api='chat', rule_cleaner=False)
+    with tqdm(total=125, disable=True) as progress_bar:
+        records = llm_split_sentence.process_text_iteratively('拆下螺栓。安装垫圈。', processor, progress_bar)
+    assert [record.text for record in records] == ['拆下螺栓。', '安装垫圈。']
+
+    messages = [data['messages'] for method, path, data in server.requests if path == '/api/chat']
+    # 每个阶段的系统消息相同，句子是唯一变化的用户消息
+    assert {tuple(message['content'] for message in m[:-1]) for m in messages} == {
+        (prompt.format(text=llm_split_sentence.CHAT_TEXT_PLACEHOLDER),)
+        for prompt in (processor.first_prompt, processor.second_prompt, processor.third_prompt,
+                       processor.fourth_prompt)}
+    assert {m[-1]['content'] for m in messages} == {'拆下螺栓。', '安装垫圈。'}
+
+    # 分类请求识别出标签后提前停止，收不到带prompt评估统计的最后一块
+    assert [(stage, count) for stage, count, _, _ in processor.prompt_eval_summary()] == [
+        ('1', 2), ('2', 2), ('3-single', 2), ('4', 2)]
+
+
+def test_chat_and_generate_produce_same_output(tmp_path, fake_ollama):
+    server = fake_ollama(reply=_pipeline_reply)
+    input_dir = tmp_path / 'in'
+    input_dir.mkdir()
+    (input_dir / 'a.txt').write_text('安装滤芯。拆下螺栓并检查。欢迎订阅本公众号。', encoding='utf-8')
+    for api in ('generate', 'chat'):
+        llm_split_sentence.process_directory(str(input_dir), str(tmp_path / api),
+                                             {'endpoints': [server.url], 'api': api})
+    assert _read_outputs(tmp_path / 'generate') == _read_outputs(tmp_path / 'chat')
+
+
+def test_endpoint_without_model_gets_no_traffic(fake_ollama, make_processor):
+    serving = fake_ollama()
+    other = fake_ollama(models=['llama3:latest'])
+    processor = make_processor(serving, other, concurrency=4)
+    assert processor.initialize()
+    processor.map_completions([f'第{i}句。' for i in range(8)])
+
+    assert len(serving.prompts()) == 8
+    assert other.paths('POST') == []
+    assert other.paths('GET') == ['/api/tags']
+
+
+def test_down_endpoint_is_ejected_and_rejoins(fake_ollama, make_processor, monkeypatch):
+    first = fake_ollama()
+    second = fake_ollama()
+    processor = make_processor(first, second, eject_time=0.2)
+    sleeps = []
+    monkeypatch.setattr(llm_split_sentence.time, 'sleep', sleeps.append)
+    assert processor.pool.check_all() == 2
+
+    second.stop()
+    for i in range(4):
+        assert processor._generate_completion(f'第{i}句。') == f'第{i}句。'
+    # 失败的请求立即换到另一个服务重试，不退避；之后不再发给已移出轮换的服务
+    assert sleeps == []
+    assert first.prompts() == [f'第{i}句。' for i in range(4)]
+    assert processor.pool.endpoints[1].ejected_until > 0
+
+    second.start()
+    monkeypatch.undo()
+    time.sleep(0.3)
+    for i in range(4, 8):
+        processor._generate_completion(f'第{i}句。')
+    # 到期后先通过 /api/tags 确认恢复，再重新分到请求
+    assert second.paths('GET') == ['/api/tags', '/api/tags']
+    assert processor.pool.endpoints[1].ejected_until == 0
+    assert second.prompts()[0] == '第4句。'
+
+
+def test_recovery_probe_of_hanging_endpoint_is_short(fake_ollama, make_processor, monkeypatch):
+    # 接受连接但从不响应的服务
+    monkeypatch.setattr(llm_split_sentence, 'HEALTH_CHECK_TIMEOUT', 0.2)
+    hanging = socket.socket()
+    hanging.bind(('127.0.0.1', 0))
+    hanging.listen()
+    try:
+        server = fake_ollama()
+        processor = make_processor(server, types.SimpleNamespace(url=f'http://127.0.0.1:{hanging.getsockname()[1]}'),
+                                   read_timeout=10)
+        good, bad = processor.pool.endpoints
+        assert processor.pool.check(good)
+        bad.models = good.models
+        bad.ejected_until = time.monotonic() - 1
+
+        start = time.perf_counter()
+        endpoint = processor.pool.acquire(processor.model)
+        assert time.perf_counter() - start < 2
+        assert endpoint is good and bad.ejected_until > time.monotonic()
+        processor.pool.release(endpoint)
+    finally:
+        hanging.close()
+
+
+def test_least_outstanding_with_round_robin_ties(fake_ollama, make_processor):
+    servers = [fake_ollama() for _ in range(3)]
+    processor = make_processor(*servers)
+    pool = processor.pool
+    model = processor.model
+
+    # 正在进行的请求数相同时轮流选择
+    for i in range(6):
+        processor._generate_completion(f'第{i}句。')
+    assert [len(server.prompts()) for server in servers] == [2, 2, 2]
+
+    # 选择正在进行的请求最少的服务
+    busy = [pool.acquire(model) for _ in range(3)]
+    assert len({endpoint.url for endpoint in busy}) == 3
+    pool.release(busy[1])
+    assert pool.acquire(model) is busy[1]
+    extra = pool.acquire(model)
+    assert extra.outstanding == 2 and extra is not busy[1]
+
+
+def test_single_endpoint_backs_off_as_before(fake_ollama, make_processor, monkeypatch):
+    server = fake_ollama()
+    server.statuses = [503] * 3
+    processor = make_processor(server, max_retries=3, backoff=1.0)
+    assert processor.pool.check_all() == 1
+    sleeps = []
+    monkeypatch.setattr(llm_split_sentence.time, 'sleep', sleeps.append)
+    monkeypatch.setattr(llm_split_sentence.random, 'random', lambda: 0.5)
+
+    assert processor._generate_completion('一句话。') == '一句话。'
+    assert sleeps == [1.0, 2.0, 4.0]
+    # 唯一的服务被移出轮换后仍然收到全部重试，不做健康检查
+    assert len(server.prompts()) == 4
+    assert server.paths('GET') == ['/api/tags']
+
+
+def _run_scheduler(scheduler, costs, latency):
+    """按短作业优先提交请求，每个请求在工作线程中记录latency(序号, cost)的延迟"""
+    def request(index, cost):
+        scheduler.record('2', latency(index, cost))
+
+    futures = [scheduler.submit(cost, request, index, cost) for index, cost in enumerate(costs)]
+    for future in futures:
+        future.result()
+    scheduler.shutdown()
+
+
+def test_adaptive_limit_survives_growing_prompts():
+    # 短作业优先时prompt越来越长，延迟与prompt长度成正比，不是过载
+    scheduler = llm_split_sentence.RequestScheduler(8, adaptive=True)
+    costs = [10 + i * 25 for i in range(400)]
+    _run_scheduler(scheduler, costs, lambda index, cost: cost * 0.001)
+    assert scheduler.limit_range[0] == 8 and int(scheduler.limit) == 8
+
+
+def test_adaptive_limit_decreases_on_overload():
+    # 同样长度的prompt，延迟从某个时刻起变为5倍
+    scheduler = llm_split_sentence.RequestScheduler(8, adaptive=True)
+    _run_scheduler(scheduler, [200] * 200, lambda index, cost: cost * 0.001 * (5 if index >= 50 else 1))
+    assert int(scheduler.limit) < 8
+
+
+def test_adaptive_concurrency_has_default_ceiling(fake_ollama, make_processor):
+    servers = [fake_ollama() for _ in range(2)]
+    assert make_processor(*servers).scheduler.max_limit == 1
+    processor = make_processor(*servers, adaptive_concurrency=True)
+    assert processor.scheduler.max_limit == 2 * llm_split_sentence.ADAPTIVE_CONCURRENCY_PER_ENDPOINT
+    assert make_processor(*servers, concurrency=4, adaptive_concurrency=True).scheduler.max_limit == 4
+
+
+def test_adaptive_concurrency_rejects_ceiling_of_one(monkeypatch, capsys):
+    monkeypatch.setattr(sys, 'argv', ['llm_split_sentence.py', '--adaptive-concurrency', '--concurrency', '1'])
+    with pytest.raises(SystemExit) as error:
+        llm_split_sentence.main()
+    assert error.value.code == 2
+    assert '--concurrency' in capsys.readouterr().err
+
+
+def test_server_parallelism_counts_only_local_endpoints(monkeypatch):
+    monkeypatch.setenv('OLLAMA_NUM_PARALLEL', '4')
+    assert llm_split_sentence.server_parallelism(['localhost:11434', 'http://127.0.0.1:11435']) == 8
+    assert llm_split_sentence.server_parallelism(['localhost:11434', 'http://gpu1:11434']) == 4
+    assert llm_split_sentence.server_parallelism(['http://gpu1:11434', 'gpu2:11434']) is None
+    monkeypatch.delenv('OLLAMA_NUM_PARALLEL')
+    assert llm_split_sentence.server_parallelism(['localhost:11434']) is None
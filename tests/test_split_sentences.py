@@ -0,0 +1,181 @@
+import os
+
+import pytest
+
+import bench_split
+import split_sentences
+
+# 只有一种内容类型的文件及原先整篇判断类型时的分句结果
+SINGLE_TYPE_CASES = [
+    ("文件操作：\n\nUp Arrow 向上移动一行\nDown Arrow 向下移动一行\nF1 打开帮助\n",
+     ['文件操作 - Up Arrow 向上移动一行', '文件操作 - Down Arrow 向下移动一行', '文件操作 - F1 打开帮助']),
+    ("编辑：\nCtrl - C 复制\nCtrl - V 粘贴\n\n视图：\nF5 刷新\nF11 全屏显示\n",
+     ['编辑 - Ctrl - C 复制', '编辑 - Ctrl - V 粘贴', '视图 - F5 刷新', '视图 - F11 全屏显示']),
+    ("基本指令：\n\n复制文本 CTRL+C\n粘贴文本 CTRL+V\n\n窗口指令：\n切换窗口 ALT+TAB\n关闭窗口 (ESC键)\n",
+     ['基本指令 - 复制文本 - CTRL+C', '基本指令 - 粘贴文本 - CTRL+V',
+      '窗口指令 - 切换窗口 - ALT+TAB', '窗口指令 - 关闭窗口 - (ESC键)']),
+    ("词典\n\naircraft 英音：[ˈeəkrɑːft]美音：[ˈerkræft] 名词 n. 飞机\n\n"
+     "engine 英音：[ˈendʒɪn]美音：[ˈendʒɪn] 名词 n. 发动机\n\nrotor 旋翼\n",
+     ['aircraft - 飞机', 'engine - 发动机', 'rotor - 旋翼']),
+    ("\n=== 表格开始 ===\n1. 拆下螺栓 | 2. 检查密封圈\n3. 安装盖板 | 4. 拧紧螺母\n=== 表格结束 ===\n\n",
+     ['1. 拆下螺栓', '2. 检查密封圈', '3. 安装盖板', '4. 拧紧螺母']),
+    ("拆下燃油喷嘴。检查密封圈是否完好！\n\n安装盖板；拧紧螺栓？最后一段没有标点",
+     ['拆下燃油喷嘴。', '检查密封圈是否完好！', '安装盖板；', '拧紧螺栓？']),
+]
+
+
+@pytest.mark.parametrize('text, expected', SINGLE_TYPE_CASES)
+def test_single_type_files_match_whole_file_classification(text, expected):
+    assert split_sentences.split_sentences(text) == expected
+
+
+def test_mixed_document_uses_strategy_per_block():
+    text = ("本章介绍发动机的拆装。\n\n"
+            "\n=== 表格开始 ===\n1. 拆下螺栓 | 2. 检查密封圈\n=== 表格结束 ===\n\n"
+            "拆装完成后进行试车。\n\n"
+            "复制 CTRL+C\n粘贴 CTRL+V\n")
+    records = list(split_sentences.iter_sentence_records(text))
+    assert [(sentence, content_type) for sentence, content_type, _, _ in records] == [
+        ('本章介绍发动机的拆装。', 'normal'),
+        ('1. 拆下螺栓', 'table'),
+        ('2. 检查密封圈', 'table'),
+        ('拆装完成后进行试车。', 'normal'),
+        ('复制 - CTRL+C', 'command'),
+        ('粘贴 - CTRL+V', 'command'),
+    ]
+
+
+def test_prose_with_single_feature_stays_normal():
+    # 正文中的方括号、功能键编号只命中1个特征，不能沿用附录的类型而被丢弃或不再分句
+    prose = ['从[燃油喷嘴](20)上拆下[余油管]。', '检查密封圈是否完好。',
+             '按F16键进入自检页面。', '确认各项指示正常。']
+    text = (f"{prose[0]}{prose[1]}\n\n{prose[2]}{prose[3]}\n\n"
+            "附录A 词汇表\n\naircraft 英音：[ˈeəkrɑːft]美音：[ˈerkræft] 名词 n. 飞机\n\n"
+            "engine 英音：[ˈendʒɪn]美音：[ˈendʒɪn] 名词 n. 发动机\n\nrotor 旋翼\n\n"
+            "附录B 键盘操作\n\nUp Arrow 向上移动一行\nDown Arrow 向下移动一行\nF1 打开帮助\n")
+    records = [(sentence, content_type) for sentence, content_type, _, _
+               in split_sentences.iter_sentence_records(text)]
+    assert records[:4] == [(sentence, 'normal') for sentence in prose]
+    assert ('aircraft - 飞机', 'dictionary') in records
+    assert ('F1 打开帮助', 'operation') in records
+
+
+def test_record_offsets_point_into_the_source_text():
+    text = "第一句。第二句！\n\n复制 CTRL+C\n粘贴 CTRL+V\n"
+    for sentence, content_type, start, end in split_sentences.iter_sentence_records(text):
+        if content_type == 'normal':
+            assert text[start:end] == sentence
+        else:
+            assert sentence.split(' - ')[0] in text[start:end]
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_sentence_store_round_trip(tmp_path, compress):
+    text = "第一句。第二句！\n\n复制 CTRL+C\n粘贴 CTRL+V\n"
+    records = list(split_sentences.iter_sentence_records(text))
+    store_path = split_sentences.sentence_store_path(str(tmp_path), 'a', compress)
+    assert store_path.endswith('.jsonl.gz' if compress else '.jsonl')
+
+    count = split_sentences.write_sentence_store(iter(records), store_path, 'a.txt')
+    stored = list(split_sentences.iter_sentence_store(store_path))
+
+    assert count == len(records) == len(stored)
+    assert [record['id'] for record in stored] == list(range(1, count + 1))
+    assert [(record['text'], record['type'], record['start'], record['end']) for record in stored] == [
+        (sentence.strip(), content_type, start, end) for sentence, content_type, start, end in records]
+
+
+@pytest.mark.parametrize('compress', [False, True])
+@pytest.mark.parametrize('stream', [False, True])
+def test_split_file_writes_readable_store(tmp_path, compress, stream):
+    input_path = tmp_path / 'a.txt'
+    input_path.write_text("第一句。第二句！\n\n第三句。\n", encoding='utf-8')
+    out = tmp_path / 'out'
+    out.mkdir()
+
+    count, store_path, error = split_sentences.split_file(str(input_path), str(out), 'jsonl', compress, stream)
+
+    assert error is None and count == 3
+    assert store_path.endswith('.jsonl.gz' if compress else '.jsonl')
+    assert [record['text'] for record in split_sentences.iter_sentence_store(store_path)] == [
+        '第一句。', '第二句！', '第三句。']
+    assert [p.name for p in out.iterdir()] == [os.path.basename(store_path)]
+
+
+def test_split_and_save_with_compressed_store(tmp_path):
+    (tmp_path / 'in').mkdir()
+    for i in range(2):
+        (tmp_path / 'in' / f'{i}.txt').write_text(f"第{i}个文件。\n", encoding='utf-8')
+    split_sentences.split_and_save(str(tmp_path / 'in'), str(tmp_path / 'out'), 'jsonl', True, workers=2)
+    for i in range(2):
+        store = list(split_sentences.iter_sentence_store(str(tmp_path / 'out' / f'{i}.jsonl.gz')))
+        assert [record['text'] for record in store] == [f'第{i}个文件。']
+
+
+def test_split_file_replaces_previous_directory_output(tmp_path):
+    input_path = tmp_path / 'a.txt'
+    out = tmp_path / 'out'
+    out.mkdir()
+    input_path.write_text("第一句。第二句。第三句。\n", encoding='utf-8')
+    split_sentences.split_file(str(input_path), str(out))
+    input_path.write_text("只有一句。\n", encoding='utf-8')
+    split_sentences.split_file(str(input_path), str(out))
+
+    assert sorted(p.name for p in (out / 'a').iterdir()) == ['0.txt', '1.txt']
+    assert sorted(p.name for p in out.iterdir()) == ['a']
+
+
+def test_remove_stale_outputs(tmp_path):
+    (tmp_path / '.a.123.tmp').mkdir()
+    (tmp_path / '.b.jsonl.123.tmp').write_text('', encoding='utf-8')
+    (tmp_path / 'keep.txt').write_text('', encoding='utf-8')
+    split_sentences.remove_stale_outputs(str(tmp_path))
+    assert [p.name for p in tmp_path.iterdir()] == ['keep.txt']
+
+
+def _chunks(text, size):
+    return (text[i:i + size] for i in range(0, len(text), size))
+
+
+@pytest.mark.parametrize('name', sorted(bench_split.BENCHMARKS))
+def test_stream_matches_whole_text(name):
+    text = bench_split.generate_corpus(name, 100_000, 1)
+    records = list(split_sentences.iter_sentence_records_stream(_chunks(text, 1000), window_size=4096))
+    assert records == list(split_sentences.iter_sentence_records(text))
+
+
+# 没有空行和句末标点的长文本、未闭合的超大表格
+UNCUTTABLE_TEXTS = [
+    '没有标点的一整行' * 5000,
+    '没有标点的一行\n' * 5000,
+    '=== 表格开始 ===\n' + '1. 第一项 | 2. 第二项\n' * 5000,
+]
+
+
+@pytest.mark.parametrize('text', UNCUTTABLE_TEXTS, ids=['line', 'lines', 'table'])
+def test_find_window_cut_forces_cut_past_limit(text):
+    window_size = 1024
+    limit = window_size * split_sentences.FORCE_CUT_FACTOR
+    assert split_sentences.find_window_cut(text[:limit - 1], window_size) == 0
+    cut = split_sentences.find_window_cut(text[:limit + 100], window_size)
+    assert 0 < cut <= limit + 100
+    if '\n' in text[:limit + 100]:
+        assert text[cut - 1] == '\n'
+
+
+@pytest.mark.parametrize('text', UNCUTTABLE_TEXTS, ids=['line', 'lines', 'table'])
+def test_stream_buffer_is_bounded(monkeypatch, text):
+    window_size = 1024
+    windows = []
+    iter_sentence_records = split_sentences.iter_sentence_records
+
+    def recording(window):
+        windows.append(window)
+        return iter_sentence_records(window)
+
+    monkeypatch.setattr(split_sentences, 'iter_sentence_records', recording)
+    list(split_sentences.iter_sentence_records_stream(_chunks(text, 256), window_size))
+
+    assert len(windows) > 1
+    assert max(map(len, windows)) < window_size * split_sentences.FORCE_CUT_FACTOR + 256
+    assert ''.join(windows) == text